@@ -7,18 +7,9 @@ from pydantic import BaseModel, Field
 from app.core.config import settings
 from app.core.logger import logger
 from app.services.api_key_manager import api_key_manager
-
-# 根据配置选择 SSO 管理器
-if settings.REDIS_ENABLED:
-    from app.services.redis_sso_manager import create_sso_manager
-    sso_manager = create_sso_manager(
-        use_redis=True,
-        redis_url=settings.REDIS_URL,
-        strategy=settings.SSO_ROTATION_STRATEGY,
-        daily_limit=settings.SSO_DAILY_LIMIT
-    )
-else:
-    from app.services.sso_manager import sso_manager
+from app.services.grok_client import grok_client, sso_manager
+from app.services.image_store import image_store
+from app.services.surplus_pool import surplus_pool
 
 router = APIRouter()
 
@@ -76,6 +67,11 @@ async def get_status():
         "service": "running",
         "sso": sso_status,
         "proxy": proxy_config if proxy_config else "none",
+        "connection_pool": grok_client.get_pool_stats(),
+        "ws_pool": grok_client.get_ws_pool_stats(),
+        "hedge": grok_client.get_hedge_stats(),
+        "image_store": image_store.get_stats(),
+        "surplus_pool": surplus_pool.get_stats(),
         "config": {
             "host": settings.HOST,
             "port": settings.PORT,
@@ -102,11 +98,11 @@ async def reload_sso():
 
 @router.post("/sso/reset-usage")
 async def reset_sso_usage():
-    """手动重置每日使用量（仅 Redis 模式）"""
+    """手动清空所有 SSO 的使用记录"""
     if hasattr(sso_manager, 'reset_daily_usage'):
         await sso_manager.reset_daily_usage()
-        logger.info("[Admin] 手动重置每日使用量")
-        return {"success": True, "message": "每日使用量已重置"}
+        logger.info("[Admin] 手动重置使用量")
+        return {"success": True, "message": "使用量已重置"}
     return {"success": False, "message": "该功能仅在 Redis 模式下可用"}
 
 
@@ -188,6 +188,12 @@ async def chat_completions(
         await api_key_manager.record_usage(api_key.key)
 
     if not result.get("success"):
+        if result.get("error_code") == "no_available_sso":
+            raise HTTPException(
+                status_code=429,
+                detail=result["error"],
+                headers={"Retry-After": str(result["retry_after"])}
+            )
         raise HTTPException(
             status_code=500,
             detail=result.get("error", "Image generation failed")
@@ -226,7 +232,7 @@ async def stream_chat_generate(
     api_key = None
 ):
     """
-    流式生成图片，输出思考进度和最终 URL
+    流式生成图片，输出思考进度，每张最终图片落盘后立即输出其 URL
 
     进度映射:
     - preview (预览): 33%
@@ -245,6 +251,13 @@ async def stream_chat_generate(
     # 记录每张图片的最新阶段，避免重复输出
     image_stages: Dict[str, str] = {}
     final_urls: List[str] = []
+    sent_urls: List[str] = []  # 已输出到内容中的图片 URL
+
+    def image_content(url: str) -> str:
+        """单张图片的 Markdown 内容，首张前附带标题"""
+        header = "" if sent_urls else "已为您生成图片：\n\n"
+        sent_urls.append(url)
+        return f"{header}![图片{len(sent_urls)}]({url})\n\n"
 
     try:
         # 开始思考
@@ -288,6 +301,11 @@ async def stream_chat_generate(
                         thinking_progress=progress
                     )
 
+                # 最终图片已落盘，立即输出
+                url = item.get("url")
+                if url and url not in sent_urls:
+                    yield create_chat_chunk(chunk_id, content=image_content(url))
+
             elif item.get("type") == "result":
                 if item.get("success"):
                     final_urls = item.get("urls", [])
@@ -303,12 +321,12 @@ async def stream_chat_generate(
                         thinking_progress=100
                     )
 
-                    # 输出最终内容 - 使用 Markdown 图片格式
-                    content = "已为您生成图片：\n\n"
-                    for i, url in enumerate(final_urls, 1):
-                        content += f"![图片{i}]({url})\n\n"
-
-                    yield create_chat_chunk(chunk_id, content=content)
+                    # 输出尚未推送的图片 - 使用 Markdown 图片格式
+                    content = "".join(
+                        image_content(url) for url in final_urls if url not in sent_urls
+                    )
+                    if content:
+                        yield create_chat_chunk(chunk_id, content=content)
 
                 else:
                     # 错误
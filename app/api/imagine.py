@@ -27,7 +27,7 @@ class OpenAIImageRequest(BaseModel):
     """OpenAI 兼容的图片生成请求"""
     prompt: str = Field(..., description="图片描述提示词", min_length=1)
     model: Optional[str] = Field("grok-2-image", description="模型名称")
-    n: Optional[int] = Field(4, description="生成数量", ge=1, le=4)
+    n: Optional[int] = Field(4, description="生成数量（超过 4 张时拆分为多个会话并发生成）", ge=1, le=settings.IMAGE_MAX_N)
     size: Optional[str] = Field("1024x1536", description="图片尺寸")
     response_format: Optional[str] = Field("url", description="响应格式: url 或 b64_json")
     stream: Optional[bool] = Field(False, description="是否流式返回进度")
@@ -147,13 +147,14 @@ async def generate_image(
             media_type="text/event-stream"
         )
 
-    # 普通模式
-    result = await grok_client.generate(
+    # 普通模式（仅在需要 b64_json 时生成 base64 数据，n > 4 时拆分为多个会话）
+    result = await grok_client.generate_batch(
         prompt=request.prompt,
         aspect_ratio=aspect_ratio,
         n=request.n,
         enable_nsfw=True,
-        sso=sso
+        sso=sso,
+        return_b64=request.response_format == "b64_json"
     )
 
     # 记录使用
@@ -166,6 +167,12 @@ async def generate_image(
 
         if error_code == "rate_limit_exceeded":
             raise HTTPException(status_code=429, detail=error_msg)
+        elif error_code == "no_available_sso":
+            raise HTTPException(
+                status_code=429,
+                detail=error_msg,
+                headers={"Retry-After": str(result["retry_after"])}
+            )
         else:
             raise HTTPException(status_code=500, detail=error_msg)
 
@@ -189,9 +196,9 @@ async def stream_generate(prompt: str, aspect_ratio: str, n: int, sso: Optional[
     流式生成图片
 
     SSE 格式输出:
-    - event: progress - 生成进度更新
+    - event: progress - 生成进度更新（最终图片落盘后即带有 url）
     - event: complete - 生成完成，包含最终 URL
-    - event: error - 发生错误
+    - event: error - 发生错误（没有可用 SSO 时附带 retry_after 秒数）
     """
     try:
         async for item in grok_client.generate_stream(
@@ -205,8 +212,10 @@ async def stream_generate(prompt: str, aspect_ratio: str, n: int, sso: Optional[
                 # 进度更新
                 event_data = {
                     "image_id": item["image_id"],
+                    "job": item.get("job", 0),
                     "stage": item["stage"],
                     "is_final": item["is_final"],
+                    "url": item.get("url") or None,
                     "completed": item["completed"],
                     "total": item["total"],
                     "progress": f"{item['completed']}/{item['total']}"
@@ -227,6 +236,8 @@ async def stream_generate(prompt: str, aspect_ratio: str, n: int, sso: Optional[
                     yield f"event: complete\ndata: {json.dumps(result_data)}\n\n"
                 else:
                     error_data = {"error": item.get("error", "Generation failed")}
+                    if item.get("retry_after"):
+                        error_data["retry_after"] = item["retry_after"]
                     yield f"event: error\ndata: {json.dumps(error_data)}\n\n"
                 break
 
@@ -342,6 +353,12 @@ async def edit_image(
 
         if error_code == "rate_limit_exceeded":
             raise HTTPException(status_code=429, detail=error_msg)
+        elif error_code == "no_available_sso":
+            raise HTTPException(
+                status_code=429,
+                detail=error_msg,
+                headers={"Retry-After": str(result["retry_after"])}
+            )
         else:
             raise HTTPException(status_code=500, detail=error_msg)
 
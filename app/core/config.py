@@ -40,21 +40,71 @@ class Settings(BaseSettings):
     # 图片存储 (可选, 用于缓存)
     IMAGES_DIR: Path = ROOT_DIR / "data" / "images"
     BASE_URL: Optional[str] = None  # 用于生成图片URL，不设置则自动使用 HOST:PORT
+    IMAGE_WRITER_WORKERS: int = 4  # 图片解码/写入线程数
 
     # 生成配置
     DEFAULT_ASPECT_RATIO: str = "2:3"  # 默认宽高比
     GENERATION_TIMEOUT: int = 120  # 生成超时(秒)
+    GENERATION_BLOCKED_TIMEOUT: float = 15  # 收到 medium 后仍无 final 判定 blocked 的时间(秒)
+    GENERATION_IDLE_TIMEOUT: float = 10  # 已有部分图片后无新消息即结束的时间(秒)
+    IMAGE_MAX_N: int = 32  # 单次请求最多生成的图片数（超过 4 张时拆分为多个会话）
+    BATCH_MAX_PARALLEL: int = 4  # 批量生成时同时进行的会话数
+
+    # 对冲请求配置（首个预览迟迟不到时，在另一个 SSO 上并行发起请求）
+    HEDGE_ENABLED: bool = False  # 是否启用对冲请求
+    HEDGE_PERCENTILE: float = 90  # 对冲延迟取首个预览耗时的分位数
+    HEDGE_MIN_SAMPLES: int = 20  # 样本少于该数量时使用默认延迟
+    HEDGE_DEFAULT_DELAY: float = 15  # 默认对冲延迟(秒)
+    HEDGE_MIN_DELAY: float = 3  # 对冲延迟下限(秒)
+    HEDGE_MAX_DELAY: float = 60  # 对冲延迟上限(秒)
+
+    # 多余图片池配置（n < 4 时保留同一会话多生成的图片，供相同请求复用）
+    SURPLUS_ENABLED: bool = False  # 是否启用多余图片池
+    SURPLUS_TTL: int = 600  # 多余图片保留时间(秒)
+    SURPLUS_MAX_IMAGES: int = 200  # 池中最多保留的图片数
+    SURPLUS_HARVEST_WAIT: float = 5  # 收够 n 张后继续等待其余图片的最长时间(秒)
 
     # Grok 官方 WebSocket 地址 (固定值，无需配置)
     GROK_WS_URL: str = "wss://grok.com/ws/imagine/listen"
 
+    # WebSocket 连接池配置
+    WS_POOL_ENABLED: bool = True  # 是否复用 WebSocket 连接
+    WS_POOL_MAX_PER_SSO: int = 2  # 每个 SSO 最多保留的空闲连接数
+    WS_POOL_IDLE_TIMEOUT: int = 120  # 空闲连接回收时间(秒)
+    WS_POOL_MAX_AGE: int = 600  # 连接最长存活时间(秒)
+    WS_MAX_STREAMS_PER_CONN: int = 1  # 帧带 requestId 时单条连接上同时进行的请求数 (1 表示不多路复用)
+
     # Redis 配置 (用于 SSO 轮询状态持久化)
     REDIS_ENABLED: bool = False  # 是否启用 Redis
     REDIS_URL: str = "redis://localhost:6379/0"  # Redis 连接 URL
+    REDIS_TIMEOUT: float = 0.5  # 单次 Redis 操作的超时(秒)，也是连接池用满时等待空闲连接的上限
+    REDIS_CONNECT_TIMEOUT: float = 1.0  # 建立 Redis 连接的超时(秒)
+    REDIS_MAX_CONNECTIONS: int = 50  # Redis 连接池大小
+    REDIS_FAILURE_THRESHOLD: int = 3  # REDIS_RETRY_INTERVAL 秒内 Redis 失败达到该次数后切换为本地记账
+    REDIS_RETRY_INTERVAL: float = 10.0  # 统计 Redis 失败次数的时间窗口(秒)，也是降级期间试探 Redis 是否恢复的间隔
+    REDIS_FALLBACK_QUOTA_RATIO: float = 0.5  # 降级期间每个实例可使用的单 key 配额比例 (相对 SSO_DAILY_LIMIT)
+    REDIS_CACHE_TTL: float = 2.0  # 本地缓存熔断状态和使用统计的最长时间(秒)，熔断变化经 pub/sub 立即失效 (0 表示不缓存)
 
     # SSO 轮询配置
-    SSO_ROTATION_STRATEGY: str = "hybrid"  # 轮询策略: round_robin/least_used/least_recent/weighted/hybrid
+    SSO_ROTATION_STRATEGY: str = "hybrid"  # 轮询策略: round_robin/least_used/least_recent/weighted/hybrid/latency
     SSO_DAILY_LIMIT: int = 10  # 每个 key 每24小时限制次数
+    SSO_QUOTA_WINDOW: int = 86400  # 配额滑动窗口长度(秒)，每次使用在该时长后单独恢复
+    SSO_MAX_INFLIGHT: int = 2  # 每个 key 同时进行的生成数上限 (0 表示不限制)
+    SSO_BREAKER_COOLDOWN_AUTH: int = 1800  # SSO 失效后的基础冷却时间(秒)
+    SSO_BREAKER_COOLDOWN_RATE_LIMIT: int = 300  # 被限流后的基础冷却时间(秒)
+    SSO_BREAKER_COOLDOWN_BLOCKED: int = 60  # blocked 后的基础冷却时间(秒)
+    SSO_BREAKER_COOLDOWN_NETWORK: int = 30  # 网络错误熔断后的基础冷却时间(秒)
+    SSO_BREAKER_MAX_COOLDOWN: int = 3600  # 连续失败时冷却时间加倍的上限(秒)
+    SSO_BREAKER_NETWORK_THRESHOLD: int = 3  # 连续网络错误达到该次数才熔断
+    SSO_TELEMETRY_ALPHA: float = 0.2  # 每个 key 延迟/错误率 EWMA 的平滑系数 (越大越偏重最近的请求)
+    SSO_LATENCY_SAMPLES: int = 8  # latency 策略每次按剩余配额抽样比较的候选 key 数
+    SSO_ADMISSION_WAIT: float = 10.0  # 没有可用 SSO 时请求排队等待的上限(秒)，超时返回 429 (0 表示不等待)
+    SSO_ADMISSION_MAX_QUEUE: int = 100  # 同时排队等待 SSO 的请求数上限，超出直接返回 429
+    SSO_RELOAD_INTERVAL: float = 5.0  # 检查 SSO 文件变化的间隔(秒)，变化时增量加载 (0 表示不监视)
+    SSO_LOCK_SHARDS: int = 8  # Redis 模式 latency 策略下 key 池的分片数，每次选择脚本只检查一个分片的 key，并发请求从不同分片开始
+    SSO_JOURNAL_FLUSH_INTERVAL: float = 1.0  # 状态日志刷盘间隔(秒)
+    SSO_JOURNAL_FLUSH_BATCH: int = 100  # 缓冲记录达到该数量时立即刷盘
+    SSO_JOURNAL_COMPACT_RECORDS: int = 10000  # 日志记录超过该数量时压缩为快照
 
     # 中转站配置（新增）
     RELAY_ENABLED: bool = False  # 是否启用中转站模式
@@ -131,21 +181,98 @@ SSO_FILE=key.txt
 # 注意: 如果不设置 BASE_URL，会自动根据 HOST:PORT 生成
 # 如果通过反向代理或域名访问，填写实际的外部访问地址
 # BASE_URL=http://your-domain.com
+# 图片解码/写入线程数（在线程池中落盘，不阻塞事件循环）
+# IMAGE_WRITER_WORKERS=4
 
 # ============ 生成配置 ============
 DEFAULT_ASPECT_RATIO=2:3
 GENERATION_TIMEOUT=120
+# 收到 medium 后仍无 final 判定 blocked 的时间(秒)
+# GENERATION_BLOCKED_TIMEOUT=15
+# 已有部分图片后无新消息即结束的时间(秒)
+# GENERATION_IDLE_TIMEOUT=10
+# 单次请求最多生成的图片数（超过 4 张时拆分到多个 SSO 并发生成）
+# IMAGE_MAX_N=32
+# 批量生成时同时进行的会话数
+# BATCH_MAX_PARALLEL=4
+
+# ============ 对冲请求 ============
+# 首个预览在延迟内未到达时，在另一个 SSO 上并行发起请求，先完成者胜出
+# 延迟取历史首个预览耗时的分位数，只对胜出的 SSO 记录使用次数
+# HEDGE_ENABLED=false
+# HEDGE_PERCENTILE=90
+# HEDGE_DEFAULT_DELAY=15
+# HEDGE_MIN_DELAY=3
+# HEDGE_MAX_DELAY=60
+
+# ============ 多余图片池 ============
+# n < 4 时继续接收同一会话的其余图片，供相同提示词/宽高比的后续请求直接返回
+# SURPLUS_ENABLED=false
+# SURPLUS_TTL=600
+# SURPLUS_MAX_IMAGES=200
+# SURPLUS_HARVEST_WAIT=5
+
+# ============ WebSocket 连接池 ============
+# 按 SSO 复用预热的 WebSocket 连接，减少每次生成的连接耗时
+# WS_POOL_ENABLED=true
+# WS_POOL_MAX_PER_SSO=2
+# WS_POOL_IDLE_TIMEOUT=120
+# WS_POOL_MAX_AGE=600
+# 服务端帧带 requestId 时单条连接上同时进行的请求数 (1 表示不多路复用)
+# 收到不带 requestId 的帧后该连接自动退回只承载一个请求
+# WS_MAX_STREAMS_PER_CONN=1
 
 # ============ Redis 配置 ============
 # 启用 Redis 后，SSO 状态将持久化，支持分布式部署
 # REDIS_ENABLED=true
 # REDIS_URL=redis://localhost:6379/0
+# 本地缓存熔断状态和使用统计的最长时间(秒)，其他实例的熔断变化通过 pub/sub 立即失效 (0 表示不缓存)
+# REDIS_CACHE_TTL=2
+# 单次操作超时(秒)、连接超时(秒)、连接池大小
+# REDIS_TIMEOUT=0.5
+# REDIS_CONNECT_TIMEOUT=1.0
+# REDIS_MAX_CONNECTIONS=50
+# 多少秒内失败多少次后降级为本地记账（该间隔同时也是降级期间试探恢复的间隔）、降级期间单 key 配额比例
+# REDIS_FAILURE_THRESHOLD=3
+# REDIS_RETRY_INTERVAL=10
+# REDIS_FALLBACK_QUOTA_RATIO=0.5
 
 # ============ SSO 轮询配置 ============
 # 轮询策略: round_robin(简单轮询) / least_used(最少使用) / least_recent(最久未用) / weighted(权重) / hybrid(混合推荐)
+#          / latency(延迟感知，按实时遥测优先快速、健康的 key)
 # SSO_ROTATION_STRATEGY=hybrid
 # 每个 key 每24小时限制调用次数
 # SSO_DAILY_LIMIT=10
+# 配额滑动窗口长度(秒)：每个 key 的每次使用在该时长后单独恢复，而不是所有 key 同时重置
+# SSO_QUOTA_WINDOW=86400
+# 每个 key 同时进行的生成数上限，避免突发请求集中到同一个 key 触发限流 (0 表示不限制)
+# SSO_MAX_INFLIGHT=2
+# 熔断器：失败的 key 冷却后以单个试探请求恢复，连续失败时冷却时间加倍（不超过上限）
+# 各类失败的基础冷却时间(秒)：SSO 失效 / 限流 / blocked / 网络错误
+# SSO_BREAKER_COOLDOWN_AUTH=1800
+# SSO_BREAKER_COOLDOWN_RATE_LIMIT=300
+# SSO_BREAKER_COOLDOWN_BLOCKED=60
+# SSO_BREAKER_COOLDOWN_NETWORK=30
+# SSO_BREAKER_MAX_COOLDOWN=3600
+# 连续网络错误（超时、连接失败）达到该次数才熔断，避免本地代理抖动误伤 key
+# SSO_BREAKER_NETWORK_THRESHOLD=3
+# 遥测：每个 key 的首帧耗时、完成耗时、blocked 率、错误率按 EWMA 平滑的系数
+# SSO_TELEMETRY_ALPHA=0.2
+# latency 策略每次按剩余配额抽样的候选数，从中选预计成功率/耗时最优的 key
+# SSO_LATENCY_SAMPLES=8
+# 准入队列：没有可用 SSO 时按到达顺序排队，有 key 释放、冷却结束或配额恢复立即分配
+# 等待上限(秒)与排队请求数上限，超出返回 429 并在 Retry-After 中给出预计恢复时间 (等待上限为 0 表示不排队)
+# SSO_ADMISSION_WAIT=10
+# SSO_ADMISSION_MAX_QUEUE=100
+# 每隔多少秒检查 SSO 文件是否变化，变化时只加载新增和删除的 key，已有 key 的使用统计保持不变 (0 表示不监视)
+# SSO_RELOAD_INTERVAL=5
+# Redis 模式 latency 策略下将 key 池分为多少个分片（每次选择只检查分片内的 key，没有可用 key 时换下一个分片）
+# 其他策略沿排序索引选择，不使用分片
+# SSO_LOCK_SHARDS=8
+# 状态日志：批量刷盘间隔(秒)、立即刷盘的缓冲记录数、压缩为快照的日志记录数
+# SSO_JOURNAL_FLUSH_INTERVAL=1.0
+# SSO_JOURNAL_FLUSH_BATCH=100
+# SSO_JOURNAL_COMPACT_RECORDS=10000
 
 # ============ 中转站配置 ============
 # 启用中转站模式后，将通过中转站 API 调用，而不是直接使用 Grok SSO
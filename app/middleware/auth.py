@@ -78,25 +78,33 @@ async def verify_api_key(authorization: Optional[str] = Header(None)) -> Tuple[b
 async def get_sso_for_key(api_key: Optional[APIKey]) -> Optional[str]:
     """为 API Key 获取对应的 SSO Token
 
-    如果 API Key 有专用的 SSO Token，则使用专用的；
-    否则使用全局 SSO 池
+    如果 API Key 有专用的 SSO Token，则从其中不在熔断冷却中、仍有配额的 token 随机选择；
+    否则返回 None，由生成客户端从全局 SSO 池中选择（支持失败切换和对冲请求）
 
     Args:
         api_key: APIKey 对象（可能为 None）
 
     Returns:
-        SSO Token 或 None
+        专用 SSO Token，使用全局池时为 None
+
+    Raises:
+        HTTPException: 专用 SSO 都在熔断冷却中或已用完配额时返回 429
     """
     if api_key and api_key.sso_tokens:
-        # 使用专用 SSO Token（简单轮询）
-        # TODO: 可以为专用 SSO 也实现轮询策略
+        # 使用专用 SSO Token（随机选择可用的）
         import random
-        sso = random.choice(api_key.sso_tokens)
+        from app.services.grok_client import sso_manager
+        available = await sso_manager.filter_available(api_key.sso_tokens)
+        if not available:
+            logger.warning(f"[Auth] 专用 SSO 均不可用: {api_key.name}")
+            raise HTTPException(
+                status_code=429,
+                detail="专用 SSO 均在熔断冷却中或已用完配额，请稍后重试"
+            )
+        sso = random.choice(available)
         logger.debug(f"[Auth] 使用专用 SSO: {api_key.name}")
         return sso
 
     # 使用全局 SSO 池
-    from app.services.sso_manager import sso_manager
-    sso = await sso_manager.get_next_sso()
     logger.debug(f"[Auth] 使用全局 SSO 池")
-    return sso
+    return None
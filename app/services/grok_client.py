@@ -4,10 +4,10 @@ import asyncio
 import json
 import uuid
 import time
-import base64
 import ssl
 import re
-from typing import Optional, List, Dict, Any, Callable, Awaitable
+from collections import deque
+from typing import Optional, List, Dict, Any, Callable, Awaitable, Tuple, Set
 from dataclasses import dataclass, field
 
 import aiohttp
@@ -15,6 +15,10 @@ from aiohttp_socks import ProxyConnector
 
 from app.core.config import settings
 from app.core.logger import logger
+from app.services.ws_pool import ImagineWSPool
+from app.services.image_store import image_store
+from app.services.surplus_pool import surplus_pool, SurplusKey, SurplusImage
+from app.services.sso_telemetry import OUTCOME_OK, OUTCOME_BLOCKED, OUTCOME_ERROR
 
 # 根据配置选择 SSO 管理器
 if settings.REDIS_ENABLED:
@@ -23,7 +27,8 @@ if settings.REDIS_ENABLED:
         use_redis=True,
         redis_url=settings.REDIS_URL,
         strategy=settings.SSO_ROTATION_STRATEGY,
-        daily_limit=settings.SSO_DAILY_LIMIT
+        daily_limit=settings.SSO_DAILY_LIMIT,
+        max_inflight=settings.SSO_MAX_INFLIGHT
     )
 else:
     from app.services.sso_manager import sso_manager
@@ -34,10 +39,12 @@ class ImageProgress:
     """单张图片的生成进度"""
     image_id: str  # 从 URL 提取的 UUID
     stage: str = "preview"  # preview -> medium -> final
-    blob: str = ""
-    blob_size: int = 0
+    job: int = 0  # 批量生成时所属子任务序号
+    data: bytes = b""  # 最终图片解码后的数据（中间阶段不解码；落盘或不再需要时释放）
+    blob_size: int = 0  # 原始 base64 数据长度
     url: str = ""
     is_final: bool = False
+    local_url: str = ""  # 最终图片落盘后的访问 URL
 
 
 @dataclass
@@ -47,6 +54,35 @@ class GenerationProgress:
     images: Dict[str, ImageProgress] = field(default_factory=dict)
     completed: int = 0  # 已完成的最终图片数量
     has_medium: bool = False  # 是否有 medium 阶段的图片
+    retained_bytes: int = 0  # 当前保留的图片数据大小
+    peak_bytes: int = 0  # 保留图片数据的峰值
+
+    def update(self, img: ImageProgress):
+        """更新单张图片进度，旧阶段的数据随之释放"""
+        existing = self.images.get(img.image_id)
+        if existing:
+            self.retained_bytes -= len(existing.data)
+        self.images[img.image_id] = img
+        self.retained_bytes += len(img.data)
+
+        # 更新完成计数
+        self.completed = sum(1 for i in self.images.values() if i.is_final)
+
+        # 最终图片已足够时，其余图片的中间数据不会再用到
+        if self.completed >= self.total:
+            for other in self.images.values():
+                if not other.is_final and other.data:
+                    self.retained_bytes -= len(other.data)
+                    other.data = b""
+
+        self.peak_bytes = max(self.peak_bytes, self.retained_bytes)
+
+    def release_data(self, image_id: str):
+        """释放已落盘且不再需要的图片数据"""
+        img = self.images.get(image_id)
+        if img and img.data:
+            self.retained_bytes -= len(img.data)
+            img.data = b""
 
     def get_completed_images(self) -> List[ImageProgress]:
         """获取所有已完成的图片"""
@@ -59,6 +95,30 @@ class GenerationProgress:
         return has_medium and not has_final
 
 
+@dataclass
+class GenerationDeadlines:
+    """生成过程的截止时间（秒），可按请求单独配置"""
+    timeout: float = 120  # 整体超时
+    blocked_after_medium: float = 15  # 收到 medium 后仍无 final 视为 blocked
+    idle_after_partial: float = 10  # 已有部分 final 后无新消息视为完成
+
+    @classmethod
+    def from_settings(cls) -> "GenerationDeadlines":
+        """使用全局配置创建"""
+        return cls(
+            timeout=settings.GENERATION_TIMEOUT,
+            blocked_after_medium=settings.GENERATION_BLOCKED_TIMEOUT,
+            idle_after_partial=settings.GENERATION_IDLE_TIMEOUT
+        )
+
+
+@dataclass
+class GenerationTiming:
+    """单次生成的耗时（秒，从发送请求开始计），未到达的阶段为 None"""
+    first_preview: Optional[float] = None  # 首个预览帧
+    final: Optional[float] = None  # 收齐所需的最终图片
+
+
 # 流式回调类型
 StreamCallback = Callable[[ImageProgress, GenerationProgress], Awaitable[None]]
 
@@ -66,15 +126,35 @@ StreamCallback = Callable[[ImageProgress, GenerationProgress], Awaitable[None]]
 class GrokImagineClient:
     """Grok Imagine WebSocket 客户端"""
 
+    IMAGES_PER_SESSION = 4  # 单次 Grok Imagine 会话最多生成的图片数
+
     def __init__(self):
         self._ssl_context = ssl.create_default_context()
         # 用于从 URL 提取图片 ID
         self._url_pattern = re.compile(r'/images/([a-f0-9-]+)\.(png|jpg)')
+        # 长连接会话池：每个代理目标一个 ClientSession（复用 DNS 缓存、连接池和代理连接）
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._session_stats: Dict[str, Dict[str, int]] = {}
+        self._session_lock = asyncio.Lock()
+        # WebSocket 连接池：按 SSO 复用预热的连接，并在一条连接上多路复用多个请求
+        self._ws_pool = ImagineWSPool(
+            connect=self._connect_ws,
+            enabled=settings.WS_POOL_ENABLED,
+            max_idle_per_sso=settings.WS_POOL_MAX_PER_SSO,
+            idle_timeout=settings.WS_POOL_IDLE_TIMEOUT,
+            max_age=settings.WS_POOL_MAX_AGE,
+            max_streams_per_conn=settings.WS_MAX_STREAMS_PER_CONN
+        )
+        # 首个预览帧耗时样本（用于计算对冲延迟）
+        self._preview_latencies: deque = deque(maxlen=200)
+        self._hedge_stats = {"started": 0, "won": 0}
 
-    def _get_connector(self) -> Optional[aiohttp.BaseConnector]:
-        """获取连接器（支持代理）"""
-        proxy_url = settings.PROXY_URL or settings.HTTP_PROXY or settings.HTTPS_PROXY
+    def _get_proxy_url(self) -> Optional[str]:
+        """获取当前代理地址"""
+        return settings.PROXY_URL or settings.HTTP_PROXY or settings.HTTPS_PROXY
 
+    def _get_connector(self, proxy_url: Optional[str] = None) -> aiohttp.BaseConnector:
+        """获取连接器（支持代理）"""
         if proxy_url:
             logger.info(f"[Grok] 使用代理: {proxy_url}")
             # 支持 http/https/socks4/socks5 代理
@@ -94,6 +174,110 @@ class GrokImagineClient:
             ttl_dns_cache=300
         )
 
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取当前代理目标对应的长连接会话，不存在或已关闭时创建"""
+        proxy_url = self._get_proxy_url()
+        target = proxy_url or "direct"
+
+        session = self._sessions.get(target)
+        if session is None or session.closed:
+            async with self._session_lock:
+                session = self._sessions.get(target)
+                if session is None or session.closed:
+                    # 设置更长的超时时间
+                    timeout = aiohttp.ClientTimeout(
+                        total=None,  # 不限制总时间
+                        connect=90,  # 连接超时 90 秒
+                        sock_connect=90,  # Socket 连接超时 90 秒
+                        sock_read=None  # 读取不超时
+                    )
+                    session = aiohttp.ClientSession(
+                        connector=self._get_connector(proxy_url),
+                        timeout=timeout
+                    )
+                    self._sessions[target] = session
+                    stats = self._session_stats.setdefault(
+                        target, {"sessions_created": 0, "requests": 0}
+                    )
+                    stats["sessions_created"] += 1
+                    logger.info(f"[Grok] 创建长连接会话: {target}")
+
+        self._session_stats[target]["requests"] += 1
+        return session
+
+    async def _connect_ws(self, sso: str) -> aiohttp.ClientWebSocketResponse:
+        """为指定 SSO 建立新的 WebSocket 连接"""
+        session = await self._get_session()
+        logger.info(f"[Grok] 正在连接 WebSocket (超时: 90s): {settings.GROK_WS_URL}")
+        return await session.ws_connect(
+            settings.GROK_WS_URL,
+            headers=self._get_ws_headers(sso),
+            heartbeat=20,
+            receive_timeout=None,  # 不限制接收超时
+            autoclose=False,
+            autoping=True
+        )
+
+    async def start(self):
+        """预热当前代理目标的会话并启动连接池回收任务（在应用启动时调用）"""
+        await self._get_session()
+        await self._ws_pool.start()
+        if settings.REDIS_ENABLED:
+            # 文件版管理器由 main 负责启动和关闭
+            await sso_manager.start()
+
+    async def close(self):
+        """关闭连接池和所有会话（在应用关闭时调用）"""
+        await self._ws_pool.close()
+        if settings.REDIS_ENABLED:
+            await sso_manager.close()
+        async with self._session_lock:
+            for target, session in self._sessions.items():
+                if not session.closed:
+                    await session.close()
+                    logger.info(f"[Grok] 已关闭会话: {target}")
+            self._sessions.clear()
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取连接池统计"""
+        pools = {}
+        for target, session in self._sessions.items():
+            connector = session.connector
+            stats = self._session_stats.get(target, {})
+            pools[target] = {
+                "closed": session.closed,
+                "limit": connector.limit if connector else 0,
+                "limit_per_host": connector.limit_per_host if connector else 0,
+                "acquired": len(getattr(connector, "_acquired", ())),
+                "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values()),
+                "sessions_created": stats.get("sessions_created", 0),
+                "requests": stats.get("requests", 0)
+            }
+        return pools
+
+    def get_ws_pool_stats(self) -> Dict[str, Any]:
+        """获取 WebSocket 连接池统计"""
+        return self._ws_pool.get_stats()
+
+    def _hedge_delay(self) -> float:
+        """对冲延迟：首个预览耗时的指定分位数，样本不足时使用默认值"""
+        samples = sorted(self._preview_latencies)
+        if len(samples) < settings.HEDGE_MIN_SAMPLES:
+            delay = settings.HEDGE_DEFAULT_DELAY
+        else:
+            index = min(len(samples) - 1, int(len(samples) * settings.HEDGE_PERCENTILE / 100))
+            delay = samples[index]
+        return min(max(delay, settings.HEDGE_MIN_DELAY), settings.HEDGE_MAX_DELAY)
+
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """获取对冲请求统计"""
+        return {
+            "enabled": settings.HEDGE_ENABLED,
+            "delay": round(self._hedge_delay(), 2),
+            "samples": len(self._preview_latencies),
+            **self._hedge_stats
+        }
+
     def _get_ws_headers(self, sso: str) -> Dict[str, str]:
         """构建 WebSocket 请求头"""
         return {
@@ -125,7 +309,11 @@ class GrokImagineClient:
         enable_nsfw: bool = True,
         sso: Optional[str] = None,
         max_retries: int = 5,
-        stream_callback: Optional[StreamCallback] = None
+        stream_callback: Optional[StreamCallback] = None,
+        return_b64: bool = False,
+        deadlines: Optional[GenerationDeadlines] = None,
+        hedge: Optional[bool] = None,
+        busy_ssos: Optional[Set[str]] = None
     ) -> Dict[str, Any]:
         """
         生成图片
@@ -138,29 +326,58 @@ class GrokImagineClient:
             sso: 指定 SSO，否则从池中获取
             max_retries: 最大重试次数 (用于轮询不同 SSO)
             stream_callback: 流式回调，每次收到图片更新时调用
+            return_b64: 是否在结果中附带 base64 列表 (response_format=b64_json 时使用)
+            deadlines: 截止时间配置，默认使用全局配置
+            hedge: 是否启用对冲请求（仅在从池中获取 SSO 时生效），默认使用 HEDGE_ENABLED
+            busy_ssos: 并发子任务共享的占用集合，选择时优先避开，使用期间加入
 
         Returns:
             生成结果，包含图片 URL 列表
         """
+        if hedge is None:
+            hedge = settings.HEDGE_ENABLED
+
+        # n < 4 时同一会话会多生成图片：优先从多余图片池返回，否则本次生成时收集多余图片
+        surplus_key = None
+        if settings.SURPLUS_ENABLED and n < self.IMAGES_PER_SESSION:
+            surplus_key = surplus_pool.make_key(prompt, aspect_ratio, enable_nsfw)
+            result = await self._serve_surplus(surplus_key, n, return_b64)
+            if result:
+                return result
+
         last_error = None
         blocked_retries = 0  # blocked 重试计数
         max_blocked_retries = 3  # blocked 最大重试次数
 
         for attempt in range(max_retries):
-            current_sso = sso if sso else await sso_manager.get_next_sso()
+            # 从池中获取的 SSO 占用租约，本次尝试结束（含取消）时归还
+            current_sso = sso if sso else await self._pick_sso(busy_ssos)
 
             if not current_sso:
-                return {"success": False, "error": "没有可用的 SSO"}
+                return await self._no_sso_result()
+
+            picked_sso = current_sso
+            if busy_ssos is not None:
+                busy_ssos.add(picked_sso)
 
             try:
-                result = await self._do_generate(
-                    sso=current_sso,
+                generate_kwargs = dict(
                     prompt=prompt,
                     aspect_ratio=aspect_ratio,
                     n=n,
                     enable_nsfw=enable_nsfw,
-                    stream_callback=stream_callback
+                    stream_callback=stream_callback,
+                    return_b64=return_b64,
+                    deadlines=deadlines,
+                    surplus_key=surplus_key
                 )
+                if hedge and not sso:
+                    # 对冲模式下胜出的可能是另一个 SSO，后续只对胜者记录使用
+                    result, current_sso = await self._generate_hedged(
+                        current_sso, busy_ssos=busy_ssos, **generate_kwargs
+                    )
+                else:
+                    result = await self._do_generate(sso=current_sso, **generate_kwargs)
 
                 if result.get("success"):
                     await sso_manager.mark_success(current_sso)
@@ -177,7 +394,9 @@ class GrokImagineClient:
                     logger.warning(
                         f"[Grok] 检测到 blocked，重试 {blocked_retries}/{max_blocked_retries}"
                     )
-                    await sso_manager.mark_failed(current_sso, "blocked - 无法生成最终图片")
+                    await sso_manager.mark_failed(
+                        current_sso, "blocked - 无法生成最终图片", error_code="blocked"
+                    )
 
                     if blocked_retries >= max_blocked_retries:
                         return {
@@ -191,7 +410,9 @@ class GrokImagineClient:
                     continue
 
                 if error_code in ["rate_limit_exceeded", "unauthorized"]:
-                    await sso_manager.mark_failed(current_sso, result.get("error", ""))
+                    await sso_manager.mark_failed(
+                        current_sso, result.get("error", ""), error_code=error_code
+                    )
                     last_error = result
                     if sso:
                         return result
@@ -208,8 +429,285 @@ class GrokImagineClient:
                     return last_error
                 continue
 
+            finally:
+                if not sso:
+                    sso_manager.release(picked_sso)
+                if busy_ssos is not None:
+                    busy_ssos.discard(picked_sso)
+
         return last_error or {"success": False, "error": "所有重试都失败了"}
 
+    async def _serve_surplus(
+        self,
+        surplus_key: SurplusKey,
+        n: int,
+        return_b64: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """从多余图片池取出 n 张图片作为结果，池中不足或图片文件已丢失时返回 None"""
+        images = surplus_pool.take(surplus_key, n)
+        if not images:
+            return None
+
+        b64_list = []
+        if return_b64:
+            # 先读取全部文件，有文件丢失时把其余图片放回池中
+            loaded = [(image, await image_store.load(image.filename)) for image in images]
+            missing = [image for image, data in loaded if data is None]
+            if missing:
+                for image in missing:
+                    logger.warning(f"[Grok] 多余图片文件已丢失: {image.filename}")
+                surplus_pool.give_back(
+                    surplus_key,
+                    [image for image, data in loaded if data is not None],
+                    lost=len(missing)
+                )
+                return None
+            for _, data in loaded:
+                b64_list.append(await image_store.encode(data))
+
+        logger.info(f"[Grok] 从多余图片池返回 {n} 张图片")
+        result = {
+            "success": True,
+            "urls": [image.url for image in images],
+            "count": len(images),
+            "from_surplus": True
+        }
+        if return_b64:
+            result["b64_list"] = b64_list
+        return result
+
+    async def _pick_sso(self, busy_ssos: Optional[Set[str]] = None) -> Optional[str]:
+        """从池中选择 SSO 并占用租约，优先避开并发子任务正在使用的 key
+
+        没有可用容量时在准入队列中等待，超时返回 None
+        """
+        if busy_ssos:
+            current_sso = await sso_manager.acquire(exclude=busy_ssos, wait=0)
+            if current_sso:
+                return current_sso
+        return await sso_manager.acquire()
+
+    async def _no_sso_result(self) -> Dict[str, Any]:
+        """没有可用 SSO（排队超时或被拒绝）时的结果，附带建议的重试间隔"""
+        retry_after = await sso_manager.retry_after()
+        return {
+            "success": False,
+            "error_code": "no_available_sso",
+            "error": f"没有可用的 SSO，请 {retry_after} 秒后重试",
+            "retry_after": retry_after
+        }
+
+    async def generate_batch(
+        self,
+        prompt: str,
+        aspect_ratio: str = "2:3",
+        n: int = 4,
+        enable_nsfw: bool = True,
+        sso: Optional[str] = None,
+        stream_callback: Optional[StreamCallback] = None,
+        return_b64: bool = False
+    ) -> Dict[str, Any]:
+        """
+        批量生成图片
+
+        单次会话最多生成 4 张，n 更大时拆分为多个子任务，
+        在不同 SSO 上并发执行（并发数受 BATCH_MAX_PARALLEL 限制），结果按子任务顺序合并
+
+        Args:
+            prompt: 提示词
+            aspect_ratio: 宽高比
+            n: 生成数量
+            enable_nsfw: 是否启用 NSFW
+            sso: 指定 SSO（所有子任务共用），否则从池中获取
+            stream_callback: 流式回调，进度中的 completed/total 为所有子任务的汇总
+            return_b64: 是否在结果中附带 base64 列表
+
+        Returns:
+            合并后的生成结果
+        """
+        if n <= self.IMAGES_PER_SESSION:
+            return await self.generate(
+                prompt=prompt,
+                aspect_ratio=aspect_ratio,
+                n=n,
+                enable_nsfw=enable_nsfw,
+                sso=sso,
+                stream_callback=stream_callback,
+                return_b64=return_b64
+            )
+
+        sizes = [self.IMAGES_PER_SESSION] * (n // self.IMAGES_PER_SESSION)
+        if n % self.IMAGES_PER_SESSION:
+            sizes.append(n % self.IMAGES_PER_SESSION)
+
+        logger.info(f"[Grok] 批量生成 {n} 张，拆分为 {len(sizes)} 个子任务")
+
+        semaphore = asyncio.Semaphore(settings.BATCH_MAX_PARALLEL)
+        busy_ssos: Set[str] = set()
+        overall = GenerationProgress(total=n)
+        job_completed = [0] * len(sizes)
+
+        def job_callback(job: int) -> Optional[StreamCallback]:
+            if stream_callback is None:
+                return None
+
+            async def callback(img: ImageProgress, prog: GenerationProgress):
+                job_completed[job] = prog.completed
+                overall.completed = sum(job_completed)
+                img.job = job
+                await stream_callback(img, overall)
+            return callback
+
+        async def run_job(job: int, size: int) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.generate(
+                    prompt=prompt,
+                    aspect_ratio=aspect_ratio,
+                    n=size,
+                    enable_nsfw=enable_nsfw,
+                    sso=sso,
+                    stream_callback=job_callback(job),
+                    return_b64=return_b64,
+                    busy_ssos=busy_ssos
+                )
+
+        start_time = time.time()
+        results = await asyncio.gather(*(run_job(i, size) for i, size in enumerate(sizes)))
+
+        urls: List[str] = []
+        b64_list: List[str] = []
+        errors = []
+        for job, result in enumerate(results):
+            if result.get("success"):
+                urls.extend(result.get("urls", []))
+                b64_list.extend(result.get("b64_list", []))
+            else:
+                errors.append({"job": job, **result})
+
+        logger.info(
+            f"[Grok] 批量生成完成: {len(urls)}/{n} 张, "
+            f"失败子任务 {len(errors)}, 耗时 {time.time() - start_time:.1f}s"
+        )
+
+        if not urls:
+            return errors[0] if errors else {"success": False, "error": "未收到图片数据"}
+
+        result = {
+            "success": True,
+            "urls": urls,
+            "count": len(urls),
+            "jobs": len(sizes)
+        }
+        if return_b64:
+            result["b64_list"] = b64_list
+        if errors:
+            result["errors"] = errors
+        return result
+
+    async def _generate_hedged(
+        self,
+        primary_sso: str,
+        stream_callback: Optional[StreamCallback] = None,
+        busy_ssos: Optional[Set[str]] = None,
+        **kwargs
+    ) -> Tuple[Dict[str, Any], str]:
+        """对冲生成
+
+        主请求在对冲延迟内没有收到预览帧时，在池中另一个 SSO 上并行发起第二个请求，
+        先成功者胜出，另一个被取消。流式回调只转发最先产生进度的请求。
+
+        Returns:
+            (生成结果, 产生该结果的 SSO)
+        """
+        leader: Dict[str, str] = {}
+
+        def gated_callback(tag: str) -> Optional[StreamCallback]:
+            if stream_callback is None:
+                return None
+
+            async def callback(img: ImageProgress, prog: GenerationProgress):
+                if leader.setdefault("sso", tag) == tag:
+                    await stream_callback(img, prog)
+            return callback
+
+        delay = self._hedge_delay()
+        primary_preview = asyncio.Event()
+        primary = asyncio.create_task(self._do_generate(
+            sso=primary_sso,
+            stream_callback=gated_callback(primary_sso),
+            first_preview=primary_preview,
+            **kwargs
+        ))
+
+        preview_wait = asyncio.create_task(primary_preview.wait())
+        try:
+            await asyncio.wait(
+                {primary, preview_wait},
+                timeout=delay,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            preview_wait.cancel()
+
+        if primary.done() or primary_preview.is_set():
+            return await primary, primary_sso
+
+        # 对冲只使用现有空闲容量，不排队
+        hedge_sso = await sso_manager.acquire(exclude={primary_sso} | (busy_ssos or set()), wait=0)
+        if not hedge_sso:
+            return await primary, primary_sso
+        if busy_ssos is not None:
+            # 对冲期间并发子任务同样避开该 key
+            busy_ssos.add(hedge_sso)
+
+        logger.info(f"[Grok] {delay:.1f}s 内未收到预览，在另一个 SSO 上发起对冲请求")
+        self._hedge_stats["started"] += 1
+        hedge = asyncio.create_task(self._do_generate(
+            sso=hedge_sso,
+            stream_callback=gated_callback(hedge_sso),
+            **kwargs
+        ))
+
+        owners = {primary: primary_sso, hedge: hedge_sso}
+        pending = set(owners)
+        last_result: Dict[str, Any] = {"success": False, "error": "对冲请求均失败"}
+        last_sso = primary_sso
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception():
+                        result = {"success": False, "error": str(task.exception())}
+                    else:
+                        result = task.result()
+
+                    if result.get("success"):
+                        if task is hedge:
+                            self._hedge_stats["won"] += 1
+                        logger.info(
+                            f"[Grok] 对冲完成，胜出: {'对冲请求' if task is hedge else '主请求'}"
+                        )
+                        return result, owners[task]
+
+                    # 失败方若是 SSO 本身的问题，不等重试就标记失败
+                    if pending and result.get("error_code") in ["rate_limit_exceeded", "unauthorized"]:
+                        await sso_manager.mark_failed(
+                            owners[task], result.get("error", ""), error_code=result["error_code"]
+                        )
+                    last_result, last_sso = result, owners[task]
+        finally:
+            # 取消未完成的一方，连接上的请求会被干净地释放
+            for task in pending:
+                task.cancel()
+            sso_manager.release(hedge_sso)
+            if busy_ssos is not None:
+                busy_ssos.discard(hedge_sso)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        return last_result, last_sso
+
     async def generate_image_to_image(
         self,
         prompt: str,
@@ -240,10 +738,10 @@ class GrokImagineClient:
         last_error = None
 
         for attempt in range(max_retries):
-            current_sso = sso if sso else await sso_manager.get_next_sso()
+            current_sso = sso if sso else await sso_manager.acquire()
 
             if not current_sso:
-                return {"success": False, "error": "没有可用的 SSO"}
+                return await self._no_sso_result()
 
             try:
                 result = await self._do_generate_image_to_image(
@@ -265,7 +763,9 @@ class GrokImagineClient:
                 error_code = result.get("error_code", "")
 
                 if error_code in ["rate_limit_exceeded", "unauthorized"]:
-                    await sso_manager.mark_failed(current_sso, result.get("error", ""))
+                    await sso_manager.mark_failed(
+                        current_sso, result.get("error", ""), error_code=error_code
+                    )
                     last_error = result
                     if sso:
                         return result
@@ -282,6 +782,10 @@ class GrokImagineClient:
                     return last_error
                 continue
 
+            finally:
+                if not sso:
+                    sso_manager.release(current_sso)
+
         return last_error or {"success": False, "error": "所有重试都失败了"}
 
     async def _do_generate_image_to_image(
@@ -300,122 +804,119 @@ class GrokImagineClient:
 
         logger.info(f"[Grok] 图生图请求: {prompt[:50]}... mode={mode}")
 
-        connector = self._get_connector()
-
         try:
-            timeout = aiohttp.ClientTimeout(
-                total=None,
-                connect=90,
-                sock_connect=90,
-                sock_read=None
-            )
+            session = await self._get_session()
+            async with session.ws_connect(
+                settings.GROK_WS_URL,
+                headers=headers,
+                heartbeat=20,
+                receive_timeout=None,
+                autoclose=False,
+                autoping=True
+            ) as ws:
+                # 构建图生图消息（使用测试成功的格式）
+                message = {
+                    "type": "conversation.item.create",
+                    "timestamp": int(time.time() * 1000),
+                    "item": {
+                        "type": "message",
+                        "content": [{
+                            "requestId": request_id,
+                            "text": prompt,
+                            "type": "input_image",  # 关键：使用 input_image 类型
+                            "image": f"data:image/jpeg;base64,{image_base64}",  # 带前缀的 base64
+                            "properties": {
+                                "section_count": 0,
+                                "is_kids_mode": False,
+                                "enable_nsfw": enable_nsfw,
+                                "skip_upsampler": False,
+                                "is_initial": False,
+                                "aspect_ratio": aspect_ratio
+                                # 注意：不包含 mode 和 strength，因为 Grok 可能不支持
+                            }
+                        }]
+                    }
+                }
+
+                await ws.send_json(message)
+                logger.info(f"[Grok] 已发送图生图请求")
+
+                # 使用与文本生成图片相同的接收逻辑
+                progress = GenerationProgress(total=1)  # 图生图通常只生成1张
+                start_time = time.time()
+                timeout_at = start_time + settings.GENERATION_TIMEOUT
+
+                while time.time() < timeout_at:
+                    try:
+                        ws_msg = await asyncio.wait_for(
+                            ws.receive(), timeout=timeout_at - time.time()
+                        )
+
+                        if ws_msg.type == aiohttp.WSMsgType.TEXT:
+                            msg = json.loads(ws_msg.data)
+                            msg_type = msg.get("type")
+
+                            # 添加详细日志
+                            logger.info(f"[Grok] 图生图收到消息: type={msg_type}")
 
-            async with aiohttp.ClientSession(
-                connector=connector,
-                timeout=timeout
-            ) as session:
-                async with session.ws_connect(
-                    settings.GROK_WS_URL,
-                    headers=headers,
-                    heartbeat=20,
-                    receive_timeout=None,
-                    autoclose=False,
-                    autoping=True
-                ) as ws:
-                    # 构建图生图消息（使用测试成功的格式）
-                    message = {
-                        "type": "conversation.item.create",
-                        "timestamp": int(time.time() * 1000),
-                        "item": {
-                            "type": "message",
-                            "content": [{
-                                "requestId": request_id,
-                                "text": prompt,
-                                "type": "input_image",  # 关键：使用 input_image 类型
-                                "image": f"data:image/jpeg;base64,{image_base64}",  # 带前缀的 base64
-                                "properties": {
-                                    "section_count": 0,
-                                    "is_kids_mode": False,
-                                    "enable_nsfw": enable_nsfw,
-                                    "skip_upsampler": False,
-                                    "is_initial": False,
-                                    "aspect_ratio": aspect_ratio
-                                    # 注意：不包含 mode 和 strength，因为 Grok 可能不支持
+                            if msg_type == "image":
+                                blob = msg.get("blob", "")
+                                url = msg.get("url", "")
+
+                                if blob and url:
+                                    image_id = self._extract_image_id(url)
+                                    if not image_id:
+                                        continue
+
+                                    blob_size = len(blob)
+                                    is_final = self._is_final_image(url, blob_size)
+
+                                    if is_final:
+                                        # 保存图片
+                                        saved_url = await self._save_image(
+                                            await image_store.decode(blob), image_id
+                                        )
+                                        logger.info(f"[Grok] 图生图完成: {saved_url}")
+
+                                        return {
+                                            "success": True,
+                                            "urls": [saved_url],
+                                            "duration": time.time() - start_time
+                                        }
+
+                            elif msg_type == "error":
+                                # Grok 返回的错误格式: {"type": "error", "err_code": "...", "err_msg": "..."}
+                                err_code = msg.get("err_code", "unknown")
+                                err_msg = msg.get("err_msg") or msg.get("message", "未知错误")
+
+                                # 打印完整的错误消息
+                                logger.error(f"[Grok] 图生图错误: {err_msg}")
+                                logger.error(f"[Grok] 完整错误消息: {json.dumps(msg, ensure_ascii=False)}")
+
+                                # 提供更有帮助的错误信息
+                                if err_code == "invalid_argument":
+                                    error_msg = f"Grok 拒绝请求 ({err_msg})。可能原因: 1) 账号需要 Premium 订阅才能使用图生图功能 2) 图片格式或大小不符合要求"
+                                else:
+                                    error_msg = f"{err_msg} (错误代码: {err_code})"
+
+                                return {
+                                    "success": False,
+                                    "error": error_msg,
+                                    "error_code": err_code
                                 }
-                            }]
-                        }
-                    }
 
-                    await ws.send_json(message)
-                    logger.info(f"[Grok] 已发送图生图请求")
-
-                    # 使用与文本生成图片相同的接收逻辑
-                    progress = GenerationProgress(total=1)  # 图生图通常只生成1张
-                    start_time = time.time()
-
-                    while time.time() - start_time < settings.GENERATION_TIMEOUT:
-                        try:
-                            ws_msg = await asyncio.wait_for(ws.receive(), timeout=5.0)
-
-                            if ws_msg.type == aiohttp.WSMsgType.TEXT:
-                                msg = json.loads(ws_msg.data)
-                                msg_type = msg.get("type")
-
-                                # 添加详细日志
-                                logger.info(f"[Grok] 图生图收到消息: type={msg_type}")
-
-                                if msg_type == "image":
-                                    blob = msg.get("blob", "")
-                                    url = msg.get("url", "")
-
-                                    if blob and url:
-                                        image_id = self._extract_image_id(url)
-                                        if not image_id:
-                                            continue
-
-                                        blob_size = len(blob)
-                                        is_final = self._is_final_image(url, blob_size)
-
-                                        if is_final:
-                                            # 保存图片
-                                            saved_url = await self._save_image(blob, image_id)
-                                            logger.info(f"[Grok] 图生图完成: {saved_url}")
-
-                                            return {
-                                                "success": True,
-                                                "urls": [saved_url],
-                                                "duration": time.time() - start_time
-                                            }
-
-                                elif msg_type == "error":
-                                    # Grok 返回的错误格式: {"type": "error", "err_code": "...", "err_msg": "..."}
-                                    err_code = msg.get("err_code", "unknown")
-                                    err_msg = msg.get("err_msg") or msg.get("message", "未知错误")
-
-                                    # 打印完整的错误消息
-                                    logger.error(f"[Grok] 图生图错误: {err_msg}")
-                                    logger.error(f"[Grok] 完整错误消息: {json.dumps(msg, ensure_ascii=False)}")
-
-                                    # 提供更有帮助的错误信息
-                                    if err_code == "invalid_argument":
-                                        error_msg = f"Grok 拒绝请求 ({err_msg})。可能原因: 1) 账号需要 Premium 订阅才能使用图生图功能 2) 图片格式或大小不符合要求"
-                                    else:
-                                        error_msg = f"{err_msg} (错误代码: {err_code})"
-
-                                    return {
-                                        "success": False,
-                                        "error": error_msg,
-                                        "error_code": err_code
-                                    }
-
-                        except asyncio.TimeoutError:
-                            continue
+                        elif ws_msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            logger.warning(f"[Grok] 图生图 WebSocket 关闭或错误: {ws_msg.type}")
+                            break
 
-                    return {
-                        "success": False,
-                        "error": "图生图超时",
-                        "error_code": "timeout"
-                    }
+                    except asyncio.TimeoutError:
+                        continue
+
+                return {
+                    "success": False,
+                    "error": "图生图超时",
+                    "error_code": "timeout"
+                }
 
         except Exception as e:
             logger.error(f"[Grok] 图生图异常: {e}")
@@ -425,272 +926,360 @@ class GrokImagineClient:
                 "error_code": "connection_error"
             }
 
-    async def _do_generate(
+    async def _do_generate(self, sso: str, **kwargs) -> Dict[str, Any]:
+        """执行生成，并向 SSO 管理器上报该 key 的耗时与结果（被取消的请求不上报）"""
+        timing = GenerationTiming()
+        try:
+            result = await self._run_generate(sso=sso, timing=timing, **kwargs)
+        except Exception:
+            sso_manager.record_telemetry(sso, OUTCOME_ERROR, timing.first_preview)
+            raise
+
+        if result.get("success"):
+            outcome = OUTCOME_OK
+        elif result.get("error_code") == "blocked":
+            outcome = OUTCOME_BLOCKED
+        else:
+            outcome = OUTCOME_ERROR
+        sso_manager.record_telemetry(sso, outcome, timing.first_preview, timing.final)
+        return result
+
+    async def _run_generate(
         self,
         sso: str,
+        timing: GenerationTiming,
         prompt: str,
         aspect_ratio: str,
         n: int,
         enable_nsfw: bool,
-        stream_callback: Optional[StreamCallback] = None
+        stream_callback: Optional[StreamCallback] = None,
+        return_b64: bool = False,
+        deadlines: Optional[GenerationDeadlines] = None,
+        first_preview: Optional[asyncio.Event] = None,
+        surplus_key: Optional[SurplusKey] = None
     ) -> Dict[str, Any]:
-        """执行生成"""
+        """执行一次生成请求
+
+        Args:
+            timing: 记录各阶段耗时
+            first_preview: 收到第一个图片帧时被设置（用于对冲判断）
+            surplus_key: 设置时收够 n 张后继续接收本会话其余最终图片，存入多余图片池
+        """
         request_id = str(uuid.uuid4())
-        headers = self._get_ws_headers(sso)
+        deadlines = deadlines or GenerationDeadlines.from_settings()
 
-        logger.info(f"[Grok] 连接 WebSocket: {settings.GROK_WS_URL}")
+        try:
+            # 同一 SSO 的并发请求共享连接，帧按 requestId 分发到各自的队列
+            stream = await self._ws_pool.open_stream(sso, request_id)
+        except aiohttp.ClientError as e:
+            logger.error(f"[Grok] 连接错误: {e}")
+            return {"success": False, "error": f"连接失败: {e}"}
 
-        connector = self._get_connector()
+        # 仅在正常完成时保留连接供复用，出错或超时则关闭
+        reusable = False
+        queue = stream.queue
 
         try:
-            # 设置更长的超时时间
-            timeout = aiohttp.ClientTimeout(
-                total=None,  # 不限制总时间
-                connect=90,  # 连接超时 90 秒
-                sock_connect=90,  # Socket 连接超时 90 秒
-                sock_read=None  # 读取不超时
-            )
-
-            async with aiohttp.ClientSession(
-                connector=connector,
-                timeout=timeout
-            ) as session:
-                logger.info(f"[Grok] 正在连接 WebSocket (超时: 90s)...")
-                async with session.ws_connect(
-                    settings.GROK_WS_URL,
-                    headers=headers,
-                    heartbeat=20,
-                    receive_timeout=None,  # 不限制接收超时
-                    autoclose=False,
-                    autoping=True
-                ) as ws:
-                    # 发送生成请求
-                    message = {
-                        "type": "conversation.item.create",
-                        "timestamp": int(time.time() * 1000),
-                        "item": {
-                            "type": "message",
-                            "content": [{
-                                "requestId": request_id,
-                                "text": prompt,
-                                "type": "input_text",
-                                "properties": {
-                                    "section_count": 0,
-                                    "is_kids_mode": False,
-                                    "enable_nsfw": enable_nsfw,
-                                    "skip_upsampler": False,
-                                    "is_initial": False,
-                                    "aspect_ratio": aspect_ratio
-                                }
-                            }]
+            # 发送生成请求
+            message = {
+                "type": "conversation.item.create",
+                "timestamp": int(time.time() * 1000),
+                "item": {
+                    "type": "message",
+                    "content": [{
+                        "requestId": request_id,
+                        "text": prompt,
+                        "type": "input_text",
+                        "properties": {
+                            "section_count": 0,
+                            "is_kids_mode": False,
+                            "enable_nsfw": enable_nsfw,
+                            "skip_upsampler": False,
+                            "is_initial": False,
+                            "aspect_ratio": aspect_ratio
                         }
+                    }]
+                }
+            }
+
+            await stream.send_json(message)
+            logger.info(f"[Grok] 已发送请求: {prompt[:50]}...")
+
+            # 进度跟踪
+            progress = GenerationProgress(total=n)
+            error_info = None
+            loop = asyncio.get_running_loop()
+            start_time = loop.time()
+            timeout_at = start_time + deadlines.timeout  # 整体超时
+            blocked_at = None  # 收到 medium 后仍无 final 的截止时间
+            idle_at = None  # 已有部分 final 后无新消息的截止时间
+            harvest_at = None  # 收够 n 张后继续收集多余图片的截止时间
+            target = self.IMAGES_PER_SESSION if surplus_key else n
+
+            while True:
+                # 等待到最近的截止时间，到期的截止时间立即处理
+                now = loop.time()
+                if progress.completed == 0 and blocked_at is not None and now >= blocked_at:
+                    logger.warning(
+                        f"[Grok] 检测到 blocked: 收到 medium 后 "
+                        f"{deadlines.blocked_after_medium:.1f}s 仍无 final"
+                    )
+                    return {
+                        "success": False,
+                        "error_code": "blocked",
+                        "error": "生成被阻止，无法获取最终图片"
                     }
+                if progress.completed > 0 and idle_at is not None and now >= idle_at:
+                    # 已经有一些最终图片且一段时间没有新消息，认为完成
+                    logger.info(f"[Grok] 空闲超时，已收集 {progress.completed} 张图片")
+                    reusable = True
+                    break
+                if harvest_at is not None and now >= harvest_at:
+                    logger.info(f"[Grok] 多余图片收集结束，共 {progress.completed} 张最终图片")
+                    reusable = True
+                    break
+                if now >= timeout_at:
+                    logger.warning(f"[Grok] 生成超时 ({deadlines.timeout}s)")
+                    break
+
+                next_deadline = timeout_at
+                if harvest_at is not None:
+                    next_deadline = min(next_deadline, harvest_at)
+                if progress.completed == 0 and blocked_at is not None:
+                    next_deadline = min(next_deadline, blocked_at)
+                if progress.completed > 0 and idle_at is not None:
+                    next_deadline = min(next_deadline, idle_at)
 
-                    await ws.send_json(message)
-                    logger.info(f"[Grok] 已发送请求: {prompt[:50]}...")
-
-                    # 进度跟踪
-                    progress = GenerationProgress(total=n)
-                    error_info = None
-                    start_time = time.time()
-                    last_activity = time.time()
-                    medium_received_time = None  # 收到 medium 的时间
-
-                    while time.time() - start_time < settings.GENERATION_TIMEOUT:
-                        try:
-                            ws_msg = await asyncio.wait_for(ws.receive(), timeout=5.0)
-
-                            if ws_msg.type == aiohttp.WSMsgType.TEXT:
-                                last_activity = time.time()
-                                msg = json.loads(ws_msg.data)
-                                msg_type = msg.get("type")
-
-                                if msg_type == "image":
-                                    blob = msg.get("blob", "")
-                                    url = msg.get("url", "")
-
-                                    if blob and url:
-                                        image_id = self._extract_image_id(url)
-                                        if not image_id:
-                                            continue
-
-                                        blob_size = len(blob)
-                                        is_final = self._is_final_image(url, blob_size)
-
-                                        # 确定阶段
-                                        if is_final:
-                                            stage = "final"
-                                        elif blob_size > 30000:
-                                            stage = "medium"
-                                            # 记录收到 medium 的时间
-                                            if medium_received_time is None:
-                                                medium_received_time = time.time()
-                                        else:
-                                            stage = "preview"
-
-                                        # 更新或创建图片进度
-                                        img_progress = ImageProgress(
-                                            image_id=image_id,
-                                            stage=stage,
-                                            blob=blob,
-                                            blob_size=blob_size,
-                                            url=url,
-                                            is_final=is_final
-                                        )
+                try:
+                    msg = await asyncio.wait_for(queue.get(), timeout=next_deadline - now)
+                except asyncio.TimeoutError:
+                    continue
 
-                                        # 只更新到更高阶段
-                                        existing = progress.images.get(image_id)
-                                        if not existing or (not existing.is_final):
-                                            progress.images[image_id] = img_progress
-
-                                            # 更新完成计数
-                                            progress.completed = len([
-                                                img for img in progress.images.values()
-                                                if img.is_final
-                                            ])
-
-                                            logger.info(
-                                                f"[Grok] 图片 {image_id[:8]}... "
-                                                f"阶段={stage} 大小={blob_size} "
-                                                f"进度={progress.completed}/{n}"
-                                            )
-
-                                            # 调用流式回调
-                                            if stream_callback:
-                                                try:
-                                                    await stream_callback(img_progress, progress)
-                                                except Exception as e:
-                                                    logger.warning(f"[Grok] 流式回调错误: {e}")
-
-                                elif msg_type == "error":
-                                    error_code = msg.get("err_code", "")
-                                    error_msg = msg.get("err_msg", "")
-                                    logger.warning(f"[Grok] 错误: {error_code} - {error_msg}")
-                                    error_info = {"error_code": error_code, "error": error_msg}
-
-                                    if error_code == "rate_limit_exceeded":
-                                        return {
-                                            "success": False,
-                                            "error_code": error_code,
-                                            "error": error_msg
-                                        }
+                if msg is None:
+                    logger.warning("[Grok] WebSocket 已关闭")
+                    break
 
-                                # 检查是否收集够了最终图片
-                                if progress.completed >= n:
-                                    logger.info(f"[Grok] 已收集 {progress.completed} 张最终图片")
-                                    break
-
-                                # 检查是否被 blocked: 有 medium 但超过 15 秒没有 final
-                                if medium_received_time and progress.completed == 0:
-                                    time_since_medium = time.time() - medium_received_time
-                                    if time_since_medium > 15:
-                                        logger.warning(
-                                            f"[Grok] 检测到 blocked: 收到 medium 后 "
-                                            f"{time_since_medium:.1f}s 仍无 final"
-                                        )
-                                        return {
-                                            "success": False,
-                                            "error_code": "blocked",
-                                            "error": "生成被阻止，无法获取最终图片"
-                                        }
+                idle_at = loop.time() + deadlines.idle_after_partial
+                msg_type = msg.get("type")
 
-                            elif ws_msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
-                                logger.warning(f"[Grok] WebSocket 关闭或错误: {ws_msg.type}")
-                                break
-
-                        except asyncio.TimeoutError:
-                            # 检查是否被 blocked
-                            if medium_received_time and progress.completed == 0:
-                                time_since_medium = time.time() - medium_received_time
-                                if time_since_medium > 10:
-                                    logger.warning(
-                                        f"[Grok] 超时检测到 blocked: 收到 medium 后 "
-                                        f"{time_since_medium:.1f}s 仍无 final"
-                                    )
-                                    return {
-                                        "success": False,
-                                        "error_code": "blocked",
-                                        "error": "生成被阻止，无法获取最终图片"
-                                    }
-
-                            # 如果已经有一些最终图片且超过10秒没有新消息，认为完成
-                            if progress.completed > 0 and time.time() - last_activity > 10:
-                                logger.info(f"[Grok] 超时，已收集 {progress.completed} 张图片")
-                                break
-                            continue
+                if msg_type == "image":
+                    blob = msg.get("blob", "")
+                    url = msg.get("url", "")
 
-                    # 保存最终图片
-                    result_urls, result_b64 = await self._save_final_images(progress, n)
+                    if blob and url:
+                        image_id = self._extract_image_id(url)
+                        if not image_id:
+                            continue
 
-                    if result_urls:
+                        if not progress.images:
+                            # 记录首个预览耗时
+                            timing.first_preview = loop.time() - start_time
+                            self._preview_latencies.append(timing.first_preview)
+                            if first_preview:
+                                first_preview.set()
+
+                        blob_size = len(blob)
+                        is_final = self._is_final_image(url, blob_size)
+
+                        # 确定阶段
+                        if is_final:
+                            stage = "final"
+                        elif blob_size > 30000:
+                            stage = "medium"
+                            # 收到第一张 medium 后开始 blocked 计时
+                            if blocked_at is None:
+                                blocked_at = loop.time() + deadlines.blocked_after_medium
+                        else:
+                            stage = "preview"
+
+                        # 只更新到更高阶段
+                        existing = progress.images.get(image_id)
+                        if not existing or (not existing.is_final):
+                            # 收够 n 张后的更新只用于收集多余图片，不再回调
+                            was_done = progress.completed >= n
+                            # 更新或创建图片进度：只解码最终图片，预览和 medium 帧只记录阶段和大小
+                            img_progress = ImageProgress(
+                                image_id=image_id,
+                                stage=stage,
+                                data=await image_store.decode(blob) if is_final else b"",
+                                blob_size=blob_size,
+                                url=url,
+                                is_final=is_final
+                            )
+                            progress.update(img_progress)
+                            if not was_done and progress.completed >= n:
+                                timing.final = loop.time() - start_time
+
+                            # 最终图片到达即落盘，流式回调可以立即推送 URL
+                            if is_final and not was_done:
+                                img_progress.local_url = await self._save_image(
+                                    img_progress.data, image_id
+                                ) or ""
+                                if img_progress.local_url:
+                                    logger.info(f"[Grok] 保存图片: {img_progress.local_url}")
+                                    if not return_b64:
+                                        progress.release_data(image_id)
+
+                            logger.info(
+                                f"[Grok] 图片 {image_id[:8]}... "
+                                f"阶段={stage} 大小={blob_size} "
+                                f"进度={progress.completed}/{n}"
+                            )
+
+                            # 调用流式回调
+                            if stream_callback and not was_done:
+                                try:
+                                    await stream_callback(img_progress, progress)
+                                except Exception as e:
+                                    logger.warning(f"[Grok] 流式回调错误: {e}")
+
+                elif msg_type == "error":
+                    error_code = msg.get("err_code", "")
+                    error_msg = msg.get("err_msg", "")
+                    logger.warning(f"[Grok] 错误: {error_code} - {error_msg}")
+                    error_info = {"error_code": error_code, "error": error_msg}
+
+                    if error_code == "rate_limit_exceeded":
                         return {
-                            "success": True,
-                            "urls": result_urls,
-                            "b64_list": result_b64,
-                            "count": len(result_urls)
+                            "success": False,
+                            "error_code": error_code,
+                            "error": error_msg
                         }
-                    elif error_info:
-                        return {"success": False, **error_info}
-                    else:
-                        # 检查是否是 blocked
-                        if progress.check_blocked():
-                            return {
-                                "success": False,
-                                "error_code": "blocked",
-                                "error": "生成被阻止，无法获取最终图片"
-                            }
-                        return {"success": False, "error": "未收到图片数据"}
+
+                # 收够 n 张后最多再等待 SURPLUS_HARVEST_WAIT 秒收集多余图片
+                if surplus_key and progress.completed >= n and harvest_at is None:
+                    harvest_at = loop.time() + settings.SURPLUS_HARVEST_WAIT
+
+                # 收集够最终图片后立即结束
+                if progress.completed >= target:
+                    logger.info(
+                        f"[Grok] 已收集 {progress.completed} 张最终图片 "
+                        f"({loop.time() - start_time:.1f}s)"
+                    )
+                    reusable = True
+                    break
+
+            # 保存最终图片
+            result_urls, result_b64 = await self._save_final_images(progress, n, return_b64)
+            if surplus_key and result_urls:
+                await self._store_surplus(progress, n, surplus_key)
+            logger.info(f"[Grok] 本次请求图片数据峰值: {progress.peak_bytes / 1024:.1f}KB")
+
+            if result_urls:
+                result = {
+                    "success": True,
+                    "urls": result_urls,
+                    "count": len(result_urls),
+                    "peak_memory": progress.peak_bytes
+                }
+                if return_b64:
+                    result["b64_list"] = result_b64
+                return result
+            elif error_info:
+                return {"success": False, **error_info}
+            else:
+                # 检查是否是 blocked
+                if progress.check_blocked():
+                    return {
+                        "success": False,
+                        "error_code": "blocked",
+                        "error": "生成被阻止，无法获取最终图片"
+                    }
+                return {"success": False, "error": "未收到图片数据"}
 
         except aiohttp.ClientError as e:
             logger.error(f"[Grok] 连接错误: {e}")
             return {"success": False, "error": f"连接失败: {e}"}
 
+        finally:
+            await self._ws_pool.release(stream, reusable=reusable)
+
+    async def _save_image(self, data: bytes, image_id: str, is_final: bool = True) -> Optional[str]:
+        """保存单张图片，返回访问 URL"""
+        ext = "jpg" if is_final else "png"
+        filename = f"{image_id}.{ext}"
+        size = await image_store.save(data, filename)
+        if size is None:
+            return None
+        return f"{settings.get_base_url()}/images/{filename}"
+
+    def _select_images(self, progress: GenerationProgress, n: int) -> List[ImageProgress]:
+        """选出作为结果的 n 张图片（只有最终图片保留数据，中间阶段不作为结果）"""
+        # 已落盘（URL 已推送）的图片排在最前，保证结果与推送的一致
+        return sorted(
+            (img for img in progress.images.values() if img.data or img.local_url),
+            key=lambda x: (bool(x.local_url), x.is_final, x.blob_size),
+            reverse=True
+        )[:n]
+
+    async def _store_surplus(
+        self,
+        progress: GenerationProgress,
+        n: int,
+        surplus_key: SurplusKey
+    ):
+        """保存结果之外的最终图片并放入多余图片池"""
+        selected = {img.image_id for img in self._select_images(progress, n)}
+        extras = [
+            img for img in progress.get_completed_images()
+            if img.image_id not in selected and img.data
+        ]
+        if not extras:
+            return
+
+        filenames = [f"{img.image_id}.jpg" for img in extras]
+        sizes = await image_store.save_many([
+            (img.data, filename) for img, filename in zip(extras, filenames)
+        ])
+        now = time.time()
+        surplus_pool.put(surplus_key, [
+            SurplusImage(
+                filename=filename,
+                url=f"{settings.get_base_url()}/images/{filename}",
+                created_at=now
+            )
+            for filename, size in zip(filenames, sizes)
+            if size is not None
+        ])
+
     async def _save_final_images(
         self,
         progress: GenerationProgress,
-        n: int
+        n: int,
+        return_b64: bool = False
     ) -> tuple[List[str], List[str]]:
-        """保存最终图片到本地，同时返回 URL 列表和 base64 列表"""
-        result_urls = []
-        result_b64 = []
-        settings.IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-
-        # 优先保存最终版本，如果没有则使用最大的版本
-        saved_ids = set()
+        """保存最终图片到本地，返回 URL 列表和 base64 列表（仅 return_b64 时生成）
 
-        for img in sorted(
-            progress.images.values(),
-            key=lambda x: (x.is_final, x.blob_size),
-            reverse=True
-        ):
-            if img.image_id in saved_ids:
+        已在接收时落盘的最终图片不再重复写入；其余图片的解码和写入在线程池中并行执行，不阻塞事件循环
+        """
+        selected = self._select_images(progress, n)
+        pending = [img for img in selected if not img.local_url]
+
+        # 根据是否是最终版本决定扩展名
+        filenames = [
+            f"{img.image_id}.{'jpg' if img.is_final else 'png'}"
+            for img in pending
+        ]
+        sizes = await image_store.save_many([
+            (img.data, filename) for img, filename in zip(pending, filenames)
+        ])
+        for img, filename, size in zip(pending, filenames, sizes):
+            if size is None:
                 continue
-            if len(saved_ids) >= n:
-                break
-
-            try:
-                image_data = base64.b64decode(img.blob)
-
-                # 根据是否是最终版本决定扩展名
-                ext = "jpg" if img.is_final else "png"
-                filename = f"{img.image_id}.{ext}"
-                filepath = settings.IMAGES_DIR / filename
-
-                with open(filepath, 'wb') as f:
-                    f.write(image_data)
-
-                url = f"{settings.get_base_url()}/images/{filename}"
-                result_urls.append(url)
-                result_b64.append(img.blob)
-                saved_ids.add(img.image_id)
-
-                logger.info(
-                    f"[Grok] 保存图片: {filename} "
-                    f"({len(image_data) / 1024:.1f}KB, {img.stage})"
-                )
+            img.local_url = f"{settings.get_base_url()}/images/{filename}"
+            logger.info(
+                f"[Grok] 保存图片: {filename} "
+                f"({size / 1024:.1f}KB, {img.stage})"
+            )
 
-            except Exception as e:
-                logger.error(f"[Grok] 保存图片失败: {e}")
+        result_urls = []
+        result_b64 = []
+        for img in selected:
+            if not img.local_url:
+                continue
+            result_urls.append(img.local_url)
+            if return_b64:
+                result_b64.append(await image_store.encode(img.data))
 
         return result_urls, result_b64
 
@@ -715,15 +1304,17 @@ class GrokImagineClient:
             await queue.put({
                 "type": "progress",
                 "image_id": img.image_id,
+                "job": img.job,
                 "stage": img.stage,
                 "blob_size": img.blob_size,
                 "is_final": img.is_final,
+                "url": img.local_url,
                 "completed": prog.completed,
                 "total": prog.total
             })
 
         async def generate_task():
-            result = await self.generate(
+            result = await self.generate_batch(
                 prompt=prompt,
                 aspect_ratio=aspect_ratio,
                 n=n,
@@ -0,0 +1,137 @@
+"""图片存储 - 在有界线程池中解码、编码并写入图片，避免阻塞事件循环"""
+
+import asyncio
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, List, Tuple, Dict, Any
+
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class ImageStore:
+    """图片落盘服务
+
+    base64 解码/编码和文件写入都在线程池中执行，同一次生成的多张图片并行写入。
+    写入先落到临时文件再原子替换，静态文件服务不会读到半张图片。
+    """
+
+    def __init__(self, images_dir: Path, max_workers: int = 4):
+        self.images_dir = images_dir
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="image-store"
+        )
+        self._pending = 0  # 已提交但未完成的任务数
+        self._stats = {
+            "saved": 0,
+            "failed": 0,
+            "bytes": 0,
+            "batches": 0,
+            "total_ms": 0.0,
+            "max_queue_depth": 0
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        """等待线程池空闲的任务数"""
+        return max(0, self._pending - self.max_workers)
+
+    async def decode(self, blob: str) -> bytes:
+        """在线程池中解码 base64 图片数据"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, base64.b64decode, blob)
+
+    async def encode(self, data: bytes) -> str:
+        """在线程池中将图片数据编码为 base64 字符串"""
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(self._executor, base64.b64encode, data)
+        return encoded.decode()
+
+    async def load(self, filename: str) -> Optional[bytes]:
+        """在线程池中读取已保存的图片，文件不存在时返回 None"""
+        filepath = self.images_dir / filename
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, filepath.read_bytes)
+        except OSError:
+            return None
+
+    def _write(self, image_data: bytes, filename: str) -> int:
+        """写入单张图片（在线程池中执行），返回写入字节数"""
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        filepath = self.images_dir / filename
+        tmp_path = filepath.with_name(f".{filename}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(image_data)
+        os.replace(tmp_path, filepath)
+        return len(image_data)
+
+    async def save(self, data: bytes, filename: str) -> Optional[int]:
+        """保存单张图片，失败返回 None"""
+        self._pending += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self.queue_depth)
+        try:
+            loop = asyncio.get_running_loop()
+            size = await loop.run_in_executor(self._executor, self._write, data, filename)
+            self._stats["saved"] += 1
+            self._stats["bytes"] += size
+            return size
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.error(f"[ImageStore] 保存图片失败 {filename}: {e}")
+            return None
+        finally:
+            self._pending -= 1
+
+    async def save_many(self, items: List[Tuple[bytes, str]]) -> List[Optional[int]]:
+        """并行保存多张图片
+
+        Args:
+            items: (图片数据, 文件名) 列表
+
+        Returns:
+            与 items 一一对应的写入字节数，失败为 None
+        """
+        if not items:
+            return []
+
+        start = time.perf_counter()
+        depth = self.queue_depth
+        sizes = await asyncio.gather(*(self.save(data, filename) for data, filename in items))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats["batches"] += 1
+        self._stats["total_ms"] += elapsed_ms
+
+        logger.info(
+            f"[ImageStore] 保存 {len(items)} 张图片耗时 {elapsed_ms:.1f}ms "
+            f"(排队 {depth})"
+        )
+        return sizes
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储统计"""
+        batches = self._stats["batches"]
+        return {
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "queue_depth": self.queue_depth,
+            "avg_batch_ms": round(self._stats["total_ms"] / batches, 1) if batches else 0,
+            **self._stats,
+            "total_ms": round(self._stats["total_ms"], 1)
+        }
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=True)
+
+
+# 全局实例
+image_store = ImageStore(
+    images_dir=settings.IMAGES_DIR,
+    max_workers=settings.IMAGE_WRITER_WORKERS
+)
@@ -0,0 +1,126 @@
+"""Redis SSO 状态的进程内缓存
+
+读多写少的池状态（熔断集合、连续失败的 key、状态接口的使用统计）在本进程缓存，
+最长 ttl 秒后重新读取；写入仍以 Redis 为准，写入方通过 pub/sub 广播失效消息，
+其他实例收到后立即丢弃对应缓存。订阅断开期间的变更最多延迟 ttl 秒可见。
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
+
+from app.core.logger import logger
+
+# 缓存未命中
+MISSING = object()
+
+
+class NearCache:
+    """带 TTL 与 pub/sub 失效的缓存
+
+    读取前记下 version()，放入时版本已变（读取期间收到失效）则不缓存，
+    避免把失效前读到的旧值放回缓存。
+    """
+
+    RECONNECT_DELAY = 1.0  # 订阅断开后重连的间隔（秒）
+
+    def __init__(self, ttl: float, channel: str):
+        self.ttl = ttl
+        self.channel = channel
+        self.instance_id = uuid.uuid4().hex[:8]
+        self._values: Dict[str, Tuple[float, Any]] = {}
+        self._version = 0
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed = False
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def version(self) -> int:
+        return self._version
+
+    def get(self, name: str) -> Any:
+        """读取缓存，过期或不存在时返回 MISSING"""
+        entry = self._values.get(name)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self._stats["misses"] += 1
+            return MISSING
+        self._stats["hits"] += 1
+        return entry[1]
+
+    def put(self, name: str, value: Any, version: int):
+        """放入缓存（ttl <= 0 或读取期间已失效时忽略）"""
+        if self.ttl > 0 and version == self._version:
+            self._values[name] = (time.monotonic(), value)
+
+    def invalidate(self, name: Optional[str] = None):
+        """丢弃一项或全部缓存"""
+        self._version += 1
+        self._stats["invalidations"] += 1
+        if name:
+            self._values.pop(name, None)
+        else:
+            self._values.clear()
+
+    async def publish(self, r, name: Optional[str] = None):
+        """本地立即失效，并通知其他实例（name 为 None 时失效全部缓存）"""
+        self.invalidate(name)
+        try:
+            await r.publish(self.channel, f"{self.instance_id}:{name or ''}")
+        except Exception as e:
+            logger.warning(f"[SSO-Redis] 广播缓存失效失败: {e}")
+
+    async def start(self, get_redis: Callable[[], Awaitable[Any]]):
+        """启动订阅任务（ttl <= 0 时不缓存，无需订阅）"""
+        if self.ttl <= 0 or (self._task and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._listen(get_redis))
+
+    async def close(self):
+        """停止订阅任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _listen(self, get_redis: Callable[[], Awaitable[Any]]):
+        """订阅失效消息，断开后重连"""
+        while True:
+            pubsub = None
+            try:
+                r = await get_redis()
+                pubsub = r.pubsub()
+                await pubsub.subscribe(self.channel)
+                self._subscribed = True
+                # 订阅建立前的变更可能已错过
+                self.invalidate()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    source, _, name = str(message["data"]).partition(":")
+                    if source != self.instance_id:
+                        self.invalidate(name or None)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"[SSO-Redis] 缓存失效订阅断开: {e}")
+                self.invalidate()
+                await asyncio.sleep(self.RECONNECT_DELAY)
+            finally:
+                self._subscribed = False
+                if pubsub is not None:
+                    try:
+                        await pubsub.reset()
+                    except Exception:
+                        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        return {
+            "ttl": self.ttl,
+            "subscribed": self._subscribed,
+            "entries": len(self._values),
+            **self._stats
+        }
@@ -1,21 +1,38 @@
 """SSO 密钥管理器 - Redis 版本
 
 支持功能：
-1. 每个 key 的使用次数限制 (24小时10次)
+1. 每个 key 的使用次数限制（滑动窗口：任意 24 小时内 10 次，每个 key 在最早一次使用移出窗口时恢复配额）
 2. 最后使用时间记录
 3. 多种轮询策略
 4. 持久化状态（重启不丢失）
 5. 分布式支持（多实例部署）
+6. 租约：选择与占用在服务端脚本内原子完成，多实例共享每个 key 的并发上限
+7. 熔断器：失败按原因分类冷却，冷却结束后以单个试探请求恢复（多实例共享）
+8. 遥测：本实例观测到的每个 key 的延迟与错误率 EWMA，供延迟感知策略使用
+9. 准入队列：没有可用容量时有限等待，容量释放时按到达顺序分配（本实例内排队）
+10. 热加载：监视 SSO 文件，只同步新增和删除的 key，已有 key 的使用统计不变
+11. 本地缓存：熔断状态与状态统计在进程内缓存，熔断变化通过 pub/sub 通知其他实例立即失效
 """
 
 from __future__ import annotations
 
 import asyncio
+import random
 import time
-from typing import Optional, List, Dict, Any
+import uuid
+from typing import Optional, List, Dict, Any, Set, Tuple
 from enum import Enum
 from app.core.config import settings
 from app.core.logger import logger
+from app.services.redis_sso_cache import NearCache, MISSING
+from app.services.redis_sso_scripts import (
+    SELECT_SCRIPT, USAGE_SCRIPT, RESET_SCRIPT, PROBE_SCRIPT, TRIP_SCRIPT, HEAL_SCRIPT
+)
+from app.services.sso_admission import AdmissionQueue, retry_after_seconds
+from app.services.sso_breaker import classify_failure, cooldown_seconds, failure_threshold
+from app.services.sso_file_watcher import SSOFileWatcher
+from app.services.sso_lock import TimedLock, lock_stats
+from app.services.sso_telemetry import KeyTelemetry
 
 try:
     import redis.asyncio as aioredis
@@ -33,6 +50,7 @@ class RotationStrategy(Enum):
     LEAST_RECENT = "least_recent"      # 最久未用优先
     WEIGHTED = "weighted"              # 权重轮询（剩余配额加权）
     HYBRID = "hybrid"                  # 混合策略（推荐）
+    LATENCY = "latency"                # 延迟感知（按实时遥测优先快速、健康的 key）
 
 
 class RedisSSOManager:
@@ -40,45 +58,102 @@ class RedisSSOManager:
 
     Redis 数据结构：
     - sso:keys              -> Set: 所有可用的 SSO key
-    - sso:failed            -> Set: 当前失败的 SSO key
-    - sso:usage:{key_hash}  -> Hash: {count: int, last_used: timestamp, first_used: timestamp}
-    - sso:index             -> String: 当前轮询索引（用于 round_robin）
-    - sso:daily_reset       -> String: 上次重置时间戳
+    - sso:failed            -> Set: 熔断中（含冷却结束等待试探）的 SSO key
+    - sso:tripped           -> Set: 连续失败次数大于 0 的 SSO key（成功时才需要清零）
+    - sso:usage:{key_hash}  -> Hash: {last_used: timestamp, first_used: timestamp,
+                                      trips: 连续失败次数, open_until: 冷却结束时间, fail_kind: 失败分类}
+    - sso:uses:{key_hash}   -> ZSet: 窗口内每次使用（score 为时间戳），窗口内次数即 ZCOUNT
+                               （手动重置后为 sso:uses:{generation}:{key_hash}，旧代的记录按 TTL 过期）
+    - sso:generation        -> String: 重置代数，手动重置时原子地加一
+    - sso:probe:{key_hash}  -> String: 半开试探请求的占用标记（带过期时间，多实例间只允许一个试探）
+    - sso:leases:{key_hash} -> ZSet: 进行中的租约（score 为过期时间），计入并发和配额，多实例共享
+    - sso:names             -> Hash: 短哈希 -> SSO（供服务端选择脚本使用）
+    - sso:hashes            -> Hash: SSO -> 短哈希（供服务端重置脚本使用）
+    - sso:by_count          -> ZSet: 有剩余配额的 key 按窗口内次数排序（least_used 按序查找，hybrid / weighted 取头部候选）
+    - sso:by_recent         -> ZSet: 有剩余配额的 key 按最后使用时间排序（least_recent / round_robin 按序查找，hybrid / weighted 取头部候选）
+    - sso:exhausted         -> ZSet: 配额用满的 key，score 为恢复配额的时间
+    - sso:open              -> ZSet: 熔断冷却中的 key（已移出 by_count / by_recent），score 为冷却结束时间
+    - sso:index_version     -> String: 索引版本，旧版数据启动时按使用统计重建索引
+    - sso:daily_reset       -> String: 上次手动重置时间戳
+    - sso:events            -> Pub/Sub: 缓存失效通知（见 redis_sso_cache）
     """
 
     # 配置
-    DAILY_LIMIT = 10           # 每个 key 每24小时限制次数
-    RESET_INTERVAL = 86400     # 24小时（秒）
+    DAILY_LIMIT = 10           # 每个 key 每个窗口限制次数
 
     # Redis key 前缀
     PREFIX = "sso:"
     KEYS_SET = f"{PREFIX}keys"
     FAILED_SET = f"{PREFIX}failed"
-    INDEX_KEY = f"{PREFIX}index"
+    TRIPPED_SET = f"{PREFIX}tripped"
+    EVENTS_CHANNEL = f"{PREFIX}events"
+    NAMES_KEY = f"{PREFIX}names"
+    HASHES_KEY = f"{PREFIX}hashes"
+    GENERATION_KEY = f"{PREFIX}generation"
+    BY_COUNT_KEY = f"{PREFIX}by_count"
+    BY_RECENT_KEY = f"{PREFIX}by_recent"
+    EXHAUSTED_KEY = f"{PREFIX}exhausted"
+    OPEN_KEY = f"{PREFIX}open"
+    INDEX_VERSION_KEY = f"{PREFIX}index_version"
+    INDEX_VERSION = 2
     DAILY_RESET_KEY = f"{PREFIX}daily_reset"
+    PROBE_TTL = 300  # 试探占用标记的过期时间（秒），防止实例崩溃后一直占用
+    LEASE_TTL = 600  # 租约的过期时间（秒），实例崩溃或归还失败时自动释放
 
     def __init__(
         self,
         redis_url: str = "redis://localhost:6379/0",
         strategy: RotationStrategy = RotationStrategy.HYBRID,
-        daily_limit: int = 10
+        daily_limit: int = 10,
+        max_inflight: int = 0
     ):
         self.redis_url = redis_url
         self.strategy = strategy
         self.DAILY_LIMIT = daily_limit
+        self.quota_window = settings.SSO_QUOTA_WINDOW
+        self.max_inflight = max_inflight
+        self._inflight: Dict[str, int] = {}  # 本实例进行中的请求数
         self._redis = None
-        self._lock = asyncio.Lock()
+        self._leases: Dict[str, List[str]] = {}  # 本实例持有的租约 id
+        self._release_tasks: Set[asyncio.Task] = set()
+        self._select_script = None
+        self._usage_script = None
+        self._reset_script = None
+        self._probe_script = None
+        self._trip_script = None
+        self._heal_script = None
+        self._lock = TimedLock()
+        # key 按位置分到若干分片，latency 策略每次选择只把一个分片的 key 交给脚本检查
+        self._shard_count = max(1, settings.SSO_LOCK_SHARDS)
+        self._shards: List[List[str]] = []
+        self._exhausted_lock = TimedLock()
+        self._next_shard = 0
         self._sso_list: List[str] = []  # 本地缓存
+        self._ids: Dict[str, int] = {}  # SSO -> 在列表中的位置（遥测 id）
+        self._by_hash: Dict[str, str] = {}  # 短哈希 -> SSO
+        self._telemetry = KeyTelemetry(settings.SSO_TELEMETRY_ALPHA)
+        self._admission = AdmissionQueue(settings.SSO_ADMISSION_WAIT, settings.SSO_ADMISSION_MAX_QUEUE)
+        self._watcher = SSOFileWatcher(settings.SSO_FILE, settings.SSO_RELOAD_INTERVAL, self.reload)
+        self._cache = NearCache(settings.REDIS_CACHE_TTL, self.EVENTS_CHANNEL)
         self._initialized = False
 
     async def _get_redis(self):
-        """获取 Redis 连接"""
+        """获取 Redis 连接
+
+        连接池大小有上限，连接用满时最多等待 REDIS_TIMEOUT 秒；每次操作的读写超时同为
+        REDIS_TIMEOUT，Redis 变慢时请求快速失败，由 FailoverSSOManager 转为本地记账
+        """
         if self._redis is None:
-            self._redis = aioredis.from_url(
+            pool = aioredis.BlockingConnectionPool.from_url(
                 self.redis_url,
                 encoding="utf-8",
-                decode_responses=True
+                decode_responses=True,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_TIMEOUT,
+                socket_timeout=settings.REDIS_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT
             )
+            self._redis = aioredis.Redis(connection_pool=pool)
         return self._redis
 
     def _key_hash(self, sso: str) -> str:
@@ -90,6 +165,91 @@ class RedisSSOManager:
         """获取某个 SSO 的使用统计 Redis key"""
         return f"{self.PREFIX}usage:{self._key_hash(sso)}"
 
+    def _uses_key(self, sso: str, generation: str = "0") -> str:
+        """获取某个 SSO 在某一重置代数下的窗口内使用记录 Redis key（第 0 代沿用旧的 key 名）"""
+        if generation == "0":
+            return f"{self.PREFIX}uses:{self._key_hash(sso)}"
+        return f"{self.PREFIX}uses:{generation}:{self._key_hash(sso)}"
+
+    async def _get_generation(self, r) -> str:
+        """当前重置代数（优先读本地缓存，重置时通过 pub/sub 失效）"""
+        generation = self._cache.get("generation")
+        if generation is MISSING:
+            version = self._cache.version()
+            generation = await r.get(self.GENERATION_KEY) or "0"
+            self._cache.put("generation", generation, version)
+        return generation
+
+    async def _get_usage(self, r, sso: str) -> Dict[str, Any]:
+        """读取使用统计，count 为滑动窗口内的使用次数"""
+        generation = await self._get_generation(r)
+        pipe = r.pipeline()
+        pipe.hgetall(self._usage_key(sso))
+        pipe.zcount(self._uses_key(sso, generation), time.time() - self.quota_window, "+inf")
+        usage, count = await pipe.execute()
+        usage["count"] = count
+        return usage
+
+    async def _get_usage_snapshot(self, r) -> Dict[str, Dict[str, Any]]:
+        """所有 key 的使用统计（一次 pipeline 读取，优先读本地缓存，最长 ttl 秒前的数据）"""
+        usages = self._cache.get("usage")
+        if usages is not MISSING:
+            return usages
+
+        version = self._cache.version()
+        generation = await self._get_generation(r)
+        sso_list = self._sso_list
+        window_start = time.time() - self.quota_window
+        pipe = r.pipeline()
+        for sso in sso_list:
+            pipe.hgetall(self._usage_key(sso))
+            pipe.zrangebyscore(self._uses_key(sso, generation), window_start, "+inf", withscores=True)
+        rows = await pipe.execute()
+
+        usages = {}
+        for i, sso in enumerate(sso_list):
+            usage, uses = rows[2 * i], rows[2 * i + 1]
+            usage["count"] = len(uses)
+            # 用满时为第 (次数 - 上限 + 1) 早的使用移出窗口的时间
+            usage["next_slot_at"] = (
+                uses[len(uses) - self.DAILY_LIMIT][1] + self.quota_window
+                if len(uses) >= self.DAILY_LIMIT else 0.0
+            )
+            usages[sso] = usage
+        self._cache.put("usage", usages, version)
+        return usages
+
+    async def _next_slot_at(self, r, sso: str, count: int) -> float:
+        """key 下一次有可用配额的时间：未用满返回 0，用满为窗口内最早一次使用移出窗口的时刻"""
+        if count < self.DAILY_LIMIT:
+            return 0.0
+        oldest = await r.zrangebyscore(
+            self._uses_key(sso, await self._get_generation(r)), time.time() - self.quota_window, "+inf",
+            start=0, num=1, withscores=True
+        )
+        return oldest[0][1] + self.quota_window if oldest else 0.0
+
+    def _leases_key(self, sso: str) -> str:
+        """获取某个 SSO 的租约 Redis key"""
+        return f"{self.PREFIX}leases:{self._key_hash(sso)}"
+
+    def _probe_key(self, sso: str) -> str:
+        """获取某个 SSO 的半开试探占用标记 Redis key"""
+        return f"{self.PREFIX}probe:{self._key_hash(sso)}"
+
+    async def _get_health(self, r) -> Tuple[Set[str], Set[str]]:
+        """熔断中的 key 与连续失败次数大于 0 的 key（优先读本地缓存）"""
+        health = self._cache.get("health")
+        if health is MISSING:
+            version = self._cache.version()
+            pipe = r.pipeline()
+            pipe.smembers(self.FAILED_SET)
+            pipe.smembers(self.TRIPPED_SET)
+            failed, tripped = await pipe.execute()
+            health = (set(failed), set(tripped))
+            self._cache.put("health", health, version)
+        return health
+
     async def initialize(self) -> int:
         """初始化：加载 SSO 列表到 Redis"""
         async with self._lock:
@@ -98,321 +258,621 @@ class RedisSSOManager:
 
             # 从文件加载
             self._sso_list = self._load_from_file()
+            self._load_telemetry()
             if not self._sso_list:
                 return 0
 
             r = await self._get_redis()
 
-            # 检查是否需要每日重置
-            await self._check_daily_reset(r)
-
             # 同步到 Redis
             pipe = r.pipeline()
             pipe.delete(self.KEYS_SET)
-            for sso in self._sso_list:
-                pipe.sadd(self.KEYS_SET, sso)
-                # 初始化使用统计（如果不存在）
-                usage_key = self._usage_key(sso)
-                pipe.hsetnx(usage_key, "count", 0)
-                pipe.hsetnx(usage_key, "last_used", 0)
-                pipe.hsetnx(usage_key, "first_used", int(time.time()))
+            self._add_keys(pipe, self._sso_list)
             await pipe.execute()
 
+            await self._migrate_daily_counts(r)
+
+            if await r.get(self.INDEX_VERSION_KEY) != str(self.INDEX_VERSION):
+                logger.info("[SSO-Redis] 按使用统计建立排序索引")
+            await self._build_indexes(r, self._sso_list, reset=True)
+
             self._initialized = True
             logger.info(f"[SSO-Redis] 初始化完成，加载了 {len(self._sso_list)} 个 SSO")
             return len(self._sso_list)
 
+    def _add_keys(self, pipe, sso_list: List[str]):
+        """在 pipeline 中登记 key 并初始化其使用统计（已存在的统计保持不变）"""
+        now = int(time.time())
+        for sso in sso_list:
+            pipe.sadd(self.KEYS_SET, sso)
+            pipe.hset(self.NAMES_KEY, self._key_hash(sso), sso)
+            pipe.hset(self.HASHES_KEY, sso, self._key_hash(sso))
+            usage_key = self._usage_key(sso)
+            pipe.hsetnx(usage_key, "last_used", 0)
+            pipe.hsetnx(usage_key, "first_used", now)
+
+    def _load_telemetry(self):
+        """按新的 key 列表重建遥测 id 和分片，保留已积累的指标"""
+        count = min(self._shard_count, len(self._sso_list)) or 1
+        self._shards = [self._sso_list[i::count] for i in range(count)] if self._sso_list else []
+        old_ids = self._ids
+        self._ids = {sso: key_id for key_id, sso in enumerate(self._sso_list)}
+        self._by_hash = {self._key_hash(sso): sso for sso in self._sso_list}
+        telemetry = KeyTelemetry(settings.SSO_TELEMETRY_ALPHA, len(self._sso_list))
+        telemetry.copy_rows(self._telemetry, {
+            old_id: self._ids[sso] for sso, old_id in old_ids.items() if sso in self._ids
+        })
+        self._telemetry = telemetry
+
     def _load_from_file(self) -> List[str]:
-        """从文件加载 SSO 列表"""
-        sso_list = []
+        """从文件加载 SSO 列表（去重并保持顺序）"""
         sso_file = settings.SSO_FILE
 
         if not sso_file.exists():
             logger.warning(f"[SSO-Redis] 文件不存在: {sso_file}")
-            return sso_list
+            return []
 
         with open(sso_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                sso = line.strip()
-                if sso and not sso.startswith('#'):
-                    sso_list.append(sso)
+            lines = (line.strip() for line in f.read().splitlines())
+            return list(dict.fromkeys(
+                sso for sso in lines if sso and not sso.startswith('#')
+            ))
 
-        return sso_list
+    async def _migrate_daily_counts(self, r):
+        """将旧版每日计数（usage 中的 count 字段）转为窗口内使用记录
 
-    async def _check_daily_reset(self, r):
-        """检查并执行每日重置"""
-        now = int(time.time())
-        last_reset = await r.get(self.DAILY_RESET_KEY)
+        只有次数时按全部发生在最后使用时刻估算（保守：同时移出窗口）
+        """
+        pipe = r.pipeline()
+        for sso in self._sso_list:
+            pipe.hmget(self._usage_key(sso), "count", "last_used")
+        rows = await pipe.execute()
 
-        if last_reset is None:
-            # 首次运行
-            await r.set(self.DAILY_RESET_KEY, now)
-            return
+        pipe = r.pipeline()
+        migrated = 0
+        for sso, (count, last_used) in zip(self._sso_list, rows):
+            if count is None:
+                continue
+            count = min(int(count), self.DAILY_LIMIT)
+            last_used = float(last_used or 0)
+            if count and last_used > time.time() - self.quota_window:
+                uses_key = self._uses_key(sso)
+                pipe.zadd(uses_key, {f"{last_used}:{i}": last_used for i in range(count)})
+                pipe.expireat(uses_key, int(last_used + self.quota_window) + 1)
+            pipe.hdel(self._usage_key(sso), "count")
+            migrated += 1
+        if migrated:
+            await pipe.execute()
+            logger.info(f"[SSO-Redis] 已将 {migrated} 个 key 的每日计数迁移为滑动窗口")
+
+    async def _build_indexes(self, r, sso_list: List[str], reset: bool = False):
+        """按使用统计为 key 建立排序索引和 tripped 集合（reset 时先清空，只保留给出的 key）
+
+        熔断中的 key 登记到 open，冷却结束后由选择脚本移回索引
+        """
+        now = time.time()
+        window_start = now - self.quota_window
+        generation = await self._get_generation(r)
+        failed = await r.smembers(self.FAILED_SET)
+        pipe = r.pipeline()
+        for sso in sso_list:
+            pipe.zrangebyscore(self._uses_key(sso, generation), window_start, "+inf", withscores=True)
+            pipe.hmget(self._usage_key(sso), "last_used", "leased_at", "trips", "open_until")
+        rows = await pipe.execute()
+
+        pipe = r.pipeline(transaction=True)
+        if reset:
+            pipe.delete(
+                self.BY_COUNT_KEY, self.BY_RECENT_KEY, self.EXHAUSTED_KEY, self.OPEN_KEY, self.TRIPPED_SET
+            )
+        for i, sso in enumerate(sso_list):
+            uses, (last_used, leased_at, trips, open_until) = rows[2 * i], rows[2 * i + 1]
+            key_hash = self._key_hash(sso)
+            if int(trips or 0) > 0:
+                pipe.sadd(self.TRIPPED_SET, sso)
+            if sso in failed:
+                pipe.zrem(self.BY_COUNT_KEY, key_hash)
+                pipe.zrem(self.BY_RECENT_KEY, key_hash)
+                pipe.zrem(self.EXHAUSTED_KEY, key_hash)
+                pipe.zadd(self.OPEN_KEY, {key_hash: float(open_until or 0)})
+                continue
+            pipe.zrem(self.OPEN_KEY, key_hash)
+            if len(uses) >= self.DAILY_LIMIT:
+                # 第 (次数 - 上限 + 1) 早的使用移出窗口时恢复配额
+                recover_at = uses[len(uses) - self.DAILY_LIMIT][1] + self.quota_window
+                pipe.zrem(self.BY_COUNT_KEY, key_hash)
+                pipe.zrem(self.BY_RECENT_KEY, key_hash)
+                pipe.zadd(self.EXHAUSTED_KEY, {key_hash: recover_at})
+            else:
+                pipe.zrem(self.EXHAUSTED_KEY, key_hash)
+                pipe.zadd(self.BY_COUNT_KEY, {key_hash: len(uses)})
+                pipe.zadd(self.BY_RECENT_KEY, {
+                    key_hash: max(float(last_used or 0), float(leased_at or 0))
+                })
+        pipe.set(self.INDEX_VERSION_KEY, self.INDEX_VERSION)
+        await pipe.execute()
+
+    def _drop_indexes(self, pipe, sso_list: List[str]):
+        """在 pipeline 中把 key 移出排序索引"""
+        hashes = [self._key_hash(sso) for sso in sso_list]
+        for key in (self.BY_COUNT_KEY, self.BY_RECENT_KEY, self.EXHAUSTED_KEY, self.OPEN_KEY):
+            pipe.zrem(key, *hashes)
 
-        last_reset = int(last_reset)
-        if now - last_reset >= self.RESET_INTERVAL:
-            logger.info("[SSO-Redis] 执行每日重置...")
-            # 重置所有 key 的使用次数
-            for sso in self._sso_list:
-                usage_key = self._usage_key(sso)
-                await r.hset(usage_key, "count", 0)
-            # 清空失败列表
-            await r.delete(self.FAILED_SET)
-            # 更新重置时间
-            await r.set(self.DAILY_RESET_KEY, now)
-            logger.info("[SSO-Redis] 每日重置完成")
-
-    async def get_next_sso(self) -> Optional[str]:
-        """获取下一个可用的 SSO"""
+    async def get_next_sso(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """获取下一个可用的 SSO（不占用租约）
+
+        Args:
+            exclude: 需要排除的 SSO（如对冲请求需要与主请求使用不同的 key）
+        """
         if not self._initialized:
             await self.initialize()
-
         if not self._sso_list:
             return None
 
         r = await self._get_redis()
+        sso = await self._select(None if self._indexed else self._sso_list, exclude)
+        if sso is None:
+            return await self._handle_all_exhausted(r, exclude)
+        return sso
 
-        # 检查每日重置
-        await self._check_daily_reset(r)
-
-        # 根据策略选择
-        if self.strategy == RotationStrategy.ROUND_ROBIN:
-            return await self._get_round_robin(r)
-        elif self.strategy == RotationStrategy.LEAST_USED:
-            return await self._get_least_used(r)
-        elif self.strategy == RotationStrategy.LEAST_RECENT:
-            return await self._get_least_recent(r)
-        elif self.strategy == RotationStrategy.WEIGHTED:
-            return await self._get_weighted(r)
-        else:  # HYBRID
-            return await self._get_hybrid(r)
-
-    async def _get_available_keys(self, r) -> List[str]:
-        """获取所有可用的 key（未失败且未超限）"""
-        failed = await r.smembers(self.FAILED_SET)
-        available = []
-
-        for sso in self._sso_list:
-            if sso in failed:
-                continue
+    @property
+    def _indexed(self) -> bool:
+        """当前策略是否按排序索引查找（只有 latency 需要本地遥测得分，逐个分片比较候选 key）"""
+        return self.strategy != RotationStrategy.LATENCY
 
-            # 检查使用次数
-            usage = await r.hgetall(self._usage_key(sso))
-            count = int(usage.get("count", 0))
-            if count >= self.DAILY_LIMIT:
-                continue
+    async def _select(
+        self,
+        keys: Optional[List[str]],
+        exclude: Optional[Set[str]] = None,
+        lease_id: Optional[str] = None
+    ) -> Optional[str]:
+        """在 Redis 内一次往返完成过滤、按策略选择，并在给出 lease_id 时原子地占用租约
+
+        Args:
+            keys: 候选 key，为 None 时沿排序索引查找（least_used / least_recent）
+            exclude: 需要排除的 SSO
+            lease_id: 租约 id，为 None 时只选择不占用
+        """
+        r = await self._get_redis()
+        if self._select_script is None:
+            self._select_script = r.register_script(SELECT_SCRIPT)
+
+        args = [
+            time.time(), self.quota_window, self.DAILY_LIMIT, self.max_inflight,
+            self.LEASE_TTL, lease_id or "", self.PROBE_TTL, self.strategy.value,
+            random.random(), 1 if lease_id else 0, self.PREFIX
+        ]
+        if keys is None:
+            args.append("index")
+            args.extend(self._key_hash(sso) for sso in exclude or ())
+        else:
+            args.append("scan")
+            latency = self.strategy == RotationStrategy.LATENCY
+            for sso in keys:
+                if exclude and sso in exclude:
+                    continue
+                args.append(self._key_hash(sso))
+                args.append(self._telemetry.score(self._ids[sso]) if latency else 1)
+            if len(args) == 12:
+                return None
+
+        key_hash = await self._select_script(keys=[], args=args)
+        return self._by_hash.get(key_hash) if key_hash else None
+
+    async def acquire(
+        self,
+        exclude: Optional[Set[str]] = None,
+        wait: Optional[float] = None
+    ) -> Optional[str]:
+        """选择一个 SSO 并占用租约，使用完毕后必须调用 release()
+
+        选择与占用在 Redis 脚本内原子完成，租约保存在 Redis 中：
+        多个实例共享并发上限，不会把同一个 key 的最后一次配额分给两个请求；
+        没有可用容量时进入准入队列等待（见 sso_admission）
+
+        Args:
+            exclude: 需要排除的 SSO
+            wait: 最长等待秒数，默认 SSO_ADMISSION_WAIT；0 表示不等待
+        """
+        return await self._admission.admit(
+            lambda: self._try_acquire(exclude), self._next_free_at, wait
+        )
 
-            available.append(sso)
+    async def _try_acquire(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """立即选择并占用一个 SSO，没有可用容量时返回 None
 
-        return available
+        除 latency 外的策略沿排序索引一次脚本调用完成，检查的 key 数与池大小无关
+        （hybrid / weighted 在 by_count 与 by_recent 头部的候选中评分，见 redis_sso_scripts）；
+        latency 的得分来自本实例遥测，只能随脚本传入，从轮到的分片开始每个分片一次脚本调用，
+        没有可用 key 时依次尝试下一个分片：单次 O(N / 分片数)，池耗尽时最多 SSO_LOCK_SHARDS 次往返
+        （分片只用于限制单次脚本检查的 key 数，原子性由 Redis 保证，无需本地锁）
+        """
+        if not self._initialized:
+            await self.initialize()
+        shards = self._shards
+        if not shards:
+            return None
 
-    async def _get_round_robin(self, r) -> Optional[str]:
-        """简单轮询"""
-        available = await self._get_available_keys(r)
-        if not available:
-            return await self._handle_all_exhausted(r)
+        lease_id = uuid.uuid4().hex[:12]
+        if self._indexed:
+            sso = await self._select(None, exclude, lease_id)
+            if sso:
+                return self._add_lease(sso, lease_id)
+        else:
+            start = self._next_shard % len(shards)
+            self._next_shard = start + 1
+            for offset in range(len(shards)):
+                sso = await self._select(shards[(start + offset) % len(shards)], exclude, lease_id)
+                if sso:
+                    return self._add_lease(sso, lease_id)
+
+        # 所有分片都没有可用 key：按全池耗尽处理（全部熔断时提前试探）
+        if exclude:
+            return None
+        async with self._exhausted_lock:
+            r = await self._get_redis()
+            sso = await self._handle_all_exhausted(r)
+            if sso and await self._select([sso], lease_id=lease_id):
+                return self._add_lease(sso, lease_id)
+            return None
 
-        # 获取并递增索引
-        index = await r.incr(self.INDEX_KEY)
-        index = (index - 1) % len(available)
+    def _add_lease(self, sso: str, lease_id: str) -> str:
+        """登记本实例持有的租约"""
+        self._leases.setdefault(sso, []).append(lease_id)
+        self._inflight[sso] = self._inflight.get(sso, 0) + 1
+        return sso
 
-        return available[index]
+    def release(self, sso: str):
+        """归还 acquire() 占用的租约（同步执行，可在 finally 中安全调用）
 
-    async def _get_least_used(self, r) -> Optional[str]:
-        """最少使用优先"""
-        available = await self._get_available_keys(r)
-        if not available:
-            return await self._handle_all_exhausted(r)
+        本地计数立即更新，Redis 中的租约在后台删除（失败时按 LEASE_TTL 自动过期）
+        """
+        leases = self._leases.get(sso)
+        if not leases:
+            return
+        lease_id = leases.pop()
+        if not leases:
+            del self._leases[sso]
+        count = self._inflight.get(sso, 0)
+        if count > 1:
+            self._inflight[sso] = count - 1
+        else:
+            self._inflight.pop(sso, None)
+
+        task = asyncio.get_running_loop().create_task(self._drop_lease(sso, lease_id))
+        self._release_tasks.add(task)
+        task.add_done_callback(self._release_tasks.discard)
+
+    async def _drop_lease(self, sso: str, lease_id: str):
+        """删除 Redis 中的租约并唤醒排队的请求"""
+        try:
+            r = await self._get_redis()
+            await r.zrem(self._leases_key(sso), lease_id)
+        except Exception as e:
+            logger.warning(f"[SSO-Redis] 归还租约失败（将自动过期）: {e}")
+        self._admission.notify()
 
-        # 获取使用次数最少的
-        min_count = float('inf')
-        selected = available[0]
+    async def _next_free_at(self) -> Tuple[Optional[float], bool]:
+        """最早到期恢复容量的时间（使用记录移出窗口且熔断冷却结束），以及本实例是否有进行中的请求
 
-        for sso in available:
-            usage = await r.hgetall(self._usage_key(sso))
-            count = int(usage.get("count", 0))
-            if count < min_count:
-                min_count = count
-                selected = sso
-
-        return selected
-
-    async def _get_least_recent(self, r) -> Optional[str]:
-        """最久未用优先"""
-        available = await self._get_available_keys(r)
-        if not available:
-            return await self._handle_all_exhausted(r)
-
-        # 获取最久未使用的
-        oldest_time = float('inf')
-        selected = available[0]
-
-        for sso in available:
-            usage = await r.hgetall(self._usage_key(sso))
-            last_used = int(usage.get("last_used", 0))
-            if last_used < oldest_time:
-                oldest_time = last_used
-                selected = sso
-
-        return selected
-
-    async def _get_weighted(self, r) -> Optional[str]:
-        """权重轮询（剩余配额作为权重）"""
-        import random
-
-        available = await self._get_available_keys(r)
-        if not available:
-            return await self._handle_all_exhausted(r)
-
-        # 计算权重
-        weights = []
-        for sso in available:
-            usage = await r.hgetall(self._usage_key(sso))
-            count = int(usage.get("count", 0))
-            remaining = self.DAILY_LIMIT - count
-            weights.append(max(1, remaining))  # 至少为1
-
-        # 加权随机选择
-        total = sum(weights)
-        r_val = random.uniform(0, total)
-        cumulative = 0
-        for i, w in enumerate(weights):
-            cumulative += w
-            if r_val <= cumulative:
-                return available[i]
-
-        return available[-1]
-
-    async def _get_hybrid(self, r) -> Optional[str]:
-        """混合策略：综合考虑剩余配额和最后使用时间
-
-        评分公式: score = remaining_quota * time_factor
-        - remaining_quota: 剩余配额 (1-10)
-        - time_factor: 时间因子，距上次使用越久分数越高
+        未熔断的 key 直接取 exhausted 索引中最早的恢复时间，熔断中的 key 单独比较
         """
-        available = await self._get_available_keys(r)
-        if not available:
-            return await self._handle_all_exhausted(r)
+        if not self._sso_list:
+            return None, bool(self._inflight)
 
+        r = await self._get_redis()
         now = time.time()
-        best_score = -1
-        selected = available[0]
-
-        for sso in available:
-            usage = await r.hgetall(self._usage_key(sso))
-            count = int(usage.get("count", 0))
-            last_used = int(usage.get("last_used", 0))
-
-            remaining = self.DAILY_LIMIT - count
-            # 时间因子：每分钟 +0.1 分，最高 +10 分
-            if last_used == 0:
-                time_factor = 10  # 从未使用过，给最高分
-            else:
-                minutes_ago = (now - last_used) / 60
-                time_factor = min(10, minutes_ago * 0.1)
+        failed, _ = await self._get_health(r)
+        failed = [sso for sso in failed if sso in self._ids]
+        failed_hashes = {self._key_hash(sso) for sso in failed}
 
-            score = remaining * (1 + time_factor)
-
-            if score > best_score:
-                best_score = score
-                selected = sso
-
-        return selected
+        pipe = r.pipeline()
+        pipe.zrangebyscore(
+            self.EXHAUSTED_KEY, f"({now}", "+inf", start=0, num=len(failed) + 1, withscores=True
+        )
+        for sso in failed:
+            pipe.hget(self._usage_key(sso), "open_until")
+            pipe.zscore(self.EXHAUSTED_KEY, self._key_hash(sso))
+        rows = await pipe.execute()
+
+        free_at = next((at for key_hash, at in rows[0] if key_hash not in failed_hashes), None)
+        for i in range(len(failed)):
+            open_until, recover_at = rows[1 + 2 * i:3 + 2 * i]
+            # 配额和熔断都恢复后 key 才可用
+            at = max(float(open_until or 0), float(recover_at or 0))
+            if at > now and (free_at is None or at < free_at):
+                free_at = at
+        return free_at, bool(self._inflight)
+
+    async def retry_after(self) -> int:
+        """没有可用容量时建议客户端重试的间隔（秒），用于 Retry-After
+
+        本实例进行中的请求按全池平均耗时估计其完成时间
+        """
+        now = time.time()
+        free_at, pending = await self._next_free_at()
+        if pending:
+            finish_at = now + (self._telemetry.pool_final or 1.0)
+            free_at = finish_at if free_at is None else min(free_at, finish_at)
+        return retry_after_seconds(free_at, now)
 
-    async def _handle_all_exhausted(self, r) -> Optional[str]:
+    async def _handle_all_exhausted(self, r, exclude: Optional[Set[str]] = None) -> Optional[str]:
         """处理所有 key 都用完的情况"""
+        if exclude:
+            # 排除后没有可用 key 不代表整个池已耗尽
+            return None
+
         logger.warning("[SSO-Redis] 所有 SSO 都已耗尽或失败")
 
-        # 检查是否所有 key 都是因为失败而不可用
-        failed = await r.smembers(self.FAILED_SET)
-        if len(failed) == len(self._sso_list):
-            # 所有 key 都失败了，重置失败列表
-            await r.delete(self.FAILED_SET)
-            logger.info("[SSO-Redis] 重置失败列表")
-            return self._sso_list[0] if self._sso_list else None
+        # 所有 key 都熔断且没有进行中的试探时，提前试探冷却最先结束的 key，避免服务完全中断
+        # （判断与选择在 Redis 脚本内一次往返完成）
+        if self._probe_script is None:
+            self._probe_script = r.register_script(PROBE_SCRIPT)
+        sso = await self._probe_script(keys=[], args=[self.PREFIX])
+        if sso:
+            logger.info(f"[SSO-Redis] 所有 SSO 都在熔断中，提前试探: {sso[:20]}...")
+            return sso
 
         # 否则是配额用完，返回 None
         return None
 
-    async def record_usage(self, sso: str):
-        """记录使用（调用后更新统计）"""
+    async def record_usage(self, sso: str, at: Optional[float] = None):
+        """记录使用（调用后更新统计）
+
+        Args:
+            at: 使用时间，默认为当前时间（Redis 恢复后补写降级期间的记录时传入原时间）
+        """
         r = await self._get_redis()
-        usage_key = self._usage_key(sso)
-        now = int(time.time())
+        if self._usage_script is None:
+            self._usage_script = r.register_script(USAGE_SCRIPT)
+        now = time.time() if at is None else at
 
-        pipe = r.pipeline()
-        pipe.hincrby(usage_key, "count", 1)
-        pipe.hset(usage_key, "last_used", now)
-        await pipe.execute()
+        # 写入使用记录与更新排序索引在同一脚本内完成；成员需唯一，同一时刻的多次使用分别计数
+        await self._usage_script(keys=[], args=[
+            now, self.quota_window, self.DAILY_LIMIT, self.PREFIX,
+            self._key_hash(sso), f"{now}:{uuid.uuid4().hex[:8]}"
+        ])
 
         logger.debug(f"[SSO-Redis] 记录使用: {sso[:20]}...")
 
-    async def mark_failed(self, sso: str, reason: str = ""):
-        """标记 SSO 为失败"""
+    async def mark_failed(self, sso: str, reason: str = "", error_code: str = ""):
+        """记录一次失败，按失败分类决定是否熔断及冷却时间
+
+        Args:
+            reason: 失败原因（日志用）
+            error_code: 错误码，用于失败分类（见 classify_failure）
+        """
+        kind = classify_failure(error_code)
         r = await self._get_redis()
-        await r.sadd(self.FAILED_SET, sso)
-        logger.warning(f"[SSO-Redis] 标记失败: {sso[:20]}... 原因: {reason}")
+        usage_key = self._usage_key(sso)
+
+        pipe = r.pipeline()
+        pipe.hincrby(usage_key, "trips", 1)
+        pipe.hset(usage_key, "fail_kind", kind.value)
+        pipe.sismember(self.FAILED_SET, sso)
+        pipe.sadd(self.TRIPPED_SET, sso)
+        failures, _, half_open, newly_tripped = await pipe.execute()
+
+        if half_open:
+            # 试探失败立即重新熔断
+            cooldown = cooldown_seconds(kind, max(failures, failure_threshold(kind)))
+        else:
+            cooldown = cooldown_seconds(kind, failures)
+
+        if cooldown:
+            open_until = time.time() + cooldown
+            pipe = r.pipeline()
+            pipe.hset(usage_key, "open_until", open_until)
+            pipe.sadd(self.FAILED_SET, sso)
+            pipe.delete(self._probe_key(sso))
+            await pipe.execute()
+            # 冷却期间移出排序索引，沿索引选择时不必逐个跳过熔断的 key
+            if self._trip_script is None:
+                self._trip_script = r.register_script(TRIP_SCRIPT)
+            await self._trip_script(keys=[], args=[self.PREFIX, self._key_hash(sso), open_until])
+            await self._cache.publish(r)
+            logger.warning(
+                f"[SSO-Redis] 熔断: {sso[:20]}... ({kind.value}, 连续失败 {failures} 次, "
+                f"冷却 {cooldown:.0f}s) 原因: {reason}"
+            )
+        else:
+            if newly_tripped:
+                await self._cache.publish(r)
+            logger.warning(
+                f"[SSO-Redis] 请求失败: {sso[:20]}... ({kind.value}, 连续失败 {failures} 次) 原因: {reason}"
+            )
 
     async def mark_success(self, sso: str):
-        """标记 SSO 为成功（从失败列表移除）"""
+        """标记 SSO 为成功（关闭熔断器，清零连续失败次数）
+
+        本地缓存显示 key 既未熔断也没有连续失败时（绝大多数成功请求）不访问 Redis
+        """
+        r = await self._get_redis()
+        failed, tripped = await self._get_health(r)
+        if sso not in failed and sso not in tripped:
+            return
+
+        pipe = r.pipeline()
+        pipe.srem(self.FAILED_SET, sso)
+        pipe.srem(self.TRIPPED_SET, sso)
+        pipe.hset(self._usage_key(sso), mapping={"trips": 0, "open_until": 0})
+        pipe.delete(self._probe_key(sso))
+        removed, _, _, _ = await pipe.execute()
+        if removed:
+            # 冷却中直接成功（如熔断前发出的请求）时立即移回排序索引
+            if self._heal_script is None:
+                self._heal_script = r.register_script(HEAL_SCRIPT)
+            await self._heal_script(keys=[], args=[
+                time.time(), self.quota_window, self.DAILY_LIMIT, self.PREFIX, self._key_hash(sso)
+            ])
+        await self._cache.publish(r)
+        if removed:
+            logger.info(f"[SSO-Redis] 熔断恢复: {sso[:20]}...")
+            self._admission.notify()
+
+    async def filter_available(self, ssos: List[str]) -> List[str]:
+        """从给定的 SSO（如 API Key 专用 SSO）中筛选当前可用的：不在熔断冷却中且窗口内仍有配额
+
+        使用记录和熔断状态对池外的 key 同样记录在 Redis 中，一次 pipeline 读取
+        """
+        if not ssos:
+            return []
         r = await self._get_redis()
-        await r.srem(self.FAILED_SET, sso)
+        now = time.time()
+        generation = await self._get_generation(r)
+        pipe = r.pipeline()
+        for sso in ssos:
+            pipe.zcount(self._uses_key(sso, generation), now - self.quota_window, "+inf")
+            pipe.hget(self._usage_key(sso), "open_until")
+            pipe.sismember(self.FAILED_SET, sso)
+        rows = await pipe.execute()
+
+        available = []
+        for i, sso in enumerate(ssos):
+            used, open_until, failed = rows[3 * i:3 * i + 3]
+            if failed and float(open_until or 0) > now:
+                continue
+            if used < self.DAILY_LIMIT:
+                available.append(sso)
+        return available
+
+    def record_telemetry(
+        self,
+        sso: str,
+        outcome: str,
+        first_preview: Optional[float] = None,
+        final: Optional[float] = None
+    ):
+        """上报一次生成的耗时与结果（见 sso_telemetry）"""
+        key_id = self._ids.get(sso)
+        if key_id is not None:
+            self._telemetry.record(key_id, outcome, first_preview, final)
 
     async def get_status(self) -> Dict[str, Any]:
-        """获取详细状态"""
+        """获取详细状态（next_slot_at 为 key 下一次有可用配额的时间，0 表示当前可用）"""
         if not self._initialized:
             await self.initialize()
 
         r = await self._get_redis()
-        failed = await r.smembers(self.FAILED_SET)
+        failed, _ = await self._get_health(r)
+        usages = await self._get_usage_snapshot(r)
 
         keys_status = []
         for sso in self._sso_list:
-            usage = await r.hgetall(self._usage_key(sso))
+            usage = usages.get(sso)
+            if usage is None:
+                # 快照之后新增的 key
+                usage = await self._get_usage(r, sso)
+                usage["next_slot_at"] = await self._next_slot_at(r, sso, usage["count"])
             count = int(usage.get("count", 0))
-            last_used = int(usage.get("last_used", 0))
 
             keys_status.append({
                 "key_prefix": sso[:20] + "...",
                 "used_today": count,
                 "remaining": max(0, self.DAILY_LIMIT - count),
-                "last_used": last_used,
-                "failed": sso in failed
+                "next_slot_at": int(usage["next_slot_at"]),
+                "last_used": int(usage.get("last_used", 0)),
+                "failed": sso in failed,
+                "open_until": int(float(usage.get("open_until", 0))),
+                "consecutive_failures": int(usage.get("trips", 0)),
+                "last_failure": usage.get("fail_kind") or None,
+                "in_flight": self._inflight.get(sso, 0),
+                "telemetry": self._telemetry.get_key_stats(self._ids[sso])
             })
 
-        # 获取下次重置时间
-        last_reset = await r.get(self.DAILY_RESET_KEY)
-        next_reset = int(last_reset or 0) + self.RESET_INTERVAL
+        # 没有可用配额时，最早恢复配额的时间
+        next_slot = 0
+        if all(key["remaining"] == 0 or key["failed"] for key in keys_status):
+            next_slot = min((key["next_slot_at"] for key in keys_status if key["next_slot_at"]), default=0)
 
         return {
             "total_keys": len(self._sso_list),
             "failed_count": len(failed),
+            "in_flight": sum(self._inflight.values()),
+            "max_inflight": self.max_inflight,
             "strategy": self.strategy.value,
             "daily_limit": self.DAILY_LIMIT,
-            "next_reset_timestamp": next_reset,
+            "quota_window": self.quota_window,
+            "next_slot_at": next_slot,
+            "telemetry": self._telemetry.get_stats(),
+            "admission": self._admission.get_stats(),
+            "watcher": self._watcher.get_stats(),
+            "cache": self._cache.get_stats(),
+            "lock": {
+                "shards": len(self._shards),
+                "exhausted": lock_stats([self._exhausted_lock]),
+                "state": lock_stats([self._lock])
+            },
             "keys": keys_status
         }
 
     async def reload(self) -> int:
-        """重新加载 SSO 列表"""
+        """增量重新加载 SSO 列表：只同步新增和删除的 key，已有 key 的使用统计保持不变
+
+        文件在锁外读取；删除的 key 的使用记录保留到自然过期，重新加入时继续生效
+        """
+        if not self._initialized:
+            count = await self.initialize()
+            self._admission.notify()
+            return count
+
+        sso_list = await asyncio.to_thread(self._load_from_file)
         async with self._lock:
-            self._initialized = False
-            self._sso_list = []
+            if sso_list == self._sso_list:
+                return len(sso_list)
+            current = set(self._sso_list)
+            new = set(sso_list)
+            added = [sso for sso in sso_list if sso not in current]
+            removed = [sso for sso in self._sso_list if sso not in new]
+
             r = await self._get_redis()
-            await r.delete(self.KEYS_SET)
-            return await self.initialize()
+            pipe = r.pipeline()
+            self._add_keys(pipe, added)
+            if removed:
+                pipe.srem(self.KEYS_SET, *removed)
+                pipe.srem(self.FAILED_SET, *removed)
+                pipe.srem(self.TRIPPED_SET, *removed)
+                pipe.hdel(self.NAMES_KEY, *[self._key_hash(sso) for sso in removed])
+                pipe.hdel(self.HASHES_KEY, *removed)
+                self._drop_indexes(pipe, removed)
+            await pipe.execute()
+            if added:
+                await self._build_indexes(r, added)
+            await self._cache.publish(r)
+
+            # 本地列表整体替换，进行中的选择使用的仍是旧列表
+            self._sso_list = sso_list
+            self._load_telemetry()
+
+        logger.info(
+            f"[SSO-Redis] 重新加载: 新增 {len(added)} 个，删除 {len(removed)} 个，共 {len(sso_list)} 个 SSO"
+        )
+        self._admission.notify()
+        return len(sso_list)
 
     async def reset_daily_usage(self):
-        """手动重置每日使用量"""
+        """手动清空所有 key 的使用记录（并关闭熔断器）
+
+        由服务端脚本一次完成，多个实例同时重置也只是各自原子地进入新的重置代数；
+        旧代的使用记录不逐个删除，按 TTL 自然过期
+        """
         r = await self._get_redis()
-        for sso in self._sso_list:
-            await r.hset(self._usage_key(sso), "count", 0)
-        await r.delete(self.FAILED_SET)
-        await r.set(self.DAILY_RESET_KEY, int(time.time()))
-        logger.info("[SSO-Redis] 手动重置每日使用量完成")
+        if self._reset_script is None:
+            self._reset_script = r.register_script(RESET_SCRIPT)
+        generation = await self._reset_script(keys=[], args=[time.time(), self.PREFIX])
+        await self._cache.publish(r)
+        logger.info(f"[SSO-Redis] 手动重置使用量完成（重置代数 {generation}）")
+        self._admission.notify()
+
+    async def start(self):
+        """启动 SSO 文件监视和缓存失效订阅（在应用启动时调用）"""
+        await self._watcher.start()
+        await self._cache.start(self._get_redis)
 
     async def close(self):
-        """关闭 Redis 连接"""
+        """停止文件监视、缓存失效订阅并关闭 Redis 连接"""
+        await self._watcher.close()
+        await self._cache.close()
         if self._redis:
             await self._redis.close()
             self._redis = None
@@ -423,24 +883,33 @@ def create_sso_manager(
     use_redis: bool = True,
     redis_url: str = "redis://localhost:6379/0",
     strategy: str = "hybrid",
-    daily_limit: int = 10
+    daily_limit: int = 10,
+    max_inflight: int = 0
 ):
     """创建 SSO 管理器
 
+    Redis 版本包装在 FailoverSSOManager 中，Redis 不可用时自动降级为本地记账
+
     Args:
         use_redis: 是否使用 Redis（否则使用内存版本）
         redis_url: Redis 连接 URL
         strategy: 轮询策略 (round_robin/least_used/least_recent/weighted/hybrid)
         daily_limit: 每个 key 每日限制次数
+        max_inflight: 每个 key 同时进行的请求数上限（0 表示不限制）
     """
     if use_redis and REDIS_AVAILABLE:
-        return RedisSSOManager(
-            redis_url=redis_url,
-            strategy=RotationStrategy(strategy),
-            daily_limit=daily_limit
+        from app.services.sso_failover import FailoverSSOManager
+        return FailoverSSOManager(
+            RedisSSOManager(
+                redis_url=redis_url,
+                strategy=RotationStrategy(strategy),
+                daily_limit=daily_limit,
+                max_inflight=max_inflight
+            ),
+            fallback_ratio=settings.REDIS_FALLBACK_QUOTA_RATIO
         )
     else:
         # 回退到文件版本
         from app.services.sso_manager import SSOManager
         logger.warning("[SSO] 使用文件版本管理器")
-        return SSOManager(strategy=strategy, daily_limit=daily_limit)
+        return SSOManager(strategy=strategy, daily_limit=daily_limit, max_inflight=max_inflight)
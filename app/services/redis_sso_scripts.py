@@ -0,0 +1,426 @@
+"""Redis 服务端脚本 - SSO 选择与租约占用在一次往返内原子完成
+
+脚本在 Redis 内逐个检查候选 key 的熔断、并发与配额，按轮询策略选出一个，
+并在同一脚本内写入租约（以及半开 key 的试探标记）。多个网关实例同时选择时
+不会把同一个 key 的最后一次配额或唯一的试探机会分给两个请求。
+
+Redis 数据（key 名由短哈希拼出，脚本只适用于单节点 Redis，不适用于 Cluster）：
+- {prefix}names             -> Hash: 短哈希 -> SSO（用于检查 failed 集合）
+- {prefix}leases:{hash}     -> ZSet: 进行中的租约（score 为过期时间，实例崩溃后自动失效）
+- {prefix}usage:{hash}      -> Hash: open_until / last_used / leased_at 等
+- {prefix}uses:{hash}       -> ZSet: 窗口内的使用记录（重置代数 > 0 时为 uses:{generation}:{hash}）
+- {prefix}generation        -> String: 重置代数，手动重置时加一，旧代的使用记录按 TTL 自然过期
+- {prefix}hashes            -> Hash: SSO -> 短哈希（重置脚本按熔断集合找到 usage key）
+- {prefix}probe:{hash}      -> String: 半开试探占用标记
+- {prefix}by_count          -> ZSet: 有剩余配额的 key，score 为窗口内使用次数
+- {prefix}by_recent         -> ZSet: 有剩余配额的 key，score 为最后使用/占用时间
+- {prefix}exhausted         -> ZSet: 配额用满的 key，score 为恢复配额的时间
+- {prefix}open              -> ZSet: 熔断冷却中的 key，score 为冷却结束（进入半开）的时间
+
+by_count 的分数在使用记录移出窗口后不会立即下降，在 key 被检查时校正；
+exhausted / open 中到期的 key 在每次选择前移回 by_count / by_recent（仍在冷却的 key 留在 open），
+因此沿索引查找时不会反复跳过熔断或用满的 key。
+"""
+
+# 选择、记录使用和熔断关闭脚本共用的索引维护函数
+_INDEX_FUNCTIONS = """
+local generation = redis.call('GET', prefix .. 'generation') or '0'
+local by_count = prefix .. 'by_count'
+local by_recent = prefix .. 'by_recent'
+local exhausted = prefix .. 'exhausted'
+local open_set = prefix .. 'open'
+local window_start = now - window
+
+-- 当前重置代数下的使用记录 key（第 0 代沿用旧的 key 名）
+local function uses_key(h)
+    if generation == '0' then
+        return prefix .. 'uses:' .. h
+    end
+    return prefix .. 'uses:' .. generation .. ':' .. h
+end
+
+-- 配额用满：移出可用索引，按第 (used - limit + 1) 早的使用移出窗口的时间登记恢复时间
+local function mark_exhausted(h)
+    local uses = uses_key(h)
+    redis.call('ZREMRANGEBYSCORE', uses, '-inf', '(' .. window_start)
+    local used = redis.call('ZCARD', uses)
+    if used < limit then
+        return false
+    end
+    local nth = redis.call('ZRANGE', uses, used - limit, used - limit, 'WITHSCORES')
+    redis.call('ZREM', by_count, h)
+    redis.call('ZREM', by_recent, h)
+    redis.call('ZADD', exhausted, tonumber(nth[2]) + window, h)
+    return true
+end
+
+-- 配额恢复：移回可用索引
+local function restore(h)
+    local used = redis.call('ZCOUNT', uses_key(h), window_start, '+inf')
+    local fields = redis.call('HMGET', prefix .. 'usage:' .. h, 'last_used', 'leased_at')
+    redis.call('ZREM', exhausted, h)
+    redis.call('ZADD', by_count, used, h)
+    redis.call('ZADD', by_recent, math.max(tonumber(fields[1] or 0), tonumber(fields[2] or 0)), h)
+end
+"""
+
+# 选择并（可选）占用一个 key
+#
+# ARGV: now, window, limit, max_inflight, lease_ttl, lease_id, probe_ttl,
+#       strategy, rand, reserve(0/1), prefix, mode, 然后：
+#       mode=scan  时为候选 (hash, bias) 对，bias 为 latency 策略的遥测得分，其他策略传 1
+#         （latency 按分片扫描；其他策略只在提前试探时用于检查单个指定 key）
+#       mode=index 时为需要排除的 hash，候选沿 by_count / by_recent 从小到大收集：
+#         least_used            -> by_count 前 BATCH 个可用 key，取实际次数最少的
+#         least_recent/round_robin -> by_recent 第一个可用 key（占用时刷新分数，即按序轮转）
+#         hybrid/weighted       -> by_count 与 by_recent 各前 TOP_K 个可用 key 的并集，在其中按策略评分
+#       每次调用检查的 key 数与池大小无关（hybrid/weighted 是在这两个头部集合内近似全池最优）
+#
+# 返回选中的短哈希，没有可用 key 时返回 nil
+SELECT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local max_inflight = tonumber(ARGV[4])
+local lease_ttl = tonumber(ARGV[5])
+local lease_id = ARGV[6]
+local probe_ttl = tonumber(ARGV[7])
+local strategy = ARGV[8]
+local rand = tonumber(ARGV[9])
+local reserve = ARGV[10] == '1'
+local prefix = ARGV[11]
+local mode = ARGV[12]
+local failed_set = prefix .. 'failed'
+local BATCH = 16
+local TOP_K = 32
+""" + _INDEX_FUNCTIONS + """
+for _, h in ipairs(redis.call('ZRANGEBYSCORE', exhausted, '-inf', now, 'LIMIT', 0, 64)) do
+    if redis.call('ZSCORE', open_set, h) then
+        -- 仍在熔断冷却：冷却结束时再检查配额
+        redis.call('ZREM', exhausted, h)
+    elseif not mark_exhausted(h) then
+        restore(h)
+    end
+end
+-- 冷却结束的 key 进入半开，移回索引（试探限制由 check 负责）
+for _, h in ipairs(redis.call('ZRANGEBYSCORE', open_set, '-inf', now, 'LIMIT', 0, 64)) do
+    redis.call('ZREM', open_set, h)
+    if not mark_exhausted(h) then
+        restore(h)
+    end
+end
+
+-- 检查一个 key 当前能否使用，能用时返回其统计
+local function check(h, bias)
+    local leases = prefix .. 'leases:' .. h
+    redis.call('ZREMRANGEBYSCORE', leases, '-inf', now)
+    local inflight = redis.call('ZCARD', leases)
+    if max_inflight > 0 and inflight >= max_inflight then
+        return nil
+    end
+    local fields = redis.call('HMGET', prefix .. 'usage:' .. h, 'open_until', 'last_used', 'leased_at')
+    local sso = redis.call('HGET', prefix .. 'names', h)
+    local half_open = sso and redis.call('SISMEMBER', failed_set, sso) == 1
+    if half_open then
+        -- 冷却结束且没有进行中的试探时才允许一个试探请求
+        if not (tonumber(fields[1] or 0) <= now and inflight == 0
+                and redis.call('EXISTS', prefix .. 'probe:' .. h) == 0) then
+            return nil
+        end
+    end
+    local used = redis.call('ZCOUNT', uses_key(h), window_start, '+inf')
+    if used >= limit then
+        if redis.call('ZSCORE', by_count, h) then
+            mark_exhausted(h)
+        end
+        return nil
+    end
+    local remaining = limit - used - inflight
+    if remaining <= 0 then
+        return nil
+    end
+    return {
+        h = h, used = used, remaining = remaining, count = used + inflight,
+        last_used = math.max(tonumber(fields[2] or 0), tonumber(fields[3] or 0)),
+        bias = bias, half_open = half_open
+    }
+end
+
+local candidates = {}
+if mode == 'index' then
+    local excluded = {}
+    for i = 13, #ARGV do
+        excluded[ARGV[i]] = true
+    end
+    local seen = {}
+
+    -- 沿索引从小到大收集最多 want 个可用 key（已收集的跳过）
+    local function collect(index, want)
+        local offset = 0
+        local found = 0
+        while found < want do
+            local batch = redis.call('ZRANGE', index, offset, offset + BATCH - 1, 'WITHSCORES')
+            if #batch == 0 then
+                break
+            end
+            local size = redis.call('ZCARD', index)
+            for i = 1, #batch, 2 do
+                local h = batch[i]
+                if not excluded[h] and not seen[h] then
+                    local c = check(h, 1)
+                    if c then
+                        -- by_count 分数可能偏大，检查时校正
+                        if index == by_count and c.used ~= tonumber(batch[i + 1]) then
+                            redis.call('ZADD', by_count, c.used, h)
+                        end
+                        seen[h] = true
+                        candidates[#candidates + 1] = c
+                        found = found + 1
+                    end
+                end
+            end
+            -- 本批中用满的 key 已移出索引，后续位置前移
+            offset = offset + #batch / 2 - (size - redis.call('ZCARD', index))
+        end
+    end
+
+    if strategy == 'least_used' then
+        collect(by_count, BATCH)
+    elseif strategy == 'least_recent' or strategy == 'round_robin' then
+        collect(by_recent, 1)
+    else
+        collect(by_count, TOP_K)
+        collect(by_recent, TOP_K)
+    end
+else
+    for i = 13, #ARGV, 2 do
+        local c = check(ARGV[i], tonumber(ARGV[i + 1]))
+        if c then
+            candidates[#candidates + 1] = c
+        end
+    end
+end
+
+if #candidates == 0 then
+    return nil
+end
+
+local chosen = nil
+if strategy == 'round_robin' then
+    -- 占用时刷新 by_recent 分数，取最前的 key 即按序轮转
+    chosen = candidates[1]
+elseif strategy == 'weighted' then
+    local total_weight = 0
+    for _, c in ipairs(candidates) do
+        total_weight = total_weight + c.remaining
+    end
+    local target = rand * total_weight
+    local cumulative = 0
+    for _, c in ipairs(candidates) do
+        cumulative = cumulative + c.remaining
+        if target < cumulative then
+            chosen = c
+            break
+        end
+    end
+    chosen = chosen or candidates[#candidates]
+else
+    local best = nil
+    for _, c in ipairs(candidates) do
+        local score
+        if strategy == 'least_used' then
+            score = -c.count
+        elseif strategy == 'least_recent' then
+            score = -c.last_used
+        elseif strategy == 'latency' then
+            score = c.remaining * c.bias
+        else
+            -- hybrid: 剩余配额 * (1 + 时间因子)，时间因子每分钟 +0.1，最高 10
+            local time_factor = 10
+            if c.last_used > 0 then
+                time_factor = math.min(10, (now - c.last_used) / 60 * 0.1)
+            end
+            score = c.remaining * (1 + time_factor)
+        end
+        if best == nil or score > best then
+            best = score
+            chosen = c
+        end
+    end
+end
+
+if chosen == nil then
+    return nil
+end
+
+if reserve then
+    local leases = prefix .. 'leases:' .. chosen.h
+    redis.call('ZADD', leases, now + lease_ttl, lease_id)
+    redis.call('EXPIRE', leases, math.ceil(lease_ttl) + 1)
+    redis.call('HSET', prefix .. 'usage:' .. chosen.h, 'leased_at', now)
+    redis.call('ZADD', by_recent, 'XX', now, chosen.h)
+    if chosen.half_open then
+        redis.call('SET', prefix .. 'probe:' .. chosen.h, 1, 'EX', probe_ttl)
+    end
+end
+return chosen.h
+"""
+
+# 记录一次使用并更新索引
+#
+# ARGV: now(使用时间，降级恢复后补写时为过去的时间), window, limit, prefix, hash, member
+#
+# 返回窗口内的使用次数
+USAGE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local prefix = ARGV[4]
+local h = ARGV[5]
+""" + _INDEX_FUNCTIONS + """
+local uses = uses_key(h)
+redis.call('ZADD', uses, now, ARGV[6])
+redis.call('ZREMRANGEBYSCORE', uses, '-inf', '(' .. window_start)
+redis.call('EXPIRE', uses, math.ceil(window) + 1)
+-- 补写的旧记录不回退最后使用时间
+local usage = prefix .. 'usage:' .. h
+local latest = now > tonumber(redis.call('HGET', usage, 'last_used') or 0)
+if latest then
+    redis.call('HSET', usage, 'last_used', math.floor(now))
+end
+
+local used = redis.call('ZCARD', uses)
+-- 只维护池中的 key（已删除的 key 不在任何索引中）
+if redis.call('ZSCORE', by_count, h) or redis.call('ZSCORE', exhausted, h) then
+    if not mark_exhausted(h) then
+        redis.call('ZADD', by_count, used, h)
+        if latest then
+            redis.call('ZADD', by_recent, now, h)
+        end
+    end
+end
+return used
+"""
+
+# 所有 key 都熔断时提前试探：选出冷却最先结束的 key，并清除其冷却时间
+#
+# 只有池中（{prefix}keys）的 key 全部在熔断集合中且没有进行中的试探时才选择，整个判断在一次往返内完成
+#
+# ARGV: prefix
+#
+# 返回选中的 SSO，池未全部熔断或已有试探进行中时返回 nil
+PROBE_SCRIPT = """
+local prefix = ARGV[1]
+local keys_set = prefix .. 'keys'
+local total = redis.call('SCARD', keys_set)
+local failed = redis.call('SINTER', prefix .. 'failed', keys_set)
+if total == 0 or #failed < total then
+    return nil
+end
+
+local hashes = prefix .. 'hashes'
+local best, best_h, best_at = nil, nil, nil
+for _, sso in ipairs(failed) do
+    local h = redis.call('HGET', hashes, sso)
+    if h then
+        if redis.call('EXISTS', prefix .. 'probe:' .. h) == 1 then
+            -- 已有试探进行中，等待其结果
+            return nil
+        end
+        local at = tonumber(redis.call('HGET', prefix .. 'usage:' .. h, 'open_until') or 0)
+        if best == nil or at < best_at or (at == best_at and sso < best) then
+            best, best_h, best_at = sso, h, at
+        end
+    end
+end
+
+if best == nil then
+    return nil
+end
+redis.call('HSET', prefix .. 'usage:' .. best_h, 'open_until', 0)
+-- 下次选择时移回索引（半开）
+redis.call('ZADD', prefix .. 'open', 'XX', 0, best_h)
+return best
+"""
+
+# 熔断打开：key 移出可用索引，登记冷却结束时间（不在池中的 key 不登记）
+#
+# ARGV: prefix, hash, open_until
+TRIP_SCRIPT = """
+local prefix = ARGV[1]
+local h = ARGV[2]
+local by_count = prefix .. 'by_count'
+local by_recent = prefix .. 'by_recent'
+local open_set = prefix .. 'open'
+if not (redis.call('ZSCORE', by_count, h) or redis.call('ZSCORE', prefix .. 'exhausted', h)
+        or redis.call('ZSCORE', open_set, h)) then
+    return 0
+end
+redis.call('ZREM', by_count, h)
+redis.call('ZREM', by_recent, h)
+redis.call('ZADD', open_set, tonumber(ARGV[3]), h)
+return 1
+"""
+
+# 熔断关闭：冷却中的 key 移回可用索引（配额用满时登记到 exhausted）
+#
+# ARGV: now, window, limit, prefix, hash
+HEAL_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local prefix = ARGV[4]
+local h = ARGV[5]
+""" + _INDEX_FUNCTIONS + """
+if redis.call('ZREM', open_set, h) == 0 then
+    return 0
+end
+if not mark_exhausted(h) then
+    restore(h)
+end
+return 1
+"""
+
+# 手动重置：清空所有 key 的使用记录并关闭熔断器
+#
+# 使用记录不逐个删除：重置代数加一后新的使用记录写入新的 key，旧 key 按 TTL 过期；
+# 只有熔断中/有连续失败的 key 需要逐个清零，索引用 ZUNIONSTORE 整体重建
+#
+# ARGV: now, prefix
+#
+# 返回新的重置代数
+RESET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local prefix = ARGV[2]
+local by_count = prefix .. 'by_count'
+local by_recent = prefix .. 'by_recent'
+local exhausted = prefix .. 'exhausted'
+local failed_set = prefix .. 'failed'
+local tripped_set = prefix .. 'tripped'
+
+local generation = redis.call('INCR', prefix .. 'generation')
+redis.call('SET', prefix .. 'daily_reset', math.floor(now))
+
+local unhealthy = redis.call('SUNION', failed_set, tripped_set)
+if #unhealthy > 0 then
+    local hashes = redis.call('HMGET', prefix .. 'hashes', unpack(unhealthy))
+    for _, h in ipairs(hashes) do
+        if h then
+            redis.call('HSET', prefix .. 'usage:' .. h, 'trips', 0, 'open_until', 0)
+        end
+    end
+end
+redis.call('DEL', failed_set, tripped_set)
+
+-- 用满和熔断中的 key 移回可用索引：次数归零，最后使用时间取自 usage
+local open_set = prefix .. 'open'
+for _, index in ipairs({exhausted, open_set}) do
+    for _, h in ipairs(redis.call('ZRANGE', index, 0, -1)) do
+        local fields = redis.call('HMGET', prefix .. 'usage:' .. h, 'last_used', 'leased_at')
+        redis.call('ZADD', by_recent, math.max(tonumber(fields[1] or 0), tonumber(fields[2] or 0)), h)
+    end
+end
+redis.call('ZUNIONSTORE', by_count, 3, by_count, exhausted, open_set, 'WEIGHTS', 0, 0, 0)
+redis.call('DEL', exhausted, open_set)
+return generation
+"""
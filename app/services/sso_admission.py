@@ -0,0 +1,134 @@
+"""SSO 准入队列 - 没有可用容量时有限等待，而不是立即失败
+
+请求获取 SSO 时如果所有 key 都在用满配额、熔断冷却或达到并发上限，
+按到达顺序排队等待，容量一释放立即交给队首：
+- 租约归还、熔断恢复：由管理器调用 notify() 唤醒队首
+- 使用记录移出窗口、熔断冷却结束：队首按管理器给出的到期时间定时重试
+
+没有进行中的请求且最早到期时间超出等待上限，或队列已满时立即拒绝，
+调用方据此返回 429 和 Retry-After。
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Awaitable, Deque, Tuple
+
+# 无法预计容量恢复时间时建议的重试间隔（秒）
+DEFAULT_RETRY_AFTER = 60
+
+
+def retry_after_seconds(free_at: Optional[float], now: Optional[float] = None) -> int:
+    """由预计最早可用时间计算 Retry-After（整秒，至少 1 秒）"""
+    if free_at is None:
+        return DEFAULT_RETRY_AFTER
+    now = time.time() if now is None else now
+    return max(1, math.ceil(free_at - now))
+
+
+class AdmissionQueue:
+    """按到达顺序排队的准入控制
+
+    只有队首会尝试获取 SSO，后来的请求不会插队；
+    队首离开（成功、超时或取消）时唤醒下一个。
+    """
+
+    MIN_POLL = 0.1  # 预计已有容量但获取失败时的最短重试间隔（秒）
+
+    def __init__(self, max_wait: float = 10, max_queue: int = 100):
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._waiters: Deque[asyncio.Event] = deque()
+        self._stats = {
+            "immediate": 0,   # 无需等待直接获取
+            "queued": 0,      # 排队后获取
+            "rejected": 0,    # 不排队直接拒绝（不等待、队列已满或预计等待超时）
+            "timeouts": 0     # 排队后等待超时
+        }
+
+    def notify(self):
+        """有容量释放（租约归还、熔断恢复等），唤醒队首重试"""
+        if self._waiters:
+            self._waiters[0].set()
+
+    async def admit(
+        self,
+        try_acquire: Callable[[], Awaitable[Optional[str]]],
+        next_free_at: Callable[[], Awaitable[Tuple[Optional[float], bool]]],
+        wait: Optional[float] = None
+    ) -> Optional[str]:
+        """获取一个 SSO，没有容量时排队等待
+
+        Args:
+            try_acquire: 立即尝试选择并占用一个 SSO，没有容量时返回 None
+            next_free_at: 返回 (到期恢复容量的最早时间戳或 None, 是否有进行中的请求可能更早释放容量)
+            wait: 最长等待秒数，默认 max_wait；0 表示不等待
+
+        Returns:
+            获取到的 SSO，等待超时或被拒绝时返回 None
+        """
+        wait = self.max_wait if wait is None else wait
+
+        # 有人排队时新请求不插队
+        tried = not self._waiters
+        if tried:
+            sso = await try_acquire()
+            if sso:
+                self._stats["immediate"] += 1
+                return sso
+
+        if wait <= 0 or len(self._waiters) >= self.max_queue:
+            self._stats["rejected"] += 1
+            return None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        waiter = asyncio.Event()
+        self._waiters.append(waiter)
+        try:
+            while True:
+                delay, pending = None, True
+                if self._waiters[0] is waiter:
+                    # 先清除唤醒标记，尝试期间的唤醒不会丢失
+                    waiter.clear()
+                    # 加入队列前刚尝试过的不重复尝试
+                    if not tried:
+                        sso = await try_acquire()
+                        if sso:
+                            self._stats["queued"] += 1
+                            return sso
+                    tried = False
+                    free_at, pending = await next_free_at()
+                    if free_at is not None:
+                        delay = free_at - time.time()
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    return None
+                if delay is not None and delay > remaining and not pending:
+                    # 等待上限内不会有容量恢复，不必干等
+                    self._stats["rejected"] += 1
+                    return None
+
+                timeout = remaining if delay is None else min(remaining, max(delay, self.MIN_POLL))
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            head = self._waiters[0] is waiter
+            self._waiters.remove(waiter)
+            if head:
+                # 队首离开，下一个成为队首立即重试（可能还有剩余容量）
+                self.notify()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """排队统计"""
+        return {
+            "waiting": len(self._waiters),
+            "max_wait": self.max_wait,
+            "max_queue": self.max_queue,
+            **self._stats
+        }
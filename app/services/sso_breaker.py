@@ -0,0 +1,72 @@
+"""SSO 熔断器策略 - 失败分类与冷却时间
+
+每个 key 一个熔断器：
+- closed（正常）: 参与轮询
+- open（熔断）: 冷却期内不参与轮询
+- half_open（半开）: 冷却期结束，只允许一个试探请求；成功则恢复，失败则以加倍的冷却时间重新熔断
+
+失败按原因分类，各自的基础冷却时间不同：
+- auth: SSO 失效（unauthorized），冷却时间最长
+- rate_limit: 上游限流
+- blocked: 无法生成最终图片
+- network: 超时、连接错误等（可能是本地代理问题），连续失败达到阈值才熔断
+"""
+
+from enum import Enum
+
+from app.core.config import settings
+
+
+class FailureKind(Enum):
+    """失败分类"""
+    AUTH = "auth"
+    RATE_LIMIT = "rate_limit"
+    BLOCKED = "blocked"
+    NETWORK = "network"
+
+
+class BreakerState:
+    """熔断器状态（存储为 int8）"""
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    NAMES = {CLOSED: "closed", OPEN: "open", HALF_OPEN: "half_open"}
+
+
+# 存储中的失败分类编码（0 表示无）
+FAILURE_CODES = {kind: code for code, kind in enumerate(FailureKind, 1)}
+FAILURE_KINDS = {code: kind for kind, code in FAILURE_CODES.items()}
+
+
+def classify_failure(error_code: str = "") -> FailureKind:
+    """按错误码对失败分类（未知错误、异常按网络错误处理）"""
+    if error_code == "unauthorized":
+        return FailureKind.AUTH
+    if error_code == "rate_limit_exceeded":
+        return FailureKind.RATE_LIMIT
+    if error_code == "blocked":
+        return FailureKind.BLOCKED
+    return FailureKind.NETWORK
+
+
+def failure_threshold(kind: FailureKind) -> int:
+    """连续失败多少次后熔断"""
+    if kind == FailureKind.NETWORK:
+        return max(1, settings.SSO_BREAKER_NETWORK_THRESHOLD)
+    return 1
+
+
+def cooldown_seconds(kind: FailureKind, trips: int) -> float:
+    """第 trips 次连续失败后的冷却时间（指数退避），未达到熔断阈值时返回 0"""
+    threshold = failure_threshold(kind)
+    if trips < threshold:
+        return 0
+    base = {
+        FailureKind.AUTH: settings.SSO_BREAKER_COOLDOWN_AUTH,
+        FailureKind.RATE_LIMIT: settings.SSO_BREAKER_COOLDOWN_RATE_LIMIT,
+        FailureKind.BLOCKED: settings.SSO_BREAKER_COOLDOWN_BLOCKED,
+        FailureKind.NETWORK: settings.SSO_BREAKER_COOLDOWN_NETWORK,
+    }[kind]
+    # 指数部分限制在合理范围内，避免大数运算
+    return min(settings.SSO_BREAKER_MAX_COOLDOWN, base * 2 ** min(trips - threshold, 20))
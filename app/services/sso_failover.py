@@ -0,0 +1,307 @@
+"""Redis SSO 管理器的降级保护
+
+Redis 变慢或不可用时，请求不应跟着阻塞：
+- 每次 Redis 操作受连接池大小和超时限制（见 RedisSSOManager._get_redis）
+- retry_interval 秒内失败达到阈值后熔断，改用进程内的 SSOManager 记账（不读写状态文件），
+  每个 key 的配额按比例缩小，多个实例同时降级时合计也不容易超出上限
+- 熔断期间每隔 retry_interval 秒放行一次 Redis 调用试探，成功即恢复
+- 恢复后把降级期间记录的使用按原时间补写到 Redis，各实例的配额统计重新一致
+
+降级期间的熔断状态只在本实例有效，恢复后以 Redis 中的状态为准。
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Optional, List, Dict, Any, Set, Tuple, Callable, Awaitable, TypeVar, Deque
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.sso_manager import SSOManager
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:
+    RedisError = OSError
+
+T = TypeVar("T")
+
+# 视为 Redis 不可用的异常（超时、连接失败、连接池等待超时等）
+REDIS_ERRORS = (RedisError, OSError, asyncio.TimeoutError)
+
+
+class RedisCircuit:
+    """Redis 调用的熔断器：retry_interval 秒内失败达到阈值后打开，每隔 retry_interval 秒放行一次试探
+
+    按时间窗口内的失败次数而不是连续失败次数判断：部分调用由本地缓存应答不访问 Redis，
+    它们的成功不代表 Redis 可用
+    """
+
+    def __init__(self, failure_threshold: int = 3, retry_interval: float = 10):
+        self.failure_threshold = max(1, failure_threshold)
+        self.retry_interval = retry_interval
+        self._failures: Deque[float] = deque()  # 窗口内的失败时间
+        self.open_since: Optional[float] = None
+        self._next_probe = 0.0
+        self._stats = {"errors": 0, "trips": 0, "recoveries": 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self.open_since is not None
+
+    def allow(self) -> bool:
+        """是否调用 Redis（打开时只在到达试探时间时放行一次）"""
+        if self.open_since is None:
+            return True
+        now = time.time()
+        if now < self._next_probe:
+            return False
+        self._next_probe = now + self.retry_interval
+        return True
+
+    def record_success(self) -> bool:
+        """记录一次成功，返回是否由熔断恢复"""
+        if self.open_since is None:
+            return False
+        self._failures.clear()
+        logger.info(f"[SSO-Redis] Redis 已恢复（降级 {time.time() - self.open_since:.0f}s）")
+        self.open_since = None
+        self._stats["recoveries"] += 1
+        return True
+
+    def record_failure(self, error: BaseException):
+        """记录一次失败，窗口内失败达到阈值时熔断"""
+        now = time.time()
+        self._failures.append(now)
+        while self._failures and self._failures[0] < now - self.retry_interval:
+            self._failures.popleft()
+        self._stats["errors"] += 1
+        if self.open_since is None and len(self._failures) >= self.failure_threshold:
+            self.open_since = now
+            self._next_probe = now + self.retry_interval
+            self._stats["trips"] += 1
+            logger.error(
+                f"[SSO-Redis] Redis {self.retry_interval:g}s 内失败 {len(self._failures)} 次，"
+                f"切换为本地记账: {type(error).__name__}: {error}"
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": "open" if self.is_open else "closed",
+            "open_since": int(self.open_since) if self.open_since else 0,
+            "recent_failures": len(self._failures),
+            "failure_threshold": self.failure_threshold,
+            "retry_interval": self.retry_interval,
+            **self._stats
+        }
+
+
+class FailoverSSOManager:
+    """Redis 管理器 + 本地降级（接口与 RedisSSOManager 相同）"""
+
+    MAX_PENDING_USES = 10000  # 等待补写到 Redis 的使用记录上限
+
+    def __init__(self, primary, fallback_ratio: float = 0.5):
+        self.primary = primary
+        self.strategy = primary.strategy
+        daily_limit = max(1, int(primary.DAILY_LIMIT * fallback_ratio))
+        self.fallback = SSOManager(
+            strategy=primary.strategy.value,
+            daily_limit=daily_limit,
+            max_inflight=primary.max_inflight,
+            persist=False
+        )
+        self._fallback_loaded = False
+        self._circuit = RedisCircuit(settings.REDIS_FAILURE_THRESHOLD, settings.REDIS_RETRY_INTERVAL)
+        self._lease_owner: Dict[str, List[Any]] = {}  # SSO -> 发放租约的管理器（按发放顺序）
+        self._pending_uses: List[Tuple[str, float]] = []  # 降级期间的使用记录 (SSO, 时间)
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._stats = {"fallback_calls": 0, "reconciled_uses": 0, "dropped_uses": 0}
+
+    def _ensure_fallback(self):
+        """首次使用时加载本地管理器的 key 列表"""
+        if not self._fallback_loaded:
+            self.fallback.load_sso_list()
+            self._fallback_loaded = True
+
+    async def _call(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        fallback: Callable[[], Awaitable[T]]
+    ) -> T:
+        """调用 Redis 管理器，Redis 不可用或熔断中时改用本地管理器"""
+        if self._circuit.allow():
+            try:
+                result = await primary()
+            except REDIS_ERRORS as e:
+                self._circuit.record_failure(e)
+                logger.warning(f"[SSO-Redis] Redis 调用失败，本次使用本地记账: {type(e).__name__}: {e}")
+            else:
+                if self._circuit.record_success():
+                    self._schedule_reconcile()
+                return result
+        self._stats["fallback_calls"] += 1
+        self._ensure_fallback()
+        return await fallback()
+
+    # ============== 选择与租约 ==============
+
+    async def get_next_sso(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        return await self._call(
+            lambda: self.primary.get_next_sso(exclude),
+            lambda: self.fallback.get_next_sso(exclude)
+        )
+
+    async def acquire(
+        self,
+        exclude: Optional[Set[str]] = None,
+        wait: Optional[float] = None
+    ) -> Optional[str]:
+        """选择一个 SSO 并占用租约，记录租约由哪个管理器发放，release() 时归还给它"""
+        owner = []
+
+        async def from_primary():
+            sso = await self.primary.acquire(exclude, wait)
+            owner.append(self.primary)
+            return sso
+
+        async def from_fallback():
+            sso = await self.fallback.acquire(exclude, wait)
+            owner.append(self.fallback)
+            return sso
+
+        sso = await self._call(from_primary, from_fallback)
+        if sso:
+            self._lease_owner.setdefault(sso, []).append(owner[-1])
+        return sso
+
+    def release(self, sso: str):
+        owners = self._lease_owner.get(sso)
+        if not owners:
+            return
+        manager = owners.pop()
+        if not owners:
+            del self._lease_owner[sso]
+        manager.release(sso)
+
+    async def retry_after(self) -> int:
+        return await self._call(self.primary.retry_after, self.fallback.retry_after)
+
+    # ============== 结果上报 ==============
+
+    async def record_usage(self, sso: str):
+        """记录使用；降级期间同时暂存，Redis 恢复后按原时间补写"""
+        now = time.time()
+
+        async def to_fallback():
+            await self.fallback.record_usage(sso)
+            if len(self._pending_uses) < self.MAX_PENDING_USES:
+                self._pending_uses.append((sso, now))
+            else:
+                self._stats["dropped_uses"] += 1
+
+        await self._call(lambda: self.primary.record_usage(sso, at=now), to_fallback)
+
+    async def mark_failed(self, sso: str, reason: str = "", error_code: str = ""):
+        await self._call(
+            lambda: self.primary.mark_failed(sso, reason, error_code),
+            lambda: self.fallback.mark_failed(sso, reason, error_code)
+        )
+
+    async def mark_success(self, sso: str):
+        await self._call(
+            lambda: self.primary.mark_success(sso),
+            lambda: self.fallback.mark_success(sso)
+        )
+
+    async def filter_available(self, ssos: List[str]) -> List[str]:
+        return await self._call(
+            lambda: self.primary.filter_available(ssos),
+            lambda: self.fallback.filter_available(ssos)
+        )
+
+    def record_telemetry(
+        self,
+        sso: str,
+        outcome: str,
+        first_preview: Optional[float] = None,
+        final: Optional[float] = None
+    ):
+        """遥测只在本地，两个管理器都记录，降级时延迟感知策略仍有数据"""
+        self.primary.record_telemetry(sso, outcome, first_preview, final)
+        if self._fallback_loaded:
+            self.fallback.record_telemetry(sso, outcome, first_preview, final)
+
+    # ============== 对账 ==============
+
+    def _schedule_reconcile(self):
+        """Redis 恢复后在后台补写降级期间的使用记录"""
+        if self._pending_uses and (self._reconcile_task is None or self._reconcile_task.done()):
+            self._reconcile_task = asyncio.create_task(self._reconcile())
+
+    async def _reconcile(self):
+        """按原时间把降级期间的使用记录补写到 Redis，失败的留待下次恢复"""
+        pending, self._pending_uses = self._pending_uses, []
+        done = 0
+        try:
+            for sso, at in pending:
+                await self.primary.record_usage(sso, at=at)
+                done += 1
+        except REDIS_ERRORS as e:
+            self._circuit.record_failure(e)
+            self._pending_uses = pending[done:] + self._pending_uses
+        self._stats["reconciled_uses"] += done
+        if done:
+            logger.info(f"[SSO-Redis] 已补写降级期间的 {done} 次使用记录")
+
+    # ============== 管理 ==============
+
+    async def get_status(self) -> Dict[str, Any]:
+        """获取详细状态（降级中时为本地管理器的状态）"""
+        async def local_status():
+            return self.fallback.get_status()
+
+        status = await self._call(self.primary.get_status, local_status)
+        return {
+            **status,
+            "redis": {
+                **self._circuit.get_stats(),
+                "pending_uses": len(self._pending_uses),
+                "fallback_daily_limit": self.fallback.daily_limit,
+                **self._stats
+            }
+        }
+
+    async def reload(self) -> int:
+        self._ensure_fallback()
+        count = await self.fallback.reload()
+
+        async def local_count():
+            return count
+
+        return await self._call(self.primary.reload, local_count)
+
+    async def reset_daily_usage(self):
+        if self._fallback_loaded:
+            await self.fallback.reset_daily_usage()
+        self._pending_uses.clear()
+
+        async def local_reset():
+            logger.warning("[SSO-Redis] Redis 不可用，只重置了本地记账")
+
+        await self._call(self.primary.reset_daily_usage, local_reset)
+
+    async def start(self):
+        """启动 Redis 管理器的后台任务，并预先加载本地管理器的 key 列表"""
+        self._ensure_fallback()
+        await self.primary.start()
+
+    async def close(self):
+        """停止后台任务，尽量补写未同步的使用记录"""
+        if self._reconcile_task and not self._reconcile_task.done():
+            await self._reconcile_task
+        if self._pending_uses and not self._circuit.is_open:
+            await self._reconcile()
+        if self._pending_uses:
+            logger.warning(f"[SSO-Redis] 关闭时仍有 {len(self._pending_uses)} 次使用记录未能补写到 Redis")
+        await self.primary.close()
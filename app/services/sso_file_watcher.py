@@ -0,0 +1,80 @@
+"""SSO 文件监视 - 定期检查 SSO_FILE 是否变化，变化时触发增量重新加载
+
+按修改时间和文件大小判断变化（不依赖 inotify 等平台特性），
+回调中只应用新增和删除的 key，已有 key 的使用统计保持不变。
+"""
+
+import asyncio
+from pathlib import Path
+from typing import Optional, Callable, Awaitable, Any, Dict, Tuple
+
+from app.core.logger import logger
+
+
+class SSOFileWatcher:
+    """轮询监视 SSO 文件"""
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float,
+        on_change: Callable[[], Awaitable[Any]]
+    ):
+        self.path = path
+        self.interval = interval
+        self._on_change = on_change
+        self._signature: Optional[Tuple[int, int]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"checks": 0, "reloads": 0, "errors": 0}
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        """文件的 (修改时间, 大小)，文件不存在时为 None"""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    async def start(self):
+        """记录当前文件状态并启动后台检查任务（interval <= 0 时不启动）"""
+        if self.interval <= 0 or (self._task and not self._task.done()):
+            return
+        self._signature = self._stat()
+        self._task = asyncio.create_task(self._watch_loop())
+
+    async def close(self):
+        """停止后台检查任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _watch_loop(self):
+        """每隔 interval 秒检查一次，文件变化时调用回调"""
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                self._stats["checks"] += 1
+                signature = await asyncio.to_thread(self._stat)
+                if signature == self._signature:
+                    continue
+                self._signature = signature
+                logger.info(f"[SSO] 检测到文件变化: {self.path}")
+                await self._on_change()
+                self._stats["reloads"] += 1
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"[SSO] 重新加载 SSO 文件失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """监视统计"""
+        return {
+            "enabled": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            **self._stats
+        }
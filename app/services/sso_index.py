@@ -0,0 +1,341 @@
+"""SSO 选择索引 - 让大规模 key 池的选择开销保持在 O(log n)
+
+索引以 key 在列表中的位置（整数 id）为单位维护，状态直接读取列式存储 UsageStore：
+- 可用性树状数组：可用为 1，用于轮询时定位下一个可用 key
+- 剩余配额树状数组：权重轮询按前缀和二分抽样
+- 最少使用 / 最久未用小顶堆：惰性删除，弹出时校验是否过期
+- 混合策略：按剩余配额分桶，每桶一个按最后使用时间排序的小顶堆，
+  同一剩余配额下最久未用的 key 得分最高，只需比较各桶堆顶
+
+进行中的请求（租约）计入选择：剩余配额扣除进行中数量，使用次数加上进行中数量，
+最后使用时间取最近一次租出时间；达到单 key 并发上限的 key 视为不可用。
+熔断中的 key 不可用；半开的 key 只允许一个进行中的试探请求。
+"""
+
+import heapq
+import random
+from array import array
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Iterable, Set, Tuple
+
+from app.services.sso_breaker import BreakerState
+from app.services.sso_usage_store import UsageStore
+
+
+class FenwickTree:
+    """树状数组：单点更新、前缀和、按前缀和定位，均为 O(log n)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tree = [0] * (size + 1)
+        self._step = 1 << (size.bit_length() - 1) if size else 0  # 不超过 size 的最大 2 的幂
+
+    @classmethod
+    def from_values(cls, values: List[int]) -> "FenwickTree":
+        """O(n) 构建"""
+        tree = cls(len(values))
+        data = tree._tree
+        for i, value in enumerate(values, 1):
+            data[i] += value
+            parent = i + (i & -i)
+            if parent <= tree.size:
+                data[parent] += data[i]
+        return tree
+
+    def add(self, index: int, delta: int):
+        """位置 index（从 0 开始）加上 delta"""
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """位置 [0, index) 之和"""
+        total = 0
+        i = index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def total(self) -> int:
+        """所有位置之和"""
+        return self.prefix(self.size)
+
+    def find(self, target: int) -> int:
+        """前缀和大于 target 的最小位置（target 需在 [0, total) 内）"""
+        pos = 0
+        step = self._step
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return pos
+
+
+class SSOIndex:
+    """SSO 选择索引
+
+    由 SSOManager 在状态或租约变化时调用 update()，选择方法只返回整数 id
+    """
+
+    REBUILD_FACTOR = 4  # 堆中过期条目超过 key 数的该倍数时重建
+
+    def __init__(self, daily_limit: int, max_inflight: int = 0):
+        self.daily_limit = daily_limit
+        self.max_inflight = max_inflight  # 单 key 并发上限，0 表示不限制
+        self._store = UsageStore()
+        self._inflight = array("i")  # 每个 key 进行中的请求数
+        self._leased_at = array("d")  # 每个 key 最近一次租出的时间
+        self._inflight_total = 0
+        self._remaining = array("i")  # 每个 key 当前计入索引的有效剩余配额（不可用为 0）
+        self._avail = FenwickTree(0)
+        self._weight = FenwickTree(0)
+        self._least_used: List[Tuple[int, int]] = []
+        self._least_recent: List[Tuple[float, int]] = []
+        self._buckets: List[List[Tuple[float, int]]] = []
+        self._heap_entries = 0
+        self.dirty: Optional[Set[int]] = None  # 不为 None 时记录状态或租约变化的 key（后台重建索引期间使用）
+
+    def __len__(self) -> int:
+        return len(self._remaining)
+
+    def _compute_remaining(self, key_id: int) -> int:
+        """有效剩余配额：扣除进行中的请求，熔断或达到并发上限时为 0"""
+        state = self._store.breaker[key_id]
+        if state == BreakerState.OPEN:
+            return 0
+        inflight = self._inflight[key_id]
+        if self.max_inflight and inflight >= self.max_inflight:
+            return 0
+        if state == BreakerState.HALF_OPEN and inflight:
+            return 0
+        return max(0, self.daily_limit - self._store.count[key_id] - inflight)
+
+    def _effective_count(self, key_id: int) -> int:
+        """使用次数（含进行中）"""
+        return self._store.count[key_id] + self._inflight[key_id]
+
+    def _effective_last_used(self, key_id: int) -> float:
+        """最后使用时间（含租出时间）"""
+        return max(self._store.last_used[key_id], self._leased_at[key_id])
+
+    def is_available(self, key_id: int) -> bool:
+        """未熔断、未超限且未达到并发上限"""
+        return self._remaining[key_id] > 0
+
+    @property
+    def available_count(self) -> int:
+        """可用 key 数"""
+        return self._avail.total
+
+    def remaining(self, key_id: int) -> int:
+        """key 的有效剩余配额（已扣除进行中的请求，不可用为 0）"""
+        return self._remaining[key_id]
+
+    def inflight(self, key_id: int) -> int:
+        """key 进行中的请求数"""
+        return self._inflight[key_id]
+
+    @property
+    def inflight_total(self) -> int:
+        """全池进行中的请求数"""
+        return self._inflight_total
+
+    def lease(self, key_id: int, now: float):
+        """租出一个 key（请求开始）"""
+        self._inflight[key_id] += 1
+        self._inflight_total += 1
+        self._leased_at[key_id] = now
+        self.update(key_id)
+
+    def leased_at(self, key_id: int) -> float:
+        """key 最近一次租出的时间"""
+        return self._leased_at[key_id]
+
+    def restore_lease(self, key_id: int, count: int, leased_at: float):
+        """设置 key 的进行中请求数（key 列表重新加载时从旧索引迁移）"""
+        self._inflight_total += count - self._inflight[key_id]
+        self._inflight[key_id] = count
+        self._leased_at[key_id] = leased_at
+        self.update(key_id)
+
+    def unlease(self, key_id: int):
+        """归还一个 key（请求结束或取消）"""
+        if self._inflight[key_id] > 0:
+            self._inflight[key_id] -= 1
+            self._inflight_total -= 1
+            self.update(key_id)
+
+    def rebuild(self, store: UsageStore, inflight: Optional[Dict[int, int]] = None):
+        """按存储全量重建，O(n)（剩余配额在安装 NumPy 时向量化计算）
+
+        Args:
+            inflight: key id -> 进行中请求数；不传时保留现有租约（key 数不变时）
+        """
+        self._store = store
+        size = len(store)
+        if inflight is not None or len(self._inflight) != size:
+            self._inflight = array("i", bytes(4 * size))
+            self._leased_at = array("d", bytes(8 * size))
+            for key_id, value in (inflight or {}).items():
+                self._inflight[key_id] = value
+            self._inflight_total = sum(self._inflight)
+
+        remaining = store.remaining(self.daily_limit)
+        if any(self._inflight):
+            for key_id in range(size):
+                if self._inflight[key_id]:
+                    remaining[key_id] = self._compute_remaining(key_id)
+        self._remaining = array("i", remaining)
+
+        self._avail = FenwickTree.from_values([1 if r else 0 for r in remaining])
+        self._weight = FenwickTree.from_values(remaining)
+
+        live = [i for i in range(size) if remaining[i]]
+        self._least_used = [(self._effective_count(i), i) for i in live]
+        self._least_recent = [(self._effective_last_used(i), i) for i in live]
+
+        self._buckets = [[] for _ in range(self.daily_limit + 1)]
+        for entry in self._least_recent:
+            self._buckets[remaining[entry[1]]].append(entry)
+        for heap in [self._least_used, self._least_recent, *self._buckets]:
+            heapq.heapify(heap)
+        self._heap_entries = 3 * len(live)
+
+    def update(self, key_id: int):
+        """单个 key 的状态或租约变化后调用，O(log n)"""
+        if self.dirty is not None:
+            self.dirty.add(key_id)
+        old_remaining = self._remaining[key_id]
+        remaining = self._compute_remaining(key_id)
+        self._remaining[key_id] = remaining
+
+        if remaining != old_remaining:
+            self._weight.add(key_id, remaining - old_remaining)
+            if bool(remaining) != bool(old_remaining):
+                self._avail.add(key_id, 1 if remaining else -1)
+
+        # 旧条目留在堆中，弹出时因与当前状态不符被丢弃
+        if remaining:
+            last_used = self._effective_last_used(key_id)
+            heapq.heappush(self._least_used, (self._effective_count(key_id), key_id))
+            heapq.heappush(self._least_recent, (last_used, key_id))
+            heapq.heappush(self._buckets[remaining], (last_used, key_id))
+            self._heap_entries += 3
+            if self._heap_entries > self.REBUILD_FACTOR * 3 * len(self) + 1024:
+                self.rebuild(self._store)
+
+    @contextmanager
+    def _excluding(self, exclude: Optional[Iterable[int]]):
+        """临时将排除的 key 从树状数组中移除"""
+        removed = []
+        for key_id in exclude or ():
+            remaining = self._remaining[key_id]
+            if remaining:
+                self._weight.add(key_id, -remaining)
+                self._avail.add(key_id, -1)
+                removed.append((key_id, remaining))
+        try:
+            yield
+        finally:
+            for key_id, remaining in removed:
+                self._weight.add(key_id, remaining)
+                self._avail.add(key_id, 1)
+
+    def _pop_valid(
+        self,
+        heap: list,
+        is_valid,
+        exclude: Optional[set]
+    ) -> Optional[tuple]:
+        """弹出过期条目，返回第一个有效且未被排除的条目（保留在堆中）"""
+        skipped = []
+        found = None
+        while heap:
+            entry = heap[0]
+            if not is_valid(entry):
+                heapq.heappop(heap)
+                self._heap_entries -= 1
+                continue
+            if exclude and entry[1] in exclude:
+                skipped.append(heapq.heappop(heap))
+                continue
+            found = entry
+            break
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return found
+
+    def pick_round_robin(self, cursor: int, exclude: Optional[set] = None) -> Optional[int]:
+        """从 cursor 开始（含）的下一个可用 key，到末尾后回到开头"""
+        with self._excluding(exclude):
+            total = self._avail.total
+            if not total:
+                return None
+            rank = self._avail.prefix(min(cursor, len(self)))
+            return self._avail.find(rank if rank < total else 0)
+
+    def pick_least_used(self, exclude: Optional[set] = None) -> Optional[int]:
+        """使用次数最少的可用 key"""
+        entry = self._pop_valid(
+            self._least_used,
+            lambda e: self._effective_count(e[1]) == e[0] and self.is_available(e[1]),
+            exclude
+        )
+        return entry[1] if entry else None
+
+    def pick_least_recent(self, exclude: Optional[set] = None) -> Optional[int]:
+        """最久未使用的可用 key"""
+        entry = self._pop_valid(
+            self._least_recent,
+            lambda e: self._effective_last_used(e[1]) == e[0] and self.is_available(e[1]),
+            exclude
+        )
+        return entry[1] if entry else None
+
+    def pick_weighted(self, exclude: Optional[set] = None) -> Optional[int]:
+        """按剩余配额加权随机选择"""
+        with self._excluding(exclude):
+            total = self._weight.total
+            if not total:
+                return None
+            return self._weight.find(random.randrange(total))
+
+    def sample_weighted(self, k: int, exclude: Optional[set] = None) -> List[int]:
+        """按剩余配额加权抽样最多 k 个不同的可用 key，O(k log n)"""
+        with self._excluding(exclude):
+            total = self._weight.total
+            if not total:
+                return []
+            return list(dict.fromkeys(
+                self._weight.find(random.randrange(total)) for _ in range(k)
+            ))
+
+    def pick_hybrid(self, now: float, exclude: Optional[set] = None) -> Optional[int]:
+        """混合策略：得分 = 剩余配额 * (1 + 时间因子)，每个剩余配额桶只需比较堆顶"""
+        best_score = -1.0
+        selected = None
+        for remaining in range(len(self._buckets) - 1, 0, -1):
+            entry = self._pop_valid(
+                self._buckets[remaining],
+                lambda e, r=remaining: (
+                    self._effective_last_used(e[1]) == e[0] and self._remaining[e[1]] == r
+                ),
+                exclude
+            )
+            if entry is None:
+                continue
+            last_used = entry[0]
+            if last_used == 0:
+                time_factor = 10
+            else:
+                time_factor = min(10, (now - last_used) / 60 * 0.1)
+            score = remaining * (1 + time_factor)
+            if score > best_score:
+                best_score = score
+                selected = entry[1]
+        return selected
@@ -0,0 +1,229 @@
+"""SSO 状态日志 - 追加写日志 + 快照，替代每次调用全量重写 JSON
+
+- 每次状态变更只在内存中追加一条记录，O(1)
+- 后台任务按时间间隔或记录数批量刷盘（追加写）
+- 日志记录数超过阈值时压缩：写入完整快照（临时文件 + 原子替换）后清空日志
+- 快照内容由调用方序列化，文件开头记录快照对应的日志序号
+- 启动时先加载快照再重放日志；每条记录带序号，快照中已包含的记录重放时跳过
+- 进程在写入中途崩溃只可能留下不完整的最后一行，重放时忽略
+- enabled=False 时不读写任何文件（仅在内存中记账的管理器，如 Redis 不可用时的本地降级）
+"""
+
+import asyncio
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+from app.core.logger import logger
+
+
+# 生成完整快照的回调（同步执行，返回序列化后的状态）
+SnapshotFunc = Callable[[], bytes]
+
+# 快照文件头：快照包含的最后一条日志序号
+_SEQ = struct.Struct("<Q")
+
+
+class SSOJournal:
+    """SSO 使用状态的追加写日志"""
+
+    def __init__(
+        self,
+        snapshot_file: Path,
+        flush_interval: float = 1.0,
+        flush_batch: int = 100,
+        compact_records: int = 10000,
+        enabled: bool = True
+    ):
+        self.enabled = enabled
+        self.snapshot_file = snapshot_file
+        self.journal_file = snapshot_file.with_suffix(".journal")
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.compact_records = compact_records
+        self._snapshot_func: Optional[SnapshotFunc] = None
+        self._buffer: List[str] = []
+        self._seq = 0  # 最后一条记录的序号
+        self._journal_records = 0  # 日志文件中的记录数（用于判断是否需要压缩）
+        self._flush_event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._io_lock = asyncio.Lock()
+        self._stats = {"appended": 0, "flushes": 0, "compactions": 0, "replayed": 0}
+
+    def bind(self, snapshot_func: SnapshotFunc):
+        """绑定生成快照的回调"""
+        self._snapshot_func = snapshot_func
+
+    def load(self, default_seq: int = 0) -> Tuple[Optional[bytes], List[Dict[str, Any]]]:
+        """读取快照和快照之后的日志记录
+
+        Args:
+            default_seq: 快照不存在时已恢复状态对应的日志序号（如从旧版状态文件迁移）
+
+        Returns:
+            (快照内容, 需要重放的记录列表)
+        """
+        snapshot = None
+        snapshot_seq = default_seq
+        if not self.enabled:
+            return None, []
+        if self.snapshot_file.exists():
+            data = self.snapshot_file.read_bytes()
+            (snapshot_seq,) = _SEQ.unpack_from(data, 0)
+            snapshot = data[_SEQ.size:]
+        self._seq = snapshot_seq
+
+        records = []
+        self._journal_records = 0
+        if self.journal_file.exists():
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时未写完的行
+                        continue
+                    self._journal_records += 1
+                    seq = record.get("s", 0)
+                    if seq <= snapshot_seq:
+                        continue
+                    records.append(record)
+                    self._seq = max(self._seq, seq)
+
+        self._stats["replayed"] += len(records)
+        return snapshot, records
+
+    @property
+    def seq(self) -> int:
+        """最后一条记录的序号（写入快照，用于重放时去重）"""
+        return self._seq
+
+    def append(self, op: str, **fields):
+        """追加一条记录（只写内存缓冲区）"""
+        self._seq += 1
+        if not self.enabled:
+            return
+        self._buffer.append(json.dumps({"op": op, "s": self._seq, **fields}) + "\n")
+        self._stats["appended"] += 1
+
+        if self._task is None or self._task.done():
+            # 未启动后台任务时（如脚本中使用）直接写入
+            self._write_lines(self._take_buffer())
+        elif len(self._buffer) >= self.flush_batch:
+            self._flush_event.set()
+
+    def _take_buffer(self) -> List[str]:
+        """取出缓冲区内容"""
+        lines, self._buffer = self._buffer, []
+        return lines
+
+    def _write_lines(self, lines: List[str]):
+        """追加写入日志文件"""
+        if not lines:
+            return
+        try:
+            self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_records += len(lines)
+            self._stats["flushes"] += 1
+        except Exception as e:
+            logger.warning(f"[SSO] 写入状态日志失败: {e}")
+
+    def _write_snapshot(self, seq: int, data: bytes):
+        """写入快照（临时文件 + 原子替换），然后清空日志"""
+        tmp_path = self.snapshot_file.with_name(f".{self.snapshot_file.name}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(_SEQ.pack(seq))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_file)
+        # 快照已包含日志中的全部记录；即使在此处崩溃，重放时也会按序号跳过
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+        self._journal_records = 0
+        self._stats["compactions"] += 1
+
+    async def flush(self):
+        """将缓冲区写入日志文件"""
+        async with self._io_lock:
+            lines = self._take_buffer()
+            if lines:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_lines, lines)
+
+    async def compact(self):
+        """生成快照并清空日志"""
+        if self._snapshot_func is None or not self.enabled:
+            return
+        async with self._io_lock:
+            # 快照包含缓冲区中所有记录的效果，生成快照与丢弃缓冲区之间不能让出事件循环
+            data = self._snapshot_func()
+            seq = self._seq
+            self._buffer.clear()
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._write_snapshot, seq, data
+                )
+                logger.debug(f"[SSO] 状态日志已压缩 (seq={self._seq})")
+            except Exception as e:
+                logger.warning(f"[SSO] 压缩状态日志失败: {e}")
+
+    def compact_sync(self):
+        """同步生成快照（未启动后台任务时使用）"""
+        if self._snapshot_func is None or not self.enabled:
+            return
+        data = self._snapshot_func()
+        self._buffer.clear()
+        try:
+            self._write_snapshot(self._seq, data)
+        except Exception as e:
+            logger.warning(f"[SSO] 压缩状态日志失败: {e}")
+
+    async def start(self):
+        """启动后台刷盘任务"""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """停止后台任务，刷盘并压缩"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.compact()
+
+    async def _flush_loop(self):
+        """按时间间隔或记录数批量刷盘，日志过长时压缩"""
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_event.clear()
+
+                if self._journal_records + len(self._buffer) >= self.compact_records:
+                    await self.compact()
+                else:
+                    await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[SSO] 状态日志刷盘异常: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取日志统计"""
+        return {
+            "seq": self._seq,
+            "buffered": len(self._buffer),
+            "journal_records": self._journal_records,
+            **self._stats
+        }
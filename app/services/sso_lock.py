@@ -0,0 +1,55 @@
+"""带等待时间统计的锁
+
+SSO 管理器的锁统一使用 TimedLock，状态接口中暴露获取次数、发生等待的次数和等待时间，
+用于判断锁是否成为并发瓶颈。
+"""
+
+import asyncio
+import time
+from typing import Iterable, Dict, Any
+
+
+class TimedLock:
+    """记录等待时间的 asyncio.Lock（用法同 asyncio.Lock）"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.acquisitions = 0
+        self.contended = 0  # 需要等待的次数
+        self.wait_total = 0.0  # 累计等待时间（秒）
+        self.wait_max = 0.0
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def __aenter__(self):
+        self.acquisitions += 1
+        if not self._lock.locked():
+            await self._lock.acquire()
+            return self
+        start = time.perf_counter()
+        await self._lock.acquire()
+        wait = time.perf_counter() - start
+        self.contended += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._lock.release()
+
+
+def lock_stats(locks: Iterable[TimedLock]) -> Dict[str, Any]:
+    """汇总一组锁的等待统计"""
+    locks = list(locks)
+    acquisitions = sum(lock.acquisitions for lock in locks)
+    contended = sum(lock.contended for lock in locks)
+    wait_total = sum(lock.wait_total for lock in locks)
+    return {
+        "locks": len(locks),
+        "acquisitions": acquisitions,
+        "contended": contended,
+        "wait_total_ms": round(wait_total * 1000, 2),
+        "wait_avg_ms": round(wait_total * 1000 / contended, 3) if contended else 0,
+        "wait_max_ms": round(max((lock.wait_max for lock in locks), default=0) * 1000, 3)
+    }
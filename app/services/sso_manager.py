@@ -1,21 +1,46 @@
 """SSO 密钥管理器 - 文件版本（支持多种轮询策略）
 
 支持功能：
-1. 每个 key 的使用次数限制 (24小时10次)
+1. 每个 key 的使用次数限制（滑动窗口：任意 24 小时内 10 次，每个 key 在最早一次使用移出窗口时恢复配额）
 2. 最后使用时间记录
 3. 多种轮询策略
-4. 状态保存到 JSON 文件（重启不丢失）
+4. 租约：统计每个 key 进行中的请求数并限制并发，选择时计入进行中的负载
+5. 熔断器：失败按原因分类冷却，冷却结束后以单个试探请求恢复
+6. 遥测：每个 key 的延迟与错误率 EWMA，供延迟感知策略使用
+7. 状态变更追加写入日志并定期压缩为快照（重启不丢失）
+8. 准入队列：没有可用容量时有限等待，容量释放时按到达顺序分配
+9. 热加载：监视 SSO 文件，只应用新增和删除的 key，已有 key 的状态不变
+10. 不在池中的 key（API Key 专用 SSO）单独记录配额和熔断状态，不参与池的选择
 """
 
 import asyncio
+import heapq
 import json
+import struct
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Set, Tuple
 from enum import Enum
-from dataclasses import dataclass, field, asdict
 from app.core.config import settings
 from app.core.logger import logger
+from app.services.sso_admission import AdmissionQueue, retry_after_seconds
+from app.services.sso_breaker import (
+    BreakerState, FailureKind, FAILURE_CODES, FAILURE_KINDS,
+    classify_failure, cooldown_seconds, failure_threshold
+)
+from app.services.sso_file_watcher import SSOFileWatcher
+from app.services.sso_journal import SSOJournal
+from app.services.sso_lock import TimedLock, lock_stats
+from app.services.sso_telemetry import KeyTelemetry
+from app.services.sso_index import SSOIndex
+from app.services.sso_usage_store import (
+    UsageStore, key_hash, list_fingerprint, pack_hashes, snapshot_hashes
+)
+
+
+# 有专用 SSO 状态时的快照：魔数, 池快照长度，之后依次为池快照和专用 SSO 快照
+_WITH_EXTRA = struct.Struct("<4sQ")
+_EXTRA_MAGIC = b"SSOX"
 
 
 class RotationStrategy(Enum):
@@ -25,367 +50,812 @@ class RotationStrategy(Enum):
     LEAST_RECENT = "least_recent"      # 最久未用优先
     WEIGHTED = "weighted"              # 权重轮询（剩余配额加权）
     HYBRID = "hybrid"                  # 混合策略（推荐）
-
-
-@dataclass
-class KeyUsage:
-    """单个 key 的使用统计"""
-    count: int = 0              # 今日使用次数
-    last_used: float = 0        # 最后使用时间戳
-    first_used: float = 0       # 首次使用时间戳
-    failed: bool = False        # 是否标记为失败
+    LATENCY = "latency"                # 延迟感知（按实时遥测优先快速、健康的 key）
 
 
 class SSOManager:
     """SSO 密钥管理器 - 支持多种轮询策略
 
     从 SSO_FILE 文件加载 token，每行一个
-    状态保存到 JSON 文件以实现持久化
+    使用统计以列式数组存储（key 在列表中的位置为 id）
+    状态变更写入追加日志（批量刷盘），定期压缩为二进制快照以实现持久化
     """
 
-    # 配置
-    RESET_INTERVAL = 86400     # 24小时（秒）
-
     def __init__(
         self,
         strategy: str = "hybrid",
-        daily_limit: int = 10
+        daily_limit: int = 10,
+        max_inflight: int = 0,
+        persist: bool = True
     ):
+        self._persist = persist  # 为 False 时不读写状态文件，只在内存中记账（如 Redis 模式的本地降级）
         self._sso_list: List[str] = []
+        self._ids: Dict[str, int] = {}  # SSO -> 在列表中的位置（索引 id）
+        self._hashes: Optional[List[str]] = None  # 按 id 顺序的短哈希（首次需要时计算）
+        self._fingerprint = b""  # key 列表指纹
         self._current_index: int = 0
-        self._lock = asyncio.Lock()
-        self._usage: Dict[str, KeyUsage] = {}
-        self._last_reset: float = 0
+        # 锁内只有同步的内存操作（日志为缓冲追加，文件读写都在锁外），等待时间见状态中的 lock
+        self._lock = TimedLock()
+        self._store = UsageStore()
+        # 不在池中的 key（API Key 专用 SSO）：短哈希 -> 行号，按需追加，同样写入日志和快照
+        self._extra = UsageStore(slots=daily_limit)
+        self._extra_ids: Dict[str, int] = {}
+        self._open_heap: List[Tuple[float, int]] = []  # (冷却结束时间, id)，惰性删除
+        self._usage_heap: List[Tuple[float, int]] = []  # (最早一次使用移出窗口的时间, id)，惰性删除
+        self._last_reset: float = 0  # 上次手动重置时间
         self.strategy = RotationStrategy(strategy)
         self.daily_limit = daily_limit
-        self._state_file = settings.SSO_FILE.parent / "sso_state.json"
-
-    def _key_hash(self, sso: str) -> str:
-        """生成 key 的短哈希"""
-        import hashlib
-        return hashlib.md5(sso.encode()).hexdigest()[:12]
+        self.quota_window = settings.SSO_QUOTA_WINDOW
+        self._legacy_state_file = settings.SSO_FILE.parent / "sso_state.json"
+        self._journal = SSOJournal(
+            settings.SSO_FILE.parent / "sso_state.bin",
+            flush_interval=settings.SSO_JOURNAL_FLUSH_INTERVAL,
+            flush_batch=settings.SSO_JOURNAL_FLUSH_BATCH,
+            compact_records=settings.SSO_JOURNAL_COMPACT_RECORDS,
+            enabled=persist
+        )
+        self._journal.bind(self._snapshot)
+        self.max_inflight = max_inflight
+        self._index = SSOIndex(daily_limit, max_inflight)
+        self._telemetry = KeyTelemetry(settings.SSO_TELEMETRY_ALPHA)
+        self._admission = AdmissionQueue(settings.SSO_ADMISSION_WAIT, settings.SSO_ADMISSION_MAX_QUEUE)
+        self._watcher = SSOFileWatcher(settings.SSO_FILE, settings.SSO_RELOAD_INTERVAL, self.reload)
+        self._reload_lock = asyncio.Lock()  # 同一时间只进行一次增量加载
+        self._generation = 0  # 全量重置或加载时递增，使进行中的增量加载改为同步重建
+
+    def _hash_list(self) -> List[str]:
+        """按 id 顺序的短哈希"""
+        if self._hashes is None:
+            self._hashes = [key_hash(sso) for sso in self._sso_list]
+        return self._hashes
+
+    def _ids_by_hash(self) -> Dict[str, int]:
+        """短哈希 -> id 映射"""
+        return {hash_value: key_id for key_id, hash_value in enumerate(self._hash_list())}
 
     def load_sso_list(self) -> int:
         """从文件加载 SSO 列表"""
-        self._sso_list = []
+        # 重新加载时保留进行中的租约和遥测指标（按 key 对应到新位置）
+        old_ids = self._ids
+        leases = {
+            sso: self._index.inflight(key_id)
+            for sso, key_id in old_ids.items() if self._index.inflight(key_id)
+        }
+        self._generation += 1
+        self._sso_list = self._read_sso_file()
+        self._ids = {sso: key_id for key_id, sso in enumerate(self._sso_list)}
+        self._hashes = None
+        telemetry = KeyTelemetry(settings.SSO_TELEMETRY_ALPHA, len(self._sso_list))
+        telemetry.copy_rows(self._telemetry, {
+            old_id: self._ids[sso] for sso, old_id in old_ids.items() if sso in self._ids
+        })
+        self._telemetry = telemetry
+        self._fingerprint = list_fingerprint(self._sso_list)
+        # 初始化使用统计
+        self._store = UsageStore(len(self._sso_list), now=time.time(), slots=self.daily_limit)
+        self._extra = UsageStore(slots=self.daily_limit)
+        self._extra_ids = {}
+
+        # 加载持久化状态
+        if self._sso_list and self._persist:
+            self._load_state()
+        self._refresh_usage()
+        self._rebuild_index({self._ids[sso]: count for sso, count in leases.items() if sso in self._ids})
 
+        logger.info(f"[SSO] 从文件加载了 {len(self._sso_list)} 个 SSO，策略: {self.strategy.value}")
+        return len(self._sso_list)
+
+    def _read_sso_file(self) -> List[str]:
+        """读取 SSO 文件（去重并保持顺序）"""
         sso_file = settings.SSO_FILE
         if not sso_file.exists():
             logger.warning(f"[SSO] 文件不存在: {sso_file}")
-            return 0
-
+            return []
         with open(sso_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                sso = line.strip()
-                if sso and not sso.startswith('#'):
-                    self._sso_list.append(sso)
-                    # 初始化使用统计
-                    if sso not in self._usage:
-                        self._usage[sso] = KeyUsage(first_used=time.time())
-
-        # 加载持久化状态
-        self._load_state()
+            lines = (line.strip() for line in f.read().splitlines())
+            return list(dict.fromkeys(
+                sso for sso in lines if sso and not sso.startswith('#')
+            ))
+
+    def _build_state(self, sso_list: List[str]) -> Dict[str, Any]:
+        """按新的 key 列表构建存储、遥测、选择索引和堆，保留仍在列表中的 key 的状态和租约
+
+        只读取当前状态、不修改，可在线程中执行；构建期间的状态变化由旧索引的 dirty 记录
+        """
+        old_ids = self._ids
+        ids = {sso: key_id for key_id, sso in enumerate(sso_list)}
+        mapping = {old_ids[sso]: key_id for sso, key_id in ids.items() if sso in old_ids}
+
+        store = UsageStore(len(sso_list), now=time.time(), slots=self.daily_limit)
+        store.copy_rows(self._store, mapping)
+        telemetry = KeyTelemetry(settings.SSO_TELEMETRY_ALPHA, len(sso_list))
+        telemetry.copy_rows(self._telemetry, mapping)
+        old_index = self._index
+        inflight = {
+            new_id: old_index.inflight(old_id)
+            for old_id, new_id in mapping.items() if old_index.inflight(old_id)
+        }
+        usage_heap = self._build_usage_heap(store, time.time())
+        index = SSOIndex(self.daily_limit, self.max_inflight)
+        index.rebuild(store, inflight)
+        return {
+            "sso_list": sso_list,
+            "ids": ids,
+            "mapping": mapping,
+            "store": store,
+            "telemetry": telemetry,
+            "index": index,
+            "usage_heap": usage_heap,
+            "open_heap": self._build_open_heap(store)
+        }
 
-        logger.info(f"[SSO] 从文件加载了 {len(self._sso_list)} 个 SSO，策略: {self.strategy.value}")
-        return len(self._sso_list)
+    def _install_state(self, state: Dict[str, Any], dirty: Iterable[int] = ()) -> Tuple[int, int]:
+        """一次性替换为 _build_state 构建的状态（同步执行，请求不会看到中间状态）
+
+        Args:
+            dirty: 构建期间状态或租约发生变化的旧 id，按当前值重新复制
+
+        Returns:
+            (新增 key 数, 删除 key 数)
+        """
+        sso_list, ids, mapping = state["sso_list"], state["ids"], state["mapping"]
+        store, index = state["store"], state["index"]
+        window_start = time.time() - self.quota_window
+        for old_id in dirty:
+            new_id = mapping.get(old_id)
+            if new_id is None:
+                continue
+            store.copy_rows(self._store, {old_id: new_id})
+            if store.refresh_count(new_id, window_start):
+                heapq.heappush(
+                    state["usage_heap"],
+                    (store.oldest_use(new_id, window_start) + self.quota_window, new_id)
+                )
+            if store.breaker[new_id] == BreakerState.OPEN:
+                heapq.heappush(state["open_heap"], (store.open_until[new_id], new_id))
+            index.restore_lease(new_id, self._index.inflight(old_id), self._index.leased_at(old_id))
+
+        # 轮询位置跟随原位置上的 key
+        cursor = self._current_index
+        if self._sso_list:
+            cursor = ids.get(self._sso_list[cursor % len(self._sso_list)], min(cursor, len(sso_list)))
+
+        added = len(ids) - len(mapping)
+        removed = len(self._ids) - len(mapping)
+        self._sso_list = sso_list
+        self._ids = ids
+        self._hashes = None
+        self._fingerprint = list_fingerprint(sso_list)
+        self._store = store
+        self._telemetry = state["telemetry"]
+        self._index = index
+        self._usage_heap = state["usage_heap"]
+        self._open_heap = state["open_heap"]
+        self._current_index = cursor
+        return added, removed
 
     def _load_state(self):
-        """从文件加载状态"""
-        if not self._state_file.exists():
-            return
-
+        """加载快照并重放之后的状态日志"""
         try:
-            with open(self._state_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            self._last_reset = data.get("last_reset", 0)
-            self._current_index = data.get("current_index", 0)
-
-            # 检查是否需要每日重置
-            if time.time() - self._last_reset >= self.RESET_INTERVAL:
-                self._do_daily_reset()
-            else:
-                # 恢复使用统计
-                for key_hash, usage_data in data.get("usage", {}).items():
-                    # 找到对应的 sso
-                    for sso in self._sso_list:
-                        if self._key_hash(sso) == key_hash:
-                            self._usage[sso] = KeyUsage(**usage_data)
-                            break
-
-            logger.info("[SSO] 已加载持久化状态")
+            legacy_seq = None
+            if not self._journal.snapshot_file.exists() and self._legacy_state_file.exists():
+                legacy_seq = self._load_legacy_state()
+
+            data, records = self._journal.load(default_seq=legacy_seq or 0)
+            if data and data.startswith(_EXTRA_MAGIC):
+                _, size = _WITH_EXTRA.unpack_from(data, 0)
+                start = _WITH_EXTRA.size
+                data, extra = data[start:start + size], data[start + size:]
+                self._load_extra(extra)
+            if data:
+                header = self._store.load_bytes(data, self._fingerprint, self._ids_by_hash)
+                self._last_reset = header["last_reset"]
+                self._current_index = header["current_index"]
         except Exception as e:
             logger.warning(f"[SSO] 加载状态失败: {e}")
+            return
 
-    def _save_state(self):
-        """保存状态到文件"""
-        try:
-            usage_data = {}
-            for sso, usage in self._usage.items():
-                usage_data[self._key_hash(sso)] = asdict(usage)
-
-            data = {
-                "last_reset": self._last_reset,
-                "current_index": self._current_index,
-                "usage": usage_data
-            }
-
-            with open(self._state_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            logger.warning(f"[SSO] 保存状态失败: {e}")
-
-    def _do_daily_reset(self):
-        """执行每日重置"""
-        logger.info("[SSO] 执行每日重置...")
-        for sso in self._sso_list:
-            if sso in self._usage:
-                self._usage[sso].count = 0
-                self._usage[sso].failed = False
-        self._last_reset = time.time()
-        self._save_state()
-        logger.info("[SSO] 每日重置完成")
-
-    def _check_daily_reset(self):
-        """检查是否需要每日重置"""
-        if self._last_reset == 0:
-            self._last_reset = time.time()
+        if data is None and not records and legacy_seq is None:
             return
 
-        if time.time() - self._last_reset >= self.RESET_INTERVAL:
-            self._do_daily_reset()
+        ids = self._ids_by_hash() if records else {}
+        for record in records:
+            self._apply_record(record, ids)
+
+        if legacy_seq is not None:
+            # 迁移到二进制快照
+            self._journal.compact_sync()
+
+        logger.info(f"[SSO] 已加载持久化状态 (重放 {len(records)} 条日志)")
+
+    def _load_extra(self, data: bytes):
+        """载入快照中专用 SSO 的状态"""
+        hashes = snapshot_hashes(data)
+        self._extra = UsageStore(len(hashes), slots=self.daily_limit)
+        self._extra_ids = {hash_value: row for row, hash_value in enumerate(hashes)}
+        self._extra.load_bytes(data, list_fingerprint(hashes), lambda: self._extra_ids)
+
+    def _extra_row(self, hash_value: str) -> int:
+        """专用 SSO 的行号，首次出现时追加"""
+        row = self._extra_ids.get(hash_value)
+        if row is None:
+            row = self._extra_ids[hash_value] = self._extra.append(time.time())
+        return row
+
+    def _load_legacy_state(self) -> int:
+        """读取旧版 JSON 状态文件，返回其对应的日志序号"""
+        with open(self._legacy_state_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self._last_reset = data.get("last_reset", 0)
+        self._current_index = data.get("current_index", 0)
+        self._store.load_legacy(data.get("usage", {}), self._ids_by_hash())
+        logger.info("[SSO] 已从旧版 JSON 状态文件迁移")
+        return data.get("seq", 0)
+
+    def _apply_record(self, record: Dict[str, Any], ids: Dict[str, int]):
+        """重放一条状态日志"""
+        op = record.get("op")
+        if op == "start":
+            # 旧版日志中记录的每日重置起点，滑动窗口下不再使用
+            return
+        if op == "reset":
+            self._store.reset_usage()
+            self._extra.reset_usage()
+            self._last_reset = record.get("t", 0)
+            return
+        if op == "reset_failed":
+            self._store.clear_failed()
+            self._extra.clear_failed()
+            return
 
-    def _get_available_keys(self) -> List[str]:
-        """获取所有可用的 key（未失败且未超限）"""
-        available = []
-        for sso in self._sso_list:
-            usage = self._usage.get(sso, KeyUsage())
-            if usage.failed:
-                continue
-            if usage.count >= self.daily_limit:
+        hash_value = record.get("k", "")
+        if not hash_value:
+            return
+        store, key_id = self._store, ids.get(hash_value)
+        if key_id is None:
+            # 不在池中的 key 记入专用 SSO 状态
+            store, key_id = self._extra, self._extra_row(hash_value)
+        if op == "use":
+            # 池中 key 的窗口内次数在重放结束后统一按时间戳重新计算
+            store.add_use(key_id, record.get("t", 0))
+            store.count[key_id] += 1
+        elif op == "fail":
+            kind = record.get("r")
+            store.fail_kind[key_id] = FAILURE_CODES[FailureKind(kind)] if kind else 0
+            store.trips[key_id] = record.get("n", 1)
+            if "u" not in record or record["u"]:
+                # 旧版记录没有冷却时间，视为冷却已结束
+                store.breaker[key_id] = BreakerState.OPEN
+                store.open_until[key_id] = record.get("u", 0)
+        elif op == "ok":
+            self._close_breaker(key_id, store)
+
+    def _snapshot(self) -> bytes:
+        """生成完整状态快照（有专用 SSO 状态时附加在池快照之后）"""
+        data = self._store.to_bytes(
+            pack_hashes(self._hash_list()),
+            self._fingerprint,
+            self._last_reset,
+            self._current_index
+        )
+        if not self._extra_ids:
+            return data
+        hashes = list(self._extra_ids)
+        extra = self._extra.to_bytes(pack_hashes(hashes), list_fingerprint(hashes), 0, 0)
+        return _WITH_EXTRA.pack(_EXTRA_MAGIC, len(data)) + data + extra
+
+    def _rebuild_index(self, inflight: Optional[Dict[int, int]] = None):
+        """全量重建选择索引和熔断冷却堆，O(n)
+
+        Args:
+            inflight: key id -> 进行中请求数；不传时保留现有租约
+        """
+        self._index.rebuild(self._store, inflight)
+        self._open_heap = self._build_open_heap(self._store)
+
+    @staticmethod
+    def _build_open_heap(store: UsageStore) -> List[Tuple[float, int]]:
+        """熔断冷却堆，O(n)"""
+        heap = [
+            (open_until, key_id)
+            for key_id, (state, open_until) in enumerate(zip(store.breaker, store.open_until))
+            if state == BreakerState.OPEN
+        ]
+        heapq.heapify(heap)
+        return heap
+
+    def _refresh_usage(self):
+        """按当前时间重新计算有使用记录的 key 的窗口内次数，并重建窗口到期堆，O(n)"""
+        self._usage_heap = self._build_usage_heap(self._store, time.time())
+
+    def _build_usage_heap(self, store: UsageStore, now: float) -> List[Tuple[float, int]]:
+        """重新计算有使用记录的 key 的窗口内次数，返回窗口到期堆，O(n)"""
+        window_start = now - self.quota_window
+        heap = []
+        for key_id in [i for i, count in enumerate(store.count) if count]:
+            if store.refresh_count(key_id, window_start):
+                heap.append((store.oldest_use(key_id, window_start) + self.quota_window, key_id))
+        heapq.heapify(heap)
+        return heap
+
+    def _expire_usage(self, now: float):
+        """移出窗口的使用记录到期后恢复对应 key 的配额，每个到期 key O(slots + log n)"""
+        window_start = now - self.quota_window
+        heap = self._usage_heap
+        while heap and heap[0][0] <= now:
+            _, key_id = heapq.heappop(heap)
+            if self._store.refresh_count(key_id, window_start):
+                heapq.heappush(
+                    heap, (self._store.oldest_use(key_id, window_start) + self.quota_window, key_id)
+                )
+            self._index.update(key_id)
+
+    def _close_breaker(self, key_id: int, store: Optional[UsageStore] = None):
+        """关闭熔断器（恢复正常）"""
+        store = store or self._store
+        store.breaker[key_id] = BreakerState.CLOSED
+        store.trips[key_id] = 0
+        store.open_until[key_id] = 0
+        store.fail_kind[key_id] = 0
+
+    def _pop_open(self, now: Optional[float] = None) -> Optional[int]:
+        """弹出冷却已结束（now 为 None 时不限）的最早一个熔断 key，转为半开"""
+        while self._open_heap:
+            open_until, key_id = self._open_heap[0]
+            if (
+                self._store.breaker[key_id] != BreakerState.OPEN
+                or self._store.open_until[key_id] != open_until
+            ):
+                heapq.heappop(self._open_heap)
                 continue
-            available.append(sso)
-        return available
-
-    async def get_next_sso(self) -> Optional[str]:
-        """获取下一个可用的 SSO"""
-        async with self._lock:
-            if not self._sso_list:
-                self.load_sso_list()
-
-            if not self._sso_list:
+            if now is not None and open_until > now:
                 return None
+            heapq.heappop(self._open_heap)
+            self._store.breaker[key_id] = BreakerState.HALF_OPEN
+            self._index.update(key_id)
+            return key_id
+        return None
 
-            # 检查每日重置
-            self._check_daily_reset()
-
-            # 根据策略选择
-            if self.strategy == RotationStrategy.ROUND_ROBIN:
-                return self._get_round_robin()
-            elif self.strategy == RotationStrategy.LEAST_USED:
-                return self._get_least_used()
-            elif self.strategy == RotationStrategy.LEAST_RECENT:
-                return self._get_least_recent()
-            elif self.strategy == RotationStrategy.WEIGHTED:
-                return self._get_weighted()
-            else:  # HYBRID
-                return self._get_hybrid()
-
-    def _get_round_robin(self) -> Optional[str]:
-        """简单轮询"""
-        available = self._get_available_keys()
-        if not available:
-            return self._handle_all_exhausted()
-
-        # 确保索引在范围内
-        self._current_index = self._current_index % len(available)
-        selected = available[self._current_index]
-        self._current_index = (self._current_index + 1) % len(available)
-        return selected
-
-    def _get_least_used(self) -> Optional[str]:
-        """最少使用优先"""
-        available = self._get_available_keys()
-        if not available:
-            return self._handle_all_exhausted()
+    def _promote_half_open(self, now: float):
+        """冷却结束的 key 转为半开，允许一个试探请求（由时间推导，不写日志）"""
+        while self._pop_open(now) is not None:
+            pass
 
-        min_count = float('inf')
-        selected = available[0]
+    async def start(self):
+        """启动状态日志的后台刷盘任务和 SSO 文件监视（在应用启动时调用）"""
+        await self._journal.start()
+        await self._watcher.start()
 
-        for sso in available:
-            usage = self._usage.get(sso, KeyUsage())
-            if usage.count < min_count:
-                min_count = usage.count
-                selected = sso
+    async def close(self):
+        """停止文件监视，刷盘并压缩状态日志（在应用关闭时调用）"""
+        await self._watcher.close()
+        await self._journal.close()
 
-        return selected
+    async def get_next_sso(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """获取下一个可用的 SSO（不占用租约）
 
-    def _get_least_recent(self) -> Optional[str]:
-        """最久未用优先"""
-        available = self._get_available_keys()
-        if not available:
-            return self._handle_all_exhausted()
+        Args:
+            exclude: 需要排除的 SSO（如对冲请求需要与主请求使用不同的 key）
+        """
+        async with self._lock:
+            return self._select(exclude)
 
-        oldest_time = float('inf')
-        selected = available[0]
+    async def acquire(
+        self,
+        exclude: Optional[Set[str]] = None,
+        wait: Optional[float] = None
+    ) -> Optional[str]:
+        """选择一个 SSO 并占用租约，使用完毕后必须调用 release()
+
+        选择与占用在同一把锁内完成，并发请求会看到彼此的租约而分散到不同 key；
+        没有可用容量时进入准入队列等待（见 sso_admission）
+
+        Args:
+            exclude: 需要排除的 SSO
+            wait: 最长等待秒数，默认 SSO_ADMISSION_WAIT；0 表示不等待
+        """
+        return await self._admission.admit(
+            lambda: self._try_acquire(exclude), self._next_free_at, wait
+        )
 
-        for sso in available:
-            usage = self._usage.get(sso, KeyUsage())
-            if usage.last_used < oldest_time:
-                oldest_time = usage.last_used
-                selected = sso
+    async def _try_acquire(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """立即选择并占用一个 SSO，没有可用容量时返回 None"""
+        async with self._lock:
+            sso = self._select(exclude)
+            key_id = self._ids.get(sso) if sso else None
+            if key_id is not None:
+                self._index.lease(key_id, time.time())
+            return sso
+
+    def release(self, sso: str):
+        """归还 acquire() 占用的租约（同步执行，可在 finally 中安全调用，包括任务被取消时）"""
+        key_id = self._ids.get(sso)
+        if key_id is not None:
+            self._index.unlease(key_id)
+            self._admission.notify()
+
+    async def _next_free_at(self) -> Tuple[Optional[float], bool]:
+        """最早到期恢复容量的时间（使用记录移出窗口或熔断冷却结束），以及是否有进行中的请求
+
+        堆中过期的条目只会让时间偏早，最多多重试一次
+        """
+        candidates = []
+        if self._usage_heap:
+            candidates.append(self._usage_heap[0][0])
+        if self._open_heap:
+            candidates.append(self._open_heap[0][0])
+        return min(candidates, default=None), self._index.inflight_total > 0
+
+    async def retry_after(self) -> int:
+        """没有可用容量时建议客户端重试的间隔（秒），用于 Retry-After
+
+        进行中的请求按全池平均耗时估计其完成时间
+        """
+        async with self._lock:
+            now = time.time()
+            self._expire_usage(now)
+            free_at, pending = await self._next_free_at()
+            if pending:
+                finish_at = now + (self._telemetry.pool_final or 1.0)
+                free_at = finish_at if free_at is None else min(free_at, finish_at)
+            return retry_after_seconds(free_at, now)
+
+    def _select(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """按策略选择 SSO（调用方持有锁）"""
+        if not self._sso_list:
+            self.load_sso_list()
+
+        if not self._sso_list:
+            return None
+
+        # 恢复使用记录已移出窗口的 key 的配额，冷却结束的熔断 key 转为半开
+        now = time.time()
+        self._expire_usage(now)
+        self._promote_half_open(now)
+
+        # 根据策略选择
+        if self.strategy == RotationStrategy.ROUND_ROBIN:
+            return self._get_round_robin(exclude)
+        elif self.strategy == RotationStrategy.LEAST_USED:
+            return self._get_least_used(exclude)
+        elif self.strategy == RotationStrategy.LEAST_RECENT:
+            return self._get_least_recent(exclude)
+        elif self.strategy == RotationStrategy.WEIGHTED:
+            return self._get_weighted(exclude)
+        elif self.strategy == RotationStrategy.LATENCY:
+            return self._get_latency(exclude)
+        else:  # HYBRID
+            return self._get_hybrid(exclude)
+
+    def _exclude_ids(self, exclude: Optional[Set[str]]) -> Optional[Set[int]]:
+        """将排除的 SSO 转换为索引 id"""
+        if not exclude:
+            return None
+        return {self._ids[sso] for sso in exclude if sso in self._ids}
+
+    def _get_round_robin(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """简单轮询（从上次选中位置之后的下一个可用 key 开始）"""
+        key_id = self._index.pick_round_robin(self._current_index, self._exclude_ids(exclude))
+        if key_id is None:
+            return self._handle_all_exhausted(exclude)
+
+        self._current_index = key_id + 1
+        return self._sso_list[key_id]
+
+    def _get_least_used(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """最少使用优先"""
+        key_id = self._index.pick_least_used(self._exclude_ids(exclude))
+        if key_id is None:
+            return self._handle_all_exhausted(exclude)
+        return self._sso_list[key_id]
 
-        return selected
+    def _get_least_recent(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """最久未用优先"""
+        key_id = self._index.pick_least_recent(self._exclude_ids(exclude))
+        if key_id is None:
+            return self._handle_all_exhausted(exclude)
+        return self._sso_list[key_id]
 
-    def _get_weighted(self) -> Optional[str]:
+    def _get_weighted(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
         """权重轮询（剩余配额作为权重）"""
-        import random
-
-        available = self._get_available_keys()
-        if not available:
-            return self._handle_all_exhausted()
+        key_id = self._index.pick_weighted(self._exclude_ids(exclude))
+        if key_id is None:
+            return self._handle_all_exhausted(exclude)
+        return self._sso_list[key_id]
 
-        weights = []
-        for sso in available:
-            usage = self._usage.get(sso, KeyUsage())
-            remaining = self.daily_limit - usage.count
-            weights.append(max(1, remaining))
-
-        total = sum(weights)
-        r_val = random.uniform(0, total)
-        cumulative = 0
-        for i, w in enumerate(weights):
-            cumulative += w
-            if r_val <= cumulative:
-                return available[i]
-
-        return available[-1]
-
-    def _get_hybrid(self) -> Optional[str]:
+    def _get_hybrid(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
         """混合策略：综合考虑剩余配额和最后使用时间"""
-        available = self._get_available_keys()
-        if not available:
-            return self._handle_all_exhausted()
-
-        now = time.time()
-        best_score = -1
-        selected = available[0]
-
-        for sso in available:
-            usage = self._usage.get(sso, KeyUsage())
-            remaining = self.daily_limit - usage.count
-
-            if usage.last_used == 0:
-                time_factor = 10
-            else:
-                minutes_ago = (now - usage.last_used) / 60
-                time_factor = min(10, minutes_ago * 0.1)
-
-            score = remaining * (1 + time_factor)
+        key_id = self._index.pick_hybrid(time.time(), self._exclude_ids(exclude))
+        if key_id is None:
+            return self._handle_all_exhausted(exclude)
+        return self._sso_list[key_id]
+
+    def _get_latency(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """延迟感知：按剩余配额加权抽样若干候选，选 剩余配额 * 预计成功率 / 预计耗时 最高的 key
+
+        抽样和剩余配额因子保证配额仍被分散使用，遥测决定同等配额下的优先级
+        """
+        candidates = self._index.sample_weighted(
+            settings.SSO_LATENCY_SAMPLES, self._exclude_ids(exclude)
+        )
+        if not candidates:
+            return self._handle_all_exhausted(exclude)
+        key_id = max(
+            candidates,
+            key=lambda i: self._index.remaining(i) * self._telemetry.score(i)
+        )
+        return self._sso_list[key_id]
 
-            if score > best_score:
-                best_score = score
-                selected = sso
+    def _handle_all_exhausted(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """处理所有 key 都用完的情况"""
+        if exclude:
+            # 排除后没有可用 key 不代表整个池已耗尽
+            return None
 
-        return selected
+        summary = self._store.summary(self.daily_limit)
+        if summary["available"]:
+            # 仍有配额，只是都达到了并发上限
+            logger.warning(f"[SSO] 所有可用 SSO 都已达到并发上限 ({self.max_inflight})")
+            return None
 
-    def _handle_all_exhausted(self) -> Optional[str]:
-        """处理所有 key 都用完的情况"""
         logger.warning("[SSO] 所有 SSO 都已耗尽或失败")
 
-        # 检查是否所有 key 都是因为失败
-        all_failed = all(
-            self._usage.get(sso, KeyUsage()).failed
-            for sso in self._sso_list
-        )
-
-        if all_failed:
-            # 重置失败状态
-            for sso in self._sso_list:
-                if sso in self._usage:
-                    self._usage[sso].failed = False
-            self._save_state()
-            logger.info("[SSO] 重置失败列表")
-            return self._sso_list[0] if self._sso_list else None
+        # 所有 key 都熔断且没有进行中的试探时，提前试探冷却最先结束的 key，避免服务完全中断
+        if summary["failed"] == len(self._sso_list) and not summary["half_open"]:
+            key_id = self._pop_open()
+            if key_id is not None and self._index.is_available(key_id):
+                logger.info(f"[SSO] 所有 SSO 都在熔断中，提前试探: {self._sso_list[key_id][:20]}...")
+                return self._sso_list[key_id]
 
         return None
 
     async def record_usage(self, sso: str):
         """记录使用"""
         async with self._lock:
-            if sso not in self._usage:
-                self._usage[sso] = KeyUsage()
-
-            self._usage[sso].count += 1
-            self._usage[sso].last_used = time.time()
-            self._save_state()
-            logger.debug(f"[SSO] 记录使用: {sso[:20]}... 今日次数: {self._usage[sso].count}")
-
-    async def mark_failed(self, sso: str, reason: str = ""):
-        """标记 SSO 为失败"""
+            key_id = self._ids.get(sso)
+            now = time.time()
+            if key_id is None:
+                # 不在池中的 key（如 API Key 专用 SSO）不参与轮询，只记录其配额
+                row = self._extra_row(key_hash(sso))
+                self._extra.add_use(row, now)
+                self._extra.refresh_count(row, now - self.quota_window)
+                self._journal.append("use", k=key_hash(sso), t=now)
+                return
+
+            self._store.add_use(key_id, now)
+            count = self._store.refresh_count(key_id, now - self.quota_window)
+            if count == 1:
+                # 窗口内第一次使用，登记其移出窗口的时间
+                heapq.heappush(self._usage_heap, (now + self.quota_window, key_id))
+            self._journal.append("use", k=key_hash(sso), t=now)
+            self._index.update(key_id)
+            logger.debug(f"[SSO] 记录使用: {sso[:20]}... 窗口内次数: {count}")
+
+    async def mark_failed(self, sso: str, reason: str = "", error_code: str = ""):
+        """记录一次失败，按失败分类决定是否熔断及冷却时间
+
+        Args:
+            reason: 失败原因（日志用）
+            error_code: 错误码，用于失败分类（见 classify_failure）
+        """
+        kind = classify_failure(error_code)
         async with self._lock:
-            if sso not in self._usage:
-                self._usage[sso] = KeyUsage()
-            self._usage[sso].failed = True
-            self._save_state()
-            logger.warning(f"[SSO] 标记失败: {sso[:20]}... 原因: {reason}")
+            store, key_id = self._store, self._ids.get(sso)
+            if key_id is None:
+                # 专用 SSO 同样按失败分类熔断，冷却结束由 filter_available 转为半开
+                store, key_id = self._extra, self._extra_row(key_hash(sso))
+
+            store.trips[key_id] += 1
+            store.fail_kind[key_id] = FAILURE_CODES[kind]
+            failures = store.trips[key_id]
+            if store.breaker[key_id] == BreakerState.HALF_OPEN:
+                # 试探失败立即重新熔断
+                cooldown = cooldown_seconds(kind, max(failures, failure_threshold(kind)))
+            else:
+                cooldown = cooldown_seconds(kind, failures)
+
+            open_until = 0.0
+            if cooldown:
+                open_until = time.time() + cooldown
+                store.breaker[key_id] = BreakerState.OPEN
+                store.open_until[key_id] = open_until
+                if store is self._store:
+                    heapq.heappush(self._open_heap, (open_until, key_id))
+            if store is self._store:
+                self._index.update(key_id)
+            self._journal.append(
+                "fail", k=key_hash(sso), r=kind.value, n=failures, u=open_until
+            )
+
+        if cooldown:
+            logger.warning(
+                f"[SSO] 熔断: {sso[:20]}... ({kind.value}, 连续失败 {failures} 次, "
+                f"冷却 {cooldown:.0f}s) 原因: {reason}"
+            )
+        else:
+            logger.warning(
+                f"[SSO] 请求失败: {sso[:20]}... ({kind.value}, 连续失败 {failures} 次) 原因: {reason}"
+            )
 
     async def mark_success(self, sso: str):
-        """标记 SSO 为成功（从失败列表移除）"""
+        """标记 SSO 为成功（关闭熔断器，清零连续失败次数）"""
         async with self._lock:
-            if sso in self._usage:
-                self._usage[sso].failed = False
-                self._save_state()
-
-    def get_status(self) -> dict:
-        """获取详细状态"""
-        keys_status = []
-        for sso in self._sso_list:
-            usage = self._usage.get(sso, KeyUsage())
-            keys_status.append({
-                "key_prefix": sso[:20] + "...",
-                "used_today": usage.count,
-                "remaining": max(0, self.daily_limit - usage.count),
-                "last_used": int(usage.last_used),
-                "failed": usage.failed
-            })
-
-        next_reset = int(self._last_reset + self.RESET_INTERVAL) if self._last_reset else 0
+            key_id = self._ids.get(sso)
+            if key_id is None:
+                row = self._extra_ids.get(key_hash(sso))
+                if row is not None and (self._extra.breaker[row] or self._extra.trips[row]):
+                    if self._extra.breaker[row]:
+                        logger.info(f"[SSO] 专用 SSO 熔断恢复: {sso[:20]}...")
+                    self._close_breaker(row, self._extra)
+                    self._journal.append("ok", k=key_hash(sso))
+            elif self._store.breaker[key_id] or self._store.trips[key_id]:
+                if self._store.breaker[key_id]:
+                    logger.info(f"[SSO] 熔断恢复: {sso[:20]}...")
+                self._close_breaker(key_id)
+                self._journal.append("ok", k=key_hash(sso))
+                self._index.update(key_id)
+                self._admission.notify()
+
+    async def filter_available(self, ssos: List[str]) -> List[str]:
+        """从给定的 SSO（如 API Key 专用 SSO）中筛选当前可用的：不在熔断冷却中且窗口内仍有配额
+
+        冷却已结束的专用 SSO 转为半开，下一次失败立即重新熔断
+        """
+        now = time.time()
+        window_start = now - self.quota_window
+        available = []
+        async with self._lock:
+            self._expire_usage(now)
+            for sso in ssos:
+                key_id = self._ids.get(sso)
+                if key_id is not None:
+                    # 池中的 key 的窗口内次数由窗口到期堆维护
+                    store, count = self._store, self._store.count[key_id]
+                else:
+                    store, key_id = self._extra, self._extra_ids.get(key_hash(sso))
+                    if key_id is None:
+                        available.append(sso)
+                        continue
+                    if store.breaker[key_id] == BreakerState.OPEN and store.open_until[key_id] <= now:
+                        store.breaker[key_id] = BreakerState.HALF_OPEN
+                    count = store.refresh_count(key_id, window_start)
+                if store.breaker[key_id] == BreakerState.OPEN and store.open_until[key_id] > now:
+                    continue
+                if count < self.daily_limit:
+                    available.append(sso)
+        return available
 
+    def record_telemetry(
+        self,
+        sso: str,
+        outcome: str,
+        first_preview: Optional[float] = None,
+        final: Optional[float] = None
+    ):
+        """上报一次生成的耗时与结果（见 sso_telemetry）"""
+        key_id = self._ids.get(sso)
+        if key_id is not None:
+            self._telemetry.record(key_id, outcome, first_preview, final)
+
+    def get_summary(self) -> dict:
+        """获取汇总状态（不含逐个 key 的明细，适合频繁调用）"""
+        self._expire_usage(time.time())
+        summary = self._store.summary(self.daily_limit)
+        # 没有可用配额时，最早恢复配额的时间
+        next_slot = 0
+        if not summary["available"] and self._usage_heap:
+            next_slot = int(self._usage_heap[0][0])
         return {
             "total_keys": len(self._sso_list),
-            "failed_count": sum(1 for u in self._usage.values() if u.failed),
+            "failed_count": summary["failed"],
+            "open_count": summary["open"],
+            "half_open_count": summary["half_open"],
+            "exhausted_count": summary["exhausted"],
+            "available_count": summary["available"],
+            "used_today": summary["used_today"],
+            "in_flight": self._index.inflight_total,
+            "max_inflight": self.max_inflight,
+            "dedicated_keys": len(self._extra_ids),
             "strategy": self.strategy.value,
             "daily_limit": self.daily_limit,
-            "next_reset_timestamp": next_reset,
-            "keys": keys_status
+            "quota_window": self.quota_window,
+            "next_slot_at": next_slot,
+            "telemetry": self._telemetry.get_stats(),
+            "admission": self._admission.get_stats(),
+            "watcher": self._watcher.get_stats(),
+            "lock": lock_stats([self._lock]),
+            "journal": self._journal.get_stats()
         }
 
+    def get_status(self) -> dict:
+        """获取详细状态（next_slot_at 为 key 下一次有可用配额的时间，0 表示当前可用）"""
+        summary = self.get_summary()
+        limit = self.daily_limit
+        window_start = time.time() - self.quota_window
+        keys_status = [
+            {
+                "key_prefix": sso[:20] + "...",
+                "used_today": count,
+                "remaining": max(0, limit - count),
+                "next_slot_at": int(
+                    self._store.next_slot_at(key_id, limit, window_start, self.quota_window)
+                ),
+                "last_used": int(last_used),
+                "failed": state != BreakerState.CLOSED,
+                "breaker": BreakerState.NAMES[state],
+                "open_until": int(open_until),
+                "consecutive_failures": trips,
+                "last_failure": FAILURE_KINDS[kind].value if kind else None,
+                "in_flight": self._index.inflight(key_id),
+                "telemetry": self._telemetry.get_key_stats(key_id)
+            }
+            for key_id, (sso, (count, last_used, _, state, trips, open_until, kind)) in enumerate(
+                zip(self._sso_list, self._store.rows())
+            )
+        ]
+
+        return {**summary, "keys": keys_status}
+
     async def reload(self) -> int:
-        """重新加载 SSO 列表"""
-        async with self._lock:
-            self._usage.clear()
-            self._current_index = 0
-            return self.load_sso_list()
+        """增量重新加载 SSO 列表：只应用新增和删除的 key，已有 key 的状态保持不变
+
+        文件在锁外读取，锁内只做内存中的替换
+        """
+        async with self._reload_lock:
+            sso_list = await asyncio.to_thread(self._read_sso_file)
+            if sso_list == self._sso_list:
+                return len(sso_list)
+            if not self._sso_list:
+                # 池原本为空（尚未加载），完整加载以恢复持久化状态
+                async with self._lock:
+                    count = self.load_sso_list()
+                self._admission.notify()
+                return count
+
+            # 在线程中构建新状态，期间请求照常使用旧状态，变化的 key 由旧索引记录
+            generation = self._generation
+            dirty = self._index.dirty = set()
+            try:
+                state = await asyncio.to_thread(self._build_state, sso_list)
+            finally:
+                self._index.dirty = None
+
+            async with self._lock:
+                if generation != self._generation:
+                    # 构建期间发生了全量重置或重新加载，按当前状态同步重建
+                    state, dirty = self._build_state(sso_list), ()
+                added, removed = self._install_state(state, dirty)
+        logger.info(f"[SSO] 重新加载: 新增 {added} 个，删除 {removed} 个，共 {len(sso_list)} 个 SSO")
+        self._admission.notify()
+        return len(sso_list)
 
     async def reset_daily_usage(self):
-        """手动重置每日使用量"""
+        """手动清空所有 key 的使用记录（并关闭熔断器）"""
         async with self._lock:
-            self._do_daily_reset()
-            logger.info("[SSO] 手动重置每日使用量完成")
+            self._store.reset_usage()
+            self._extra.reset_usage()
+            self._generation += 1
+            self._last_reset = time.time()
+            self._journal.append("reset", t=self._last_reset)
+            self._usage_heap = []
+            self._rebuild_index()
+            logger.info("[SSO] 手动重置使用量完成")
+        self._admission.notify()
 
 
 # 工厂函数
 def create_file_sso_manager(
     strategy: str = "hybrid",
-    daily_limit: int = 10
+    daily_limit: int = 10,
+    max_inflight: int = 0
 ) -> SSOManager:
     """创建文件版 SSO 管理器"""
-    return SSOManager(strategy=strategy, daily_limit=daily_limit)
+    return SSOManager(strategy=strategy, daily_limit=daily_limit, max_inflight=max_inflight)
 
 
 # 全局实例（使用配置）
 sso_manager = SSOManager(
     strategy=settings.SSO_ROTATION_STRATEGY,
-    daily_limit=settings.SSO_DAILY_LIMIT
+    daily_limit=settings.SSO_DAILY_LIMIT,
+    max_inflight=settings.SSO_MAX_INFLIGHT
 )
@@ -0,0 +1,116 @@
+"""SSO 实时遥测 - 每个 key 的延迟与健康度指数加权移动平均（EWMA）
+
+由 GrokImagineClient 在每次生成结束后上报：
+- first_preview: 首个预览帧耗时
+- final: 收齐所需最终图片的耗时
+- blocked / error: 本次结果是否被 blocked、是否出错（按 0/1 计入比率）
+
+与使用统计一样以 key 在列表中的位置为 id 按列存储；只保存在内存中，重启后重新积累。
+"""
+
+from array import array
+from typing import Optional, Dict, Any
+
+# 上报的结果
+OUTCOME_OK = "ok"
+OUTCOME_BLOCKED = "blocked"
+OUTCOME_ERROR = "error"
+
+
+class KeyTelemetry:
+    """按列存储的每个 key 的 EWMA 指标"""
+
+    EXPLORE_FACTOR = 0.8  # 没有样本的 key 按池平均耗时的该比例估计，保证新 key 会被试用
+
+    def __init__(self, alpha: float = 0.2, size: int = 0):
+        self.alpha = alpha
+        self.resize(size)
+
+    def resize(self, size: int):
+        """重新分配为 size 个 key（清空已有指标）"""
+        self.samples = array("i", bytes(4 * size))
+        self.first_preview = array("d", bytes(8 * size))  # 0 表示暂无样本
+        self.final = array("d", bytes(8 * size))
+        self.blocked_rate = array("d", bytes(8 * size))
+        self.error_rate = array("d", bytes(8 * size))
+        # 全池 EWMA，作为没有样本的 key 的先验
+        self.pool_first_preview = 0.0
+        self.pool_final = 0.0
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def copy_rows(self, other: "KeyTelemetry", mapping: Dict[int, int]):
+        """从另一组指标按 旧 id -> 新 id 复制（key 列表重新加载时保留已积累的指标）"""
+        for old_id, new_id in mapping.items():
+            self.samples[new_id] = other.samples[old_id]
+            self.first_preview[new_id] = other.first_preview[old_id]
+            self.final[new_id] = other.final[old_id]
+            self.blocked_rate[new_id] = other.blocked_rate[old_id]
+            self.error_rate[new_id] = other.error_rate[old_id]
+        self.pool_first_preview = other.pool_first_preview
+        self.pool_final = other.pool_final
+
+    def _ewma(self, old: float, value: float) -> float:
+        """指数加权移动平均（第一个样本直接作为初值）"""
+        return value if old == 0 else old + self.alpha * (value - old)
+
+    def record(
+        self,
+        key_id: int,
+        outcome: str,
+        first_preview: Optional[float] = None,
+        final: Optional[float] = None
+    ):
+        """记录一次生成结果"""
+        self.samples[key_id] += 1
+        if first_preview is not None:
+            self.first_preview[key_id] = self._ewma(self.first_preview[key_id], first_preview)
+            self.pool_first_preview = self._ewma(self.pool_first_preview, first_preview)
+        if final is not None:
+            self.final[key_id] = self._ewma(self.final[key_id], final)
+            self.pool_final = self._ewma(self.pool_final, final)
+
+        alpha = self.alpha
+        blocked = 1.0 if outcome == OUTCOME_BLOCKED else 0.0
+        error = 1.0 if outcome == OUTCOME_ERROR else 0.0
+        self.blocked_rate[key_id] += alpha * (blocked - self.blocked_rate[key_id])
+        self.error_rate[key_id] += alpha * (error - self.error_rate[key_id])
+
+    def expected_latency(self, key_id: int) -> float:
+        """预计完成耗时（秒）：有样本用自身 EWMA，否则用全池平均"""
+        latency = self.final[key_id]
+        if latency:
+            return latency
+        if self.pool_final:
+            factor = 1.0 if self.samples[key_id] else self.EXPLORE_FACTOR
+            return self.pool_final * factor
+        return 1.0
+
+    def health(self, key_id: int) -> float:
+        """预计成功率"""
+        return (1 - self.error_rate[key_id]) * (1 - self.blocked_rate[key_id])
+
+    def score(self, key_id: int) -> float:
+        """得分：单位时间内预计成功完成的请求数，越快越健康越高"""
+        return self.health(key_id) / self.expected_latency(key_id)
+
+    def get_key_stats(self, key_id: int) -> Optional[Dict[str, Any]]:
+        """单个 key 的指标（没有样本时返回 None）"""
+        if not self.samples[key_id]:
+            return None
+        return {
+            "samples": self.samples[key_id],
+            "first_preview_ewma": round(self.first_preview[key_id], 3),
+            "final_ewma": round(self.final[key_id], 3),
+            "blocked_rate": round(self.blocked_rate[key_id], 3),
+            "error_rate": round(self.error_rate[key_id], 3)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """全池指标"""
+        return {
+            "alpha": self.alpha,
+            "first_preview_ewma": round(self.pool_first_preview, 3),
+            "final_ewma": round(self.pool_final, 3)
+        }
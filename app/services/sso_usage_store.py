@@ -0,0 +1,357 @@
+"""SSO 使用统计存储 - 列式数组（struct-of-arrays）
+
+以 key 在列表中的位置作为整数 id，每个字段一列连续数组：
+- count: 滑动窗口内的使用次数 (int32，由 uses 计算的缓存)
+- uses: 每个 key 最近 slots 次使用的时间戳环形缓冲区 (float64，每个 key 占 slots 个位置)
+- last_used / first_used: 时间戳 (float64)
+- breaker: 熔断器状态 closed/open/half_open (int8)
+- trips: 连续失败次数 (int32)
+- open_until: 熔断冷却结束时间 (float64)
+- fail_kind: 最近一次失败的分类 (int8，0 表示无)
+
+相比每个 key 一个 dataclass 的字典，10 万个 key 只占几 MB；
+全池运算（剩余配额、统计）在安装 NumPy 时向量化执行，否则回退到纯 Python。
+快照为紧凑的二进制格式，同一 key 列表下直接整列载入。
+"""
+
+import hashlib
+import struct
+import sys
+from array import array
+from typing import Optional, List, Dict, Any, Iterable, Callable
+
+from app.services.sso_breaker import BreakerState
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+# 快照头: 魔数, 版本, 列表指纹, key 数, 上次重置时间, 轮询位置
+_HEADER = struct.Struct("<4sH16sIdq")
+_MAGIC = b"SSOU"
+_VERSION = 3  # 版本 1 只有 failed 列，载入时视为冷却已结束的熔断；版本 2 起有熔断列，版本 3 起有使用时间列
+_HASH_BYTES = 6  # 每个 key 的短哈希（12 位十六进制）
+
+
+def key_hash(sso: str) -> str:
+    """生成 key 的短哈希（日志和快照中用于标识 key，不保存明文）"""
+    return hashlib.md5(sso.encode()).hexdigest()[:12]
+
+
+def list_fingerprint(sso_list: List[str]) -> bytes:
+    """key 列表指纹，列表不变时快照可按位置直接载入"""
+    return hashlib.md5("\n".join(sso_list).encode()).digest()
+
+
+def pack_hashes(hash_values: Iterable[str]) -> bytes:
+    """将短哈希按顺序拼接为快照中的哈希列"""
+    return b"".join(bytes.fromhex(value) for value in hash_values)
+
+
+def snapshot_hashes(data: bytes) -> List[str]:
+    """读取快照中按 id 顺序的 key 短哈希"""
+    size = _HEADER.unpack_from(data, 0)[3]
+    hashes = data[_HEADER.size:_HEADER.size + size * _HASH_BYTES]
+    return [hashes[row * _HASH_BYTES:(row + 1) * _HASH_BYTES].hex() for row in range(size)]
+
+
+def _to_le(column: array) -> bytes:
+    """按小端序输出数组内容"""
+    if sys.byteorder == "little":
+        return column.tobytes()
+    swapped = array(column.typecode, column)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def _from_le(typecode: str, data: bytes) -> array:
+    """从小端序数据读取数组"""
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+class UsageStore:
+    """列式存储的 key 使用统计
+
+    每个 key 保留最近 slots 次（即配额上限）使用的时间戳，窗口内的使用次数在
+    最早一次使用移出窗口时减少，各 key 独立恢复配额
+    """
+
+    def __init__(self, size: int = 0, now: float = 0, slots: int = 10):
+        self.slots = max(1, slots)
+        self.resize(size, now)
+
+    def resize(self, size: int, now: float = 0):
+        """重新分配为 size 个 key 的初始状态"""
+        self.count = array("i", bytes(4 * size))
+        self.uses = array("d", bytes(8 * size * self.slots))
+        self.last_used = array("d", bytes(8 * size))
+        self.first_used = array("d", [now]) * size
+        self.breaker = array("b", bytes(size))
+        self.trips = array("i", bytes(4 * size))
+        self.open_until = array("d", bytes(8 * size))
+        self.fail_kind = array("b", bytes(size))
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def append(self, now: float = 0) -> int:
+        """追加一个 key 的初始状态，返回其 id"""
+        self.count.append(0)
+        self.uses.extend(array("d", bytes(8 * self.slots)))
+        self.last_used.append(0)
+        self.first_used.append(now)
+        self.breaker.append(0)
+        self.trips.append(0)
+        self.open_until.append(0)
+        self.fail_kind.append(0)
+        return len(self.count) - 1
+
+    def reset_usage(self):
+        """清零使用记录并关闭所有熔断器"""
+        size = len(self)
+        self.count = array("i", bytes(4 * size))
+        self.uses = array("d", bytes(8 * size * self.slots))
+        self.clear_failed()
+
+    def _key_uses(self, key_id: int) -> array:
+        """key 的使用时间戳（slots 个，0 表示空位）"""
+        base = key_id * self.slots
+        return self.uses[base:base + self.slots]
+
+    def add_use(self, key_id: int, timestamp: float):
+        """记录一次使用：覆盖最早的时间戳，O(slots)"""
+        key_uses = self._key_uses(key_id)
+        slot = min(range(self.slots), key=key_uses.__getitem__)
+        self.uses[key_id * self.slots + slot] = timestamp
+        self.last_used[key_id] = max(self.last_used[key_id], timestamp)
+
+    def refresh_count(self, key_id: int, window_start: float) -> int:
+        """按窗口起点重新计算 key 的使用次数，O(slots)"""
+        count = sum(1 for t in self._key_uses(key_id) if t > window_start)
+        self.count[key_id] = count
+        return count
+
+    def oldest_use(self, key_id: int, window_start: float) -> float:
+        """窗口内最早一次使用的时间戳（窗口内没有使用时为 0）"""
+        return min((t for t in self._key_uses(key_id) if t > window_start), default=0.0)
+
+    def next_slot_at(self, key_id: int, limit: int, window_start: float, window: float) -> float:
+        """key 下一次有可用配额的时间：未用满为窗口起点之后的任意时刻（返回 0），用满为最早一次使用移出窗口的时刻"""
+        if self.count[key_id] < limit:
+            return 0.0
+        return self.oldest_use(key_id, window_start) + window
+
+    def copy_rows(self, other: "UsageStore", mapping: Dict[int, int]):
+        """从另一个存储按 旧 id -> 新 id 复制（key 列表增量更新时保留已有 key 的状态）
+
+        新旧 id 连续的区段整段切片复制，增删少量 key 时接近 O(区段数)
+        """
+        runs = []  # [旧起点, 新起点, 长度]
+        for old_id, new_id in sorted(mapping.items()):
+            if runs and old_id == runs[-1][0] + runs[-1][2] and new_id == runs[-1][1] + runs[-1][2]:
+                runs[-1][2] += 1
+            else:
+                runs.append([old_id, new_id, 1])
+
+        for name in ("count", "last_used", "first_used", "breaker", "trips", "open_until", "fail_kind"):
+            src, dst = getattr(other, name), getattr(self, name)
+            for old_id, new_id, length in runs:
+                dst[new_id:new_id + length] = src[old_id:old_id + length]
+        slots = self.slots
+        for old_id, new_id, length in runs:
+            if other.slots == slots:
+                self.uses[new_id * slots:(new_id + length) * slots] = \
+                    other.uses[old_id * slots:(old_id + length) * slots]
+            else:
+                for offset in range(length):
+                    self._load_uses(new_id + offset, other.uses, old_id + offset, other.slots)
+
+    def clear_failed(self):
+        """关闭所有熔断器"""
+        size = len(self)
+        self.breaker = array("b", bytes(size))
+        self.trips = array("i", bytes(4 * size))
+        self.open_until = array("d", bytes(8 * size))
+        self.fail_kind = array("b", bytes(size))
+
+    def remaining(self, daily_limit: int) -> List[int]:
+        """每个 key 的剩余配额（熔断中的 key 为 0，半开的 key 按实际配额计）"""
+        if NUMPY_AVAILABLE and len(self):
+            count = np.frombuffer(self.count, dtype=np.int32)
+            breaker = np.frombuffer(self.breaker, dtype=np.int8)
+            remaining = np.clip(daily_limit - count, 0, None)
+            remaining[breaker == BreakerState.OPEN] = 0
+            return remaining.tolist()
+        return [
+            0 if state == BreakerState.OPEN else max(0, daily_limit - count)
+            for count, state in zip(self.count, self.breaker)
+        ]
+
+    def summary(self, daily_limit: int) -> Dict[str, int]:
+        """全池统计（failed 为熔断中和半开的 key 数）"""
+        if NUMPY_AVAILABLE and len(self):
+            count = np.frombuffer(self.count, dtype=np.int32)
+            breaker = np.frombuffer(self.breaker, dtype=np.int8)
+            failed = breaker != BreakerState.CLOSED
+            exhausted = count >= daily_limit
+            return {
+                "failed": int(failed.sum()),
+                "open": int((breaker == BreakerState.OPEN).sum()),
+                "half_open": int((breaker == BreakerState.HALF_OPEN).sum()),
+                "exhausted": int((exhausted & ~failed).sum()),
+                "available": int((~exhausted & ~failed).sum()),
+                "used_today": int(count.sum())
+            }
+        open_count = self.breaker.count(BreakerState.OPEN)
+        half_open = self.breaker.count(BreakerState.HALF_OPEN)
+        failed = open_count + half_open
+        available = sum(
+            1 for c, state in zip(self.count, self.breaker)
+            if state == BreakerState.CLOSED and c < daily_limit
+        )
+        return {
+            "failed": failed,
+            "open": open_count,
+            "half_open": half_open,
+            "exhausted": len(self) - failed - available,
+            "available": available,
+            "used_today": sum(self.count)
+        }
+
+    def to_bytes(
+        self,
+        hashes: bytes,
+        fingerprint: bytes,
+        last_reset: float,
+        current_index: int
+    ) -> bytes:
+        """序列化为二进制快照
+
+        Args:
+            hashes: 按 id 顺序拼接的 key 短哈希（见 pack_hashes）
+            fingerprint: key 列表指纹
+        """
+        return b"".join([
+            _HEADER.pack(_MAGIC, _VERSION, fingerprint, len(self), last_reset, current_index),
+            hashes,
+            _to_le(self.count),
+            _to_le(self.last_used),
+            _to_le(self.first_used),
+            self.breaker.tobytes(),
+            _to_le(self.trips),
+            _to_le(self.open_until),
+            self.fail_kind.tobytes(),
+            # 最后一列的每 key 位置数由剩余长度推出，配额上限变化后仍可载入
+            _to_le(self.uses)
+        ])
+
+    def load_bytes(
+        self,
+        data: bytes,
+        fingerprint: bytes,
+        ids_by_hash: Callable[[], Dict[str, int]]
+    ) -> Dict[str, Any]:
+        """从二进制快照恢复
+
+        key 列表未变化时整列载入；否则按短哈希逐个对应（已删除的 key 被忽略）
+
+        Args:
+            fingerprint: 当前 key 列表指纹
+            ids_by_hash: 返回 短哈希 -> id 映射的回调（仅列表变化时调用）
+
+        Returns:
+            快照头中的 last_reset 和 current_index
+        """
+        magic, version, snap_fingerprint, size, last_reset, current_index = \
+            _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or not 1 <= version <= _VERSION:
+            raise ValueError("未知的快照格式")
+
+        offset = _HEADER.size
+        hashes = data[offset:offset + size * _HASH_BYTES]
+        offset += size * _HASH_BYTES
+        layout = [("count", "i", 4), ("last_used", "d", 8), ("first_used", "d", 8), ("breaker", "b", 1)]
+        if version >= 2:
+            layout += [("trips", "i", 4), ("open_until", "d", 8), ("fail_kind", "b", 1)]
+        columns = {}
+        for name, typecode, width in layout:
+            columns[name] = _from_le(typecode, data[offset:offset + size * width])
+            offset += size * width
+        if version == 1:
+            # 旧版失败标记：熔断且冷却已结束，下次选择时即可试探
+            failed = columns["breaker"]
+            columns["breaker"] = array("b", (BreakerState.OPEN if f else 0 for f in failed))
+            columns["trips"] = array("i", (1 if f else 0 for f in failed))
+            columns["open_until"] = array("d", bytes(8 * size))
+            columns["fail_kind"] = array("b", bytes(size))
+        uses = None
+        snap_slots = 0
+        if version >= 3 and size:
+            uses = _from_le("d", data[offset:])
+            snap_slots = len(uses) // size
+
+        if snap_fingerprint == fingerprint and size == len(self):
+            for name in columns:
+                setattr(self, name, columns[name])
+            if snap_slots == self.slots:
+                self.uses = uses
+            else:
+                for key_id in range(size):
+                    self._load_uses(key_id, uses, key_id, snap_slots)
+        else:
+            ids = ids_by_hash()
+            for row in range(size):
+                key_id = ids.get(hashes[row * _HASH_BYTES:(row + 1) * _HASH_BYTES].hex())
+                if key_id is None:
+                    continue
+                for name, column in columns.items():
+                    getattr(self, name)[key_id] = column[row]
+                self._load_uses(key_id, uses, row, snap_slots)
+
+        return {"last_reset": last_reset, "current_index": current_index}
+
+    def _load_uses(self, key_id: int, uses: Optional[array], row: int, snap_slots: int):
+        """载入一个 key 的使用时间戳（保留最近的 slots 个）；旧版快照没有时间戳时按使用次数和最后使用时间估算"""
+        if uses is None:
+            self._seed_uses(key_id, self.count[key_id], self.last_used[key_id])
+            return
+        recent = sorted(uses[row * snap_slots:(row + 1) * snap_slots], reverse=True)[:self.slots]
+        base = key_id * self.slots
+        for slot, timestamp in enumerate(recent):
+            self.uses[base + slot] = timestamp
+
+    def _seed_uses(self, key_id: int, count: int, timestamp: float):
+        """只有使用次数时，按全部发生在最后使用时刻估算（保守：同时移出窗口）"""
+        base = key_id * self.slots
+        for slot in range(min(count, self.slots)):
+            self.uses[base + slot] = timestamp
+
+    def load_legacy(self, usage: Dict[str, Dict[str, Any]], ids_by_hash: Dict[str, int]):
+        """从旧版 JSON 快照的 usage 字段恢复"""
+        for hash_value, fields in usage.items():
+            key_id = ids_by_hash.get(hash_value)
+            if key_id is None:
+                continue
+            self.count[key_id] = int(fields.get("count", 0))
+            self.last_used[key_id] = float(fields.get("last_used", 0))
+            self.first_used[key_id] = float(fields.get("first_used", 0))
+            self._seed_uses(key_id, self.count[key_id], self.last_used[key_id])
+            if fields.get("failed"):
+                # 旧版失败标记：熔断且冷却已结束，下次选择时即可试探
+                self.breaker[key_id] = BreakerState.OPEN
+                self.trips[key_id] = 1
+
+    def rows(self) -> Iterable[tuple]:
+        """逐行输出 (count, last_used, first_used, breaker, trips, open_until, fail_kind)"""
+        return zip(
+            self.count, self.last_used, self.first_used,
+            self.breaker, self.trips, self.open_until, self.fail_kind
+        )
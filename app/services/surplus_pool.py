@@ -0,0 +1,123 @@
+"""多余图片池 - 保存 n < 4 时同一会话中多生成的图片，供相同请求直接复用"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Tuple, Dict, Any
+
+from app.core.config import settings
+from app.core.logger import logger
+
+
+# 池的键: (提示词, 宽高比, 是否启用 NSFW)
+SurplusKey = Tuple[str, str, bool]
+
+
+@dataclass
+class SurplusImage:
+    """池中的一张图片（已落盘）"""
+    filename: str
+    url: str
+    created_at: float
+
+
+class SurplusPool:
+    """按请求参数分组的多余图片池
+
+    - 每张图片在 ttl 秒后过期
+    - 总数超过 max_images 时淘汰最早放入的分组
+    """
+
+    def __init__(self, ttl: float = 600, max_images: int = 200):
+        self.ttl = ttl
+        self.max_images = max_images
+        self._pool: "OrderedDict[SurplusKey, List[SurplusImage]]" = OrderedDict()
+        self._size = 0
+        self._stats = {"stored": 0, "served": 0, "hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def make_key(prompt: str, aspect_ratio: str, enable_nsfw: bool) -> SurplusKey:
+        """生成池的键"""
+        return (prompt.strip(), aspect_ratio, enable_nsfw)
+
+    def _purge(self):
+        """移除过期图片"""
+        deadline = time.time() - self.ttl
+        for key in list(self._pool):
+            images = self._pool[key]
+            fresh = [img for img in images if img.created_at > deadline]
+            expired = len(images) - len(fresh)
+            if expired:
+                self._stats["expired"] += expired
+                self._size -= expired
+            if fresh:
+                self._pool[key] = fresh
+            else:
+                del self._pool[key]
+
+    def put(self, key: SurplusKey, images: List[SurplusImage]):
+        """放入多余图片"""
+        if not images:
+            return
+        self._purge()
+        self._pool.setdefault(key, []).extend(images)
+        self._pool.move_to_end(key)
+        self._size += len(images)
+        self._stats["stored"] += len(images)
+
+        # 超出容量时淘汰最早的分组
+        while self._size > self.max_images and self._pool:
+            _, evicted = self._pool.popitem(last=False)
+            self._size -= len(evicted)
+
+        logger.info(f"[Surplus] 存入 {len(images)} 张多余图片，池中共 {self._size} 张")
+
+    def take(self, key: SurplusKey, n: int) -> List[SurplusImage]:
+        """取出 n 张图片，不足 n 张时返回空列表（不取出）"""
+        self._purge()
+        images = self._pool.get(key, [])
+        if len(images) < n:
+            self._stats["misses"] += 1
+            return []
+
+        taken, rest = images[:n], images[n:]
+        if rest:
+            self._pool[key] = rest
+        else:
+            del self._pool[key]
+        self._size -= n
+        self._stats["hits"] += 1
+        self._stats["served"] += n
+        return taken
+
+    def give_back(self, key: SurplusKey, images: List[SurplusImage], lost: int = 0):
+        """归还 take() 取出但未能使用的图片（放回分组开头，本次取出不计为命中）
+
+        Args:
+            lost: 同一次取出中文件已丢失、不再放回的图片数
+        """
+        self._stats["hits"] -= 1
+        self._stats["misses"] += 1
+        self._stats["served"] -= len(images) + lost
+        if not images:
+            return
+        self._pool[key] = images + self._pool.get(key, [])
+        self._size += len(images)
+        self._purge()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取池统计"""
+        return {
+            "enabled": settings.SURPLUS_ENABLED,
+            "groups": len(self._pool),
+            "images": self._size,
+            "ttl": self.ttl,
+            **self._stats
+        }
+
+
+# 全局实例
+surplus_pool = SurplusPool(
+    ttl=settings.SURPLUS_TTL,
+    max_images=settings.SURPLUS_MAX_IMAGES
+)
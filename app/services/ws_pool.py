@@ -0,0 +1,358 @@
+"""Grok Imagine WebSocket 连接池 - 按 SSO 复用预热的长连接
+
+每条连接由独立的读取任务持续接收帧，并按请求分发：
+- 只有确认服务端帧会回带 requestId 后，连接才同时承载多个请求（多路复用），帧按 requestId 投递
+- 在此之前以及收到任何不带 requestId 的帧之后，连接只承载一个请求，帧全部投递给该请求
+- 不属于任何进行中请求的帧被丢弃（空闲时同样持续读取，保证心跳 pong 能被及时处理）
+
+连接池负责空闲回收、最长存活时间限制和健康检查。
+"""
+
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any, Callable, Awaitable
+
+import aiohttp
+
+from app.core.logger import logger
+
+
+# 建立新连接的回调: sso -> WebSocket
+ConnectFunc = Callable[[str], Awaitable[aiohttp.ClientWebSocketResponse]]
+
+# 用于从 URL 提取图片 ID
+_IMAGE_ID_PATTERN = re.compile(r'/images/([a-f0-9-]+)\.(png|jpg)')
+
+
+class ImagineStream:
+    """连接上的一个生成请求（按 requestId 区分）
+
+    queue 中依次收到属于该请求的 image/error 帧，None 表示连接已断开或帧无法归属
+    """
+
+    def __init__(self, conn: "PooledConnection", request_id: str):
+        self.conn = conn
+        self.request_id = request_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.image_ids: set = set()
+        self.opened_at = time.time()
+
+    async def send_json(self, data: Dict[str, Any]):
+        """在所属连接上发送消息"""
+        await self.conn.ws.send_json(data)
+
+
+class PooledConnection:
+    """池中的一条 WebSocket 连接，确认帧带 requestId 后可同时承载多个请求"""
+
+    RETIRED_IDS_LIMIT = 256  # 已结束请求的图片 ID 记录上限
+
+    def __init__(self, sso: str, ws: aiohttp.ClientWebSocketResponse, max_streams: int = 1):
+        self.sso = sso
+        self.ws = ws
+        self.max_streams = max(1, max_streams)
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.draining = False  # 不再接受新请求，最后一个请求结束后关闭
+        # 服务端帧是否回带 requestId：None 未知，True 已确认，False 收到过不带 requestId 的帧
+        self.tagged: Optional[bool] = None
+        self._streams: "OrderedDict[str, ImagineStream]" = OrderedDict()
+        self._retired_ids: "OrderedDict[str, None]" = OrderedDict()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    @property
+    def closed(self) -> bool:
+        """连接是否已关闭"""
+        return self.ws.closed or self._reader.done()
+
+    @property
+    def stream_count(self) -> int:
+        """进行中的请求数"""
+        return len(self._streams)
+
+    @property
+    def capacity(self) -> int:
+        """可同时承载的请求数：未确认帧带 requestId 时只承载一个"""
+        return self.max_streams if self.tagged else 1
+
+    def is_healthy(self, max_age: float) -> bool:
+        """健康检查：未关闭、未进入排空、未超过最长存活时间"""
+        if self.closed or self.draining:
+            return False
+        return time.time() - self.created_at < max_age
+
+    def open_stream(self, request_id: str) -> ImagineStream:
+        """在连接上开启一个请求"""
+        stream = ImagineStream(self, request_id)
+        self._streams[request_id] = stream
+        self.uses += 1
+        if self.closed:
+            stream.queue.put_nowait(None)
+        return stream
+
+    def close_stream(self, stream: ImagineStream):
+        """结束一个请求，其图片 ID 的迟到帧此后都会被丢弃"""
+        self._streams.pop(stream.request_id, None)
+        for image_id in stream.image_ids:
+            self._retired_ids[image_id] = None
+        while len(self._retired_ids) > self.RETIRED_IDS_LIMIT:
+            self._retired_ids.popitem(last=False)
+        self.last_used = time.time()
+
+    async def close(self):
+        """关闭连接"""
+        self._reader.cancel()
+        try:
+            await self._reader
+        except (asyncio.CancelledError, Exception):
+            pass
+        if not self.ws.closed:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+
+    def _route(self, msg: Dict[str, Any]) -> List[ImagineStream]:
+        """确定帧应投递到哪些请求"""
+        frame_request_id = msg.get("request_id") or msg.get("requestId")
+        if frame_request_id:
+            if self.tagged is None:
+                self.tagged = True
+            stream = self._streams.get(frame_request_id)
+            return [stream] if stream else []
+
+        if msg.get("type") not in ("image", "error"):
+            return []
+
+        # 帧不带 requestId：连接此后只承载一个请求
+        self.tagged = False
+        if len(self._streams) > 1:
+            # 多个请求进行中时无法判断归属，结束所有请求并排空连接，不按到达顺序猜测
+            logger.warning(
+                f"[WSPool] 收到不带 requestId 的帧，无法区分 {len(self._streams)} 个请求，排空连接"
+            )
+            self.draining = True
+            for stream in self._streams.values():
+                stream.queue.put_nowait(None)
+            return []
+
+        stream = next(iter(self._streams.values()))
+        if msg.get("type") == "image":
+            match = _IMAGE_ID_PATTERN.search(msg.get("url", ""))
+            if not match:
+                return []
+            image_id = match.group(1)
+            if image_id in self._retired_ids:
+                # 已结束请求的迟到帧
+                return []
+            stream.image_ids.add(image_id)
+        return [stream]
+
+    async def _read_loop(self):
+        """持续读取并分发帧"""
+        try:
+            while True:
+                ws_msg = await self.ws.receive()
+
+                if ws_msg.type == aiohttp.WSMsgType.TEXT:
+                    if not self._streams:
+                        continue
+                    try:
+                        msg = json.loads(ws_msg.data)
+                    except ValueError:
+                        continue
+                    for stream in self._route(msg):
+                        stream.queue.put_nowait(msg)
+
+                elif ws_msg.type in (
+                    aiohttp.WSMsgType.CLOSE,
+                    aiohttp.WSMsgType.CLOSING,
+                    aiohttp.WSMsgType.CLOSED,
+                    aiohttp.WSMsgType.ERROR
+                ):
+                    logger.debug(f"[WSPool] 连接关闭或错误: {ws_msg.type}")
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[WSPool] 读取异常: {e}")
+        finally:
+            for stream in self._streams.values():
+                stream.queue.put_nowait(None)
+
+
+class ImagineWSPool:
+    """按 SSO 分组的 WebSocket 连接池"""
+
+    REAP_INTERVAL = 10  # 回收检查间隔（秒）
+
+    def __init__(
+        self,
+        connect: ConnectFunc,
+        enabled: bool = True,
+        max_idle_per_sso: int = 2,
+        idle_timeout: float = 120,
+        max_age: float = 600,
+        max_streams_per_conn: int = 1
+    ):
+        self._connect = connect
+        self.enabled = enabled
+        self.max_idle_per_sso = max_idle_per_sso
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.max_streams_per_conn = max(1, max_streams_per_conn) if enabled else 1
+        self._conns: Dict[str, List[PooledConnection]] = {}
+        self._connecting: Dict[str, asyncio.Future] = {}
+        self._lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "multiplexed": 0,
+            "evicted_idle": 0,
+            "evicted_age": 0,
+            "evicted_unhealthy": 0
+        }
+
+    def _pick(self, sso: str) -> Optional[PooledConnection]:
+        """选择有空余容量的健康连接，优先已有请求最多的连接，尽量集中复用"""
+        candidates = [
+            c for c in self._conns.get(sso, [])
+            if c.stream_count < c.capacity and c.is_healthy(self.max_age)
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda c: c.stream_count)
+
+    async def open_stream(self, sso: str, request_id: str) -> ImagineStream:
+        """在该 SSO 的连接上开启请求：优先复用有空余容量的连接，否则新建
+
+        同一 SSO 正在建立连接时，并发请求等待该连接而不是各自新建
+        """
+        while True:
+            async with self._lock:
+                conn = self._pick(sso)
+                if conn:
+                    self._stats["multiplexed" if conn.stream_count else "reused"] += 1
+                    logger.debug(
+                        f"[WSPool] 复用连接: {sso[:20]}... "
+                        f"(进行中 {conn.stream_count}, 已用 {conn.uses} 次)"
+                    )
+                    return conn.open_stream(request_id)
+
+                connecting = self._connecting.get(sso)
+                if connecting is None:
+                    connecting = asyncio.get_running_loop().create_future()
+                    self._connecting[sso] = connecting
+                    break
+
+            await asyncio.shield(connecting)
+
+        try:
+            ws = await self._connect(sso)
+        finally:
+            async with self._lock:
+                self._connecting.pop(sso, None)
+            connecting.set_result(None)
+
+        conn = PooledConnection(sso, ws, max_streams=self.max_streams_per_conn)
+        async with self._lock:
+            self._conns.setdefault(sso, []).append(conn)
+            self._stats["created"] += 1
+            return conn.open_stream(request_id)
+
+    async def release(self, stream: ImagineStream, reusable: bool = True):
+        """结束请求：连接健康且未超出空闲上限时保留，否则在无其他请求后关闭"""
+        conn = stream.conn
+        async with self._lock:
+            conn.close_stream(stream)
+            if not (self.enabled and reusable):
+                conn.draining = True
+            if conn.stream_count:
+                return
+            conns = self._conns.get(conn.sso, [])
+            idle = [c for c in conns if c is not conn and not c.stream_count]
+            if conn.is_healthy(self.max_age) and len(idle) < self.max_idle_per_sso:
+                return
+            if conn in conns:
+                conns.remove(conn)
+            if not conns:
+                self._conns.pop(conn.sso, None)
+        await conn.close()
+
+    async def start(self):
+        """启动空闲回收任务"""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def close(self):
+        """关闭回收任务和所有连接"""
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+        async with self._lock:
+            conns = [conn for group in self._conns.values() for conn in group]
+            self._conns.clear()
+        for conn in conns:
+            await conn.close()
+
+    async def _reap_loop(self):
+        """定期回收空闲过久、超龄或已断开的连接"""
+        while True:
+            try:
+                await asyncio.sleep(self.REAP_INTERVAL)
+                await self._reap()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[WSPool] 回收异常: {e}")
+
+    async def _reap(self):
+        """执行一次回收（只回收没有进行中请求的连接）"""
+        now = time.time()
+        to_close = []
+        async with self._lock:
+            for sso, conns in self._conns.items():
+                keep = []
+                for conn in conns:
+                    if conn.stream_count:
+                        keep.append(conn)
+                    elif conn.closed or conn.draining:
+                        self._stats["evicted_unhealthy"] += 1
+                        to_close.append(conn)
+                    elif now - conn.created_at >= self.max_age:
+                        self._stats["evicted_age"] += 1
+                        to_close.append(conn)
+                    elif now - conn.last_used >= self.idle_timeout:
+                        self._stats["evicted_idle"] += 1
+                        to_close.append(conn)
+                    else:
+                        keep.append(conn)
+                self._conns[sso] = keep
+            self._conns = {sso: conns for sso, conns in self._conns.items() if conns}
+
+        for conn in to_close:
+            await conn.close()
+        if to_close:
+            logger.debug(f"[WSPool] 回收 {len(to_close)} 条连接")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池统计"""
+        conns = [conn for group in self._conns.values() for conn in group]
+        return {
+            "enabled": self.enabled,
+            "connections": len(conns),
+            "idle": sum(1 for conn in conns if not conn.stream_count),
+            "active_streams": sum(conn.stream_count for conn in conns),
+            "max_streams_per_conn": self.max_streams_per_conn,
+            "multiplexing_connections": sum(1 for conn in conns if conn.capacity > 1),
+            "sso_count": len(self._conns),
+            **self._stats
+        }
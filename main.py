@@ -18,6 +18,8 @@ from app.api.prompts import router as prompts_router
 from app.core.config import settings
 from app.core.logger import logger
 from app.services.sso_manager import sso_manager
+from app.services.grok_client import grok_client
+from app.services.image_store import image_store
 
 
 @asynccontextmanager
@@ -43,12 +45,20 @@ async def lifespan(app: FastAPI):
     logger.info(f"[SSO] 从文件加载: {settings.SSO_FILE}")
     count = sso_manager.load_sso_list()
     logger.info(f"[SSO] 已加载 {count} 个 SSO")
+    await sso_manager.start()
 
     # 确保图片目录存在
     settings.IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 
+    # 创建长连接会话（复用 DNS 缓存、TLS 和代理连接）
+    await grok_client.start()
+
     yield
 
+    await grok_client.close()
+    await sso_manager.close()
+    image_store.shutdown()
+
     logger.info("Grok Imagine API Gateway 已关闭")
 
 
@@ -118,11 +128,11 @@ async def api_info():
 @app.get("/health")
 async def health():
     """健康检查"""
-    sso_status = sso_manager.get_status()
+    sso_status = sso_manager.get_summary()
     return {
         "status": "healthy",
-        "sso_count": sso_status["total"],
-        "sso_failed": sso_status["failed"]
+        "sso_count": sso_status["total_keys"],
+        "sso_failed": sso_status["failed_count"]
     }
 
 
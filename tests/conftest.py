@@ -0,0 +1,50 @@
+"""测试公共配置"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到 Python 路径
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from app.core.config import settings  # noqa: E402
+
+
+@pytest.fixture
+def sso_file(tmp_path, monkeypatch):
+    """写入 SSO 文件并指向临时目录，返回写入函数（状态文件同样落在临时目录）"""
+    path = tmp_path / "key.txt"
+    monkeypatch.setattr(settings, "SSO_FILE", path)
+
+    def write(keys):
+        path.write_text("\n".join(keys) + "\n", encoding="utf-8")
+        return path
+
+    return write
+
+
+@pytest.fixture
+def redis_manager(sso_file):
+    """创建连接到 fakeredis 的 RedisSSOManager（需要 fakeredis 和 lupa 以执行 Lua 脚本）
+
+    返回 make(keys, **kwargs)；同一个测试中创建的管理器共享同一个 Redis 服务端（模拟多实例）。
+    管理器需在同一个事件循环中使用。
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    from app.services.redis_sso_manager import RedisSSOManager, RotationStrategy
+
+    server = fakeredis.FakeServer()
+
+    def make(keys=None, strategy="hybrid", daily_limit=10, max_inflight=0):
+        if keys is not None:
+            sso_file(keys)
+        manager = RedisSSOManager(
+            strategy=RotationStrategy(strategy), daily_limit=daily_limit, max_inflight=max_inflight
+        )
+        manager._redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        return manager
+
+    return make
@@ -0,0 +1,59 @@
+"""图片存储测试"""
+
+import asyncio
+import base64
+
+from app.services.image_store import ImageStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_decode_and_encode_round_trip(tmp_path):
+    store = ImageStore(tmp_path)
+    blob = base64.b64encode(b"image-bytes").decode()
+
+    async def scenario():
+        data = await store.decode(blob)
+        assert data == b"image-bytes"
+        assert await store.encode(data) == blob
+
+    run(scenario())
+    store.shutdown()
+
+
+def test_save_many_writes_every_file_without_temporaries(tmp_path):
+    store = ImageStore(tmp_path / "images", max_workers=2)
+
+    sizes = run(store.save_many([(b"a" * 10, "a.jpg"), (b"b" * 20, "b.jpg"), (b"c", "c.png")]))
+
+    assert sizes == [10, 20, 1]
+    assert sorted(p.name for p in (tmp_path / "images").iterdir()) == ["a.jpg", "b.jpg", "c.png"]
+    stats = store.get_stats()
+    assert stats["saved"] == 3
+    assert stats["bytes"] == 31
+    assert stats["batches"] == 1
+    store.shutdown()
+
+
+def test_failed_write_returns_none(tmp_path):
+    store = ImageStore(tmp_path)
+
+    sizes = run(store.save_many([(b"ok", "ok.jpg"), (b"bad", "missing-dir/bad.jpg")]))
+
+    assert sizes == [2, None]
+    assert store.get_stats()["failed"] == 1
+    store.shutdown()
+
+
+def test_load_returns_saved_data_or_none(tmp_path):
+    store = ImageStore(tmp_path)
+
+    async def scenario():
+        await store.save(b"data", "x.jpg")
+        assert await store.load("x.jpg") == b"data"
+        assert await store.load("gone.jpg") is None
+
+    run(scenario())
+    store.shutdown()
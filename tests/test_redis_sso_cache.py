@@ -0,0 +1,99 @@
+"""Redis SSO 进程内缓存测试（TTL、版本与 pub/sub 失效）"""
+
+import asyncio
+
+from app.services.redis_sso_cache import NearCache, MISSING
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_get_put_and_ttl(monkeypatch):
+    cache = NearCache(ttl=5, channel="sso:events")
+    now = [100.0]
+    monkeypatch.setattr("app.services.redis_sso_cache.time.monotonic", lambda: now[0])
+
+    assert cache.get("health") is MISSING
+    cache.put("health", {"a"}, cache.version())
+    assert cache.get("health") == {"a"}
+
+    now[0] += 6
+    assert cache.get("health") is MISSING
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_value_read_before_invalidation_is_not_cached():
+    cache = NearCache(ttl=5, channel="sso:events")
+    version = cache.version()
+    # 读取期间收到失效
+    cache.invalidate("health")
+    cache.put("health", {"stale"}, version)
+
+    assert cache.get("health") is MISSING
+
+
+def test_invalidate_one_or_all():
+    cache = NearCache(ttl=5, channel="sso:events")
+    cache.put("health", 1, cache.version())
+    cache.put("usage", 2, cache.version())
+
+    cache.invalidate("usage")
+    assert cache.get("health") == 1
+    assert cache.get("usage") is MISSING
+    cache.invalidate()
+    assert cache.get("health") is MISSING
+
+
+def test_zero_ttl_disables_caching():
+    cache = NearCache(ttl=0, channel="sso:events")
+    cache.put("health", 1, cache.version())
+
+    assert cache.get("health") is MISSING
+
+
+def test_other_instances_are_invalidated_over_pubsub(redis_manager):
+    first = redis_manager(["a", "b"], strategy="least_used")
+    second = redis_manager(strategy="least_used")
+
+    async def wait_subscribed(manager):
+        for _ in range(100):
+            if manager._cache.get_stats()["subscribed"]:
+                return
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        await first.initialize()
+        await second.initialize()
+        await second._cache.start(second._get_redis)
+        await wait_subscribed(second)
+
+        failed, _ = await second._get_health(second._redis)
+        assert failed == set()
+        await first.mark_failed("a", "expired", "unauthorized")
+        for _ in range(100):
+            if second._cache.get("health") is MISSING:
+                break
+            await asyncio.sleep(0.01)
+        failed, _ = await second._get_health(second._redis)
+        await second._cache.close()
+        return failed
+
+    assert run(scenario()) == {"a"}
+
+
+def test_success_on_healthy_key_skips_redis(redis_manager):
+    manager = redis_manager(["a"], strategy="least_used")
+
+    async def scenario():
+        await manager.initialize()
+        await manager._get_health(manager._redis)
+        invalidations = manager._cache.get_stats()["invalidations"]
+        await manager.mark_success("a")
+        return manager._cache.get_stats()["invalidations"] - invalidations
+
+    # 缓存显示 key 健康时不写 Redis、不广播失效
+    assert run(scenario()) == 0
+
@@ -0,0 +1,239 @@
+"""Redis 服务端脚本测试（选择、记录使用、提前试探），通过 fakeredis + lupa 执行 Lua"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import redis_sso_manager as redis_sso_manager_module
+
+STRATEGIES = ["round_robin", "least_used", "least_recent", "weighted", "hybrid", "latency"]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可控的管理器时钟"""
+    now = SimpleNamespace(value=1_000_000.0)
+    monkeypatch.setattr(redis_sso_manager_module, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+async def use(manager, exclude=None):
+    """占用一个 key、记录使用并归还"""
+    sso = await manager.acquire(exclude=exclude, wait=0)
+    if sso:
+        await manager.record_usage(sso)
+        manager.release(sso)
+        await asyncio.gather(*manager._release_tasks)
+    return sso
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_every_strategy_honours_the_quota(redis_manager, strategy):
+    manager = redis_manager(["a", "b", "c"], strategy=strategy, daily_limit=2)
+
+    async def scenario():
+        picked = [await use(manager) for _ in range(6)]
+        return picked, await use(manager)
+
+    picked, extra = run(scenario())
+    assert sorted(picked) == ["a", "a", "b", "b", "c", "c"]
+    assert extra is None
+
+
+def test_least_used_and_round_robin_order(redis_manager):
+    least_used = redis_manager(["a", "b", "c"], strategy="least_used")
+
+    async def scenario():
+        await least_used.record_usage("a")
+        await least_used.record_usage("b")
+        await least_used.record_usage("b")
+        first = await least_used.get_next_sso()
+
+        round_robin = redis_manager(strategy="round_robin")
+        order = [await use(round_robin) for _ in range(6)]
+        return first, order
+
+    first, order = run(scenario())
+    assert first == "c"
+    assert order[:3] == order[3:]
+    assert sorted(order[:3]) == ["a", "b", "c"]
+
+
+def test_exclude_and_inflight_cap(redis_manager):
+    manager = redis_manager(["a", "b"], strategy="least_used", max_inflight=1)
+
+    async def scenario():
+        assert await manager.acquire(exclude={"a"}, wait=0) == "b"
+        assert await manager.acquire(exclude={"a"}, wait=0) is None
+        assert await manager.acquire(wait=0) == "a"
+        manager.release("b")
+        await asyncio.gather(*manager._release_tasks)
+        return await manager.acquire(wait=0)
+
+    assert run(scenario()) == "b"
+
+
+def test_usage_script_moves_full_keys_to_exhausted(redis_manager, clock):
+    manager = redis_manager(["a", "b"], strategy="least_used", daily_limit=2)
+
+    async def scenario():
+        await manager.initialize()
+        r = manager._redis
+        h = manager._key_hash("a")
+        await manager.record_usage("a", at=clock.value - 100)
+        assert await r.zscore(manager.BY_COUNT_KEY, h) == 1
+        await manager.record_usage("a")
+        return (
+            await r.zscore(manager.BY_COUNT_KEY, h),
+            await r.zscore(manager.BY_RECENT_KEY, h),
+            await r.zscore(manager.EXHAUSTED_KEY, h),
+        )
+
+    by_count, by_recent, recover_at = run(scenario())
+    assert by_count is None and by_recent is None
+    # 最早一次使用移出窗口时恢复配额
+    assert recover_at == clock.value - 100 + manager.quota_window
+
+
+def test_exhausted_keys_return_when_uses_leave_the_window(redis_manager, clock):
+    manager = redis_manager(["a"], strategy="least_used", daily_limit=1)
+
+    async def scenario():
+        assert await use(manager) == "a"
+        assert await use(manager) is None
+        clock.value += manager.quota_window + 1
+        return await use(manager)
+
+    assert run(scenario()) == "a"
+
+
+def test_half_open_key_allows_a_single_probe(redis_manager, clock):
+    first = redis_manager(["a", "b"], strategy="least_used")
+    second = redis_manager(strategy="least_used")
+
+    async def scenario():
+        await first.mark_failed("a", "expired", "unauthorized")
+        clock.value += 1800 + 1
+        probes = await asyncio.gather(
+            first.acquire(exclude={"b"}, wait=0), second.acquire(exclude={"b"}, wait=0)
+        )
+        return probes
+
+    probes = run(scenario())
+    # 两个实例同时选择，只有一个拿到试探机会
+    assert sorted(probes, key=lambda p: p or "") == [None, "a"]
+
+
+def test_probe_script_picks_the_earliest_cooldown(redis_manager):
+    manager = redis_manager(["a", "b", "c"], strategy="least_used")
+
+    async def scenario():
+        await manager.initialize()
+        await manager.mark_failed("a", "expired", "unauthorized")
+        await manager.mark_failed("b", "limited", "rate_limit_exceeded")
+        # 还有健康的 key 时不提前试探
+        assert await manager._handle_all_exhausted(manager._redis) is None
+
+        await manager.mark_failed("c", "expired", "unauthorized")
+        probe = await manager.acquire(wait=0)
+        open_until = await manager._redis.hget(manager._usage_key("b"), "open_until")
+        # 试探进行中时不再提前试探其他 key
+        second = await manager.acquire(wait=0)
+        return probe, float(open_until), second
+
+    probe, open_until, second = run(scenario())
+    assert probe == "b"
+    assert open_until == 0
+    assert second is None
+
+
+async def index_state(manager, sso):
+    """key 所在的排序索引"""
+    r = manager._redis
+    h = manager._key_hash(sso)
+    names = {
+        "by_count": manager.BY_COUNT_KEY, "by_recent": manager.BY_RECENT_KEY,
+        "exhausted": manager.EXHAUSTED_KEY, "open": manager.OPEN_KEY
+    }
+    return {name for name, key in names.items() if await r.zscore(key, h) is not None}
+
+
+def test_tripped_keys_leave_the_indexes_until_half_open(redis_manager, clock):
+    manager = redis_manager(["a", "b"], strategy="least_used")
+
+    async def scenario():
+        await manager.initialize()
+        await manager.mark_failed("a", "expired", "unauthorized")
+        tripped = await index_state(manager, "a")
+        assert await manager.get_next_sso() == "b"
+
+        clock.value += 1800 + 1
+        await manager.get_next_sso()
+        return tripped, await index_state(manager, "a")
+
+    tripped, half_open = run(scenario())
+    assert tripped == {"open"}
+    assert half_open == {"by_count", "by_recent"}
+
+
+def test_success_during_cooldown_restores_the_indexes(redis_manager):
+    manager = redis_manager(["a", "b"], strategy="least_used", daily_limit=1)
+
+    async def scenario():
+        await manager.initialize()
+        await manager.record_usage("b")
+        await manager.mark_failed("a", "limited", "rate_limit_exceeded")
+        await manager.mark_failed("b", "limited", "rate_limit_exceeded")
+        await manager.mark_success("a")
+        await manager.mark_success("b")
+        return await index_state(manager, "a"), await index_state(manager, "b")
+
+    healed, healed_full = run(scenario())
+    assert healed == {"by_count", "by_recent"}
+    # 配额已用满的 key 恢复到 exhausted
+    assert healed_full == {"exhausted"}
+
+
+def test_rebuild_keeps_tripped_keys_out_of_the_indexes(redis_manager):
+    first = redis_manager(["a", "b"], strategy="least_used")
+
+    async def scenario():
+        await first.initialize()
+        await first.mark_failed("a", "expired", "unauthorized")
+        # 新实例启动时按使用统计重建索引
+        second = redis_manager(strategy="least_used")
+        await second.initialize()
+        return await index_state(second, "a"), await second.get_next_sso()
+
+    state, picked = run(scenario())
+    assert state == {"open"}
+    assert picked == "b"
+
+
+def test_reset_clears_usage_and_breakers(redis_manager):
+    manager = redis_manager(["a", "b"], strategy="least_used", daily_limit=1)
+
+    async def scenario():
+        await use(manager)
+        await manager.mark_failed("b", "expired", "unauthorized")
+        assert await use(manager) is None
+
+        await manager.reset_daily_usage()
+        r = manager._redis
+        generation = await r.get(manager.GENERATION_KEY)
+        states = [await index_state(manager, sso) for sso in ("a", "b")]
+        picked = sorted([await use(manager), await use(manager)])
+        status = await manager.get_status()
+        return generation, states, picked, status
+
+    generation, states, picked, status = run(scenario())
+    assert generation == "1"
+    assert states == [{"by_count", "by_recent"}] * 2
+    assert picked == ["a", "b"]
+    assert status["failed_count"] == 0
+    assert [key["used_today"] for key in status["keys"]] == [1, 1]
@@ -0,0 +1,162 @@
+"""SSO 准入队列测试（有限等待与 429 Retry-After）"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.sso_admission import AdmissionQueue, DEFAULT_RETRY_AFTER, retry_after_seconds
+from app.services.sso_manager import SSOManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Capacity:
+    """可控的容量：free 个可用 SSO，free_at 为预计恢复时间"""
+
+    def __init__(self, free=0, free_at=None, pending=False):
+        self.free = free
+        self.free_at = free_at
+        self.pending = pending
+        self.attempts = 0
+
+    async def try_acquire(self):
+        self.attempts += 1
+        if self.free:
+            self.free -= 1
+            return "sso"
+        return None
+
+    async def next_free_at(self):
+        return self.free_at, self.pending
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(None) == DEFAULT_RETRY_AFTER
+    assert retry_after_seconds(100.2, now=90.0) == 11
+    assert retry_after_seconds(80.0, now=90.0) == 1
+
+
+def test_immediate_and_rejected_without_wait():
+    queue = AdmissionQueue(max_wait=5)
+    capacity = Capacity(free=1)
+
+    assert run(queue.admit(capacity.try_acquire, capacity.next_free_at)) == "sso"
+    assert run(queue.admit(capacity.try_acquire, capacity.next_free_at, wait=0)) is None
+    stats = queue.get_stats()
+    assert stats["immediate"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_rejects_when_capacity_returns_after_the_wait_limit():
+    queue = AdmissionQueue(max_wait=1)
+    capacity = Capacity(free_at=10 ** 12)
+
+    assert run(queue.admit(capacity.try_acquire, capacity.next_free_at)) is None
+    assert queue.get_stats()["rejected"] == 1
+    assert queue.get_stats()["waiting"] == 0
+
+
+def test_waiter_is_admitted_on_notify():
+    queue = AdmissionQueue(max_wait=5)
+    capacity = Capacity(pending=True)
+
+    async def scenario():
+        task = asyncio.create_task(queue.admit(capacity.try_acquire, capacity.next_free_at))
+        await asyncio.sleep(0.01)
+        assert queue.get_stats()["waiting"] == 1
+        capacity.free = 1
+        queue.notify()
+        return await asyncio.wait_for(task, 1)
+
+    assert run(scenario()) == "sso"
+    assert queue.get_stats()["queued"] == 1
+
+
+def test_waiters_are_served_in_order_and_queue_is_bounded():
+    queue = AdmissionQueue(max_wait=5, max_queue=2)
+    capacity = Capacity(pending=True)
+
+    async def scenario():
+        first = asyncio.create_task(queue.admit(capacity.try_acquire, capacity.next_free_at))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(queue.admit(capacity.try_acquire, capacity.next_free_at))
+        await asyncio.sleep(0.01)
+        # 队列已满，直接拒绝
+        assert await queue.admit(capacity.try_acquire, capacity.next_free_at) is None
+
+        capacity.free = 1
+        queue.notify()
+        assert await asyncio.wait_for(first, 1) == "sso"
+        assert not second.done()
+        second.cancel()
+
+    run(scenario())
+    assert queue.get_stats()["waiting"] == 0
+
+
+def test_exhausted_pool_rejects_with_retry_after(sso_file, monkeypatch):
+    monkeypatch.setattr(settings, "SSO_ADMISSION_WAIT", 0)
+    sso_file(["key-a"])
+    manager = SSOManager(strategy="least_used", daily_limit=1)
+    manager.load_sso_list()
+
+    async def scenario():
+        sso = await manager.acquire()
+        await manager.record_usage(sso)
+        manager.release(sso)
+        assert await manager.acquire() is None
+        return await manager.retry_after()
+
+    retry_after = run(scenario())
+    assert settings.SSO_QUOTA_WINDOW - 5 <= retry_after <= settings.SSO_QUOTA_WINDOW
+
+
+def test_chat_returns_429_with_retry_after(monkeypatch):
+    from app.api import chat
+
+    async def translate(prompt, enhance=True):
+        return prompt
+
+    async def generate(**kwargs):
+        return {
+            "success": False,
+            "error_code": "no_available_sso",
+            "error": "没有可用的 SSO，请 42 秒后重试",
+            "retry_after": 42
+        }
+
+    monkeypatch.setattr(settings, "API_KEY", "")
+    monkeypatch.setattr(settings, "RELAY_ENABLED", False)
+    monkeypatch.setattr(chat, "get_translator", lambda: SimpleNamespace(translate=translate))
+    monkeypatch.setattr(chat.grok_client, "generate", generate)
+    request = chat.ChatCompletionRequest(
+        messages=[chat.ChatMessage(role="user", content="cat")], stream=False
+    )
+
+    with pytest.raises(HTTPException) as excinfo:
+        run(chat.chat_completions(request, authorization=None))
+
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers == {"Retry-After": "42"}
+
+
+def test_client_reports_no_available_sso(sso_file, monkeypatch):
+    from app.services import grok_client as grok_client_module
+
+    monkeypatch.setattr(settings, "SSO_ADMISSION_WAIT", 0)
+    sso_file(["key-a"])
+    manager = SSOManager(strategy="least_used", daily_limit=1)
+    manager.load_sso_list()
+    run(manager.record_usage("key-a"))
+    monkeypatch.setattr(grok_client_module, "sso_manager", manager)
+
+    result = run(grok_client_module.grok_client.generate("cat", n=4, hedge=False))
+
+    assert result["success"] is False
+    assert result["error_code"] == "no_available_sso"
+    assert result["retry_after"] >= 1
@@ -0,0 +1,99 @@
+"""SSO 熔断器测试（失败分类、冷却时间与状态转换）"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.services import sso_manager as sso_manager_module
+from app.services.sso_breaker import (
+    BreakerState, FailureKind, classify_failure, cooldown_seconds
+)
+from app.services.sso_manager import SSOManager
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可控的管理器时钟"""
+    now = SimpleNamespace(value=1_000_000.0)
+    monkeypatch.setattr(sso_manager_module, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def manager(sso_file, clock):
+    sso_file(["key-a", "key-b"])
+    manager = SSOManager(strategy="least_used", daily_limit=10)
+    manager.load_sso_list()
+    return manager
+
+
+def state(manager, sso):
+    return manager._store.breaker[manager._ids[sso]]
+
+
+def test_classify_failure():
+    assert classify_failure("unauthorized") == FailureKind.AUTH
+    assert classify_failure("rate_limit_exceeded") == FailureKind.RATE_LIMIT
+    assert classify_failure("blocked") == FailureKind.BLOCKED
+    assert classify_failure("") == FailureKind.NETWORK
+
+
+def test_cooldown_doubles_and_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "SSO_BREAKER_NETWORK_THRESHOLD", 3)
+    base = settings.SSO_BREAKER_COOLDOWN_NETWORK
+
+    assert cooldown_seconds(FailureKind.NETWORK, 2) == 0
+    assert cooldown_seconds(FailureKind.NETWORK, 3) == base
+    assert cooldown_seconds(FailureKind.NETWORK, 4) == base * 2
+    assert cooldown_seconds(FailureKind.AUTH, 100) == settings.SSO_BREAKER_MAX_COOLDOWN
+
+
+def test_network_errors_trip_only_at_threshold(manager, monkeypatch):
+    monkeypatch.setattr(settings, "SSO_BREAKER_NETWORK_THRESHOLD", 2)
+
+    asyncio.run(manager.mark_failed("key-a", "timeout"))
+    assert state(manager, "key-a") == BreakerState.CLOSED
+
+    asyncio.run(manager.mark_failed("key-a", "timeout"))
+    assert state(manager, "key-a") == BreakerState.OPEN
+
+
+def test_open_half_open_and_recovery(manager, clock):
+    asyncio.run(manager.mark_failed("key-a", "expired", "unauthorized"))
+    assert state(manager, "key-a") == BreakerState.OPEN
+    assert asyncio.run(manager.get_next_sso()) == "key-b"
+
+    # 冷却结束后转为半开，只允许一个试探请求
+    clock.value += settings.SSO_BREAKER_COOLDOWN_AUTH + 1
+    assert asyncio.run(manager.acquire(exclude={"key-b"}, wait=0)) == "key-a"
+    assert state(manager, "key-a") == BreakerState.HALF_OPEN
+    assert asyncio.run(manager.acquire(exclude={"key-b"}, wait=0)) is None
+
+    asyncio.run(manager.mark_success("key-a"))
+    manager.release("key-a")
+    assert state(manager, "key-a") == BreakerState.CLOSED
+    assert manager._store.trips[manager._ids["key-a"]] == 0
+
+
+def test_failed_probe_reopens_with_longer_cooldown(manager, clock):
+    asyncio.run(manager.mark_failed("key-a", "limited", "rate_limit_exceeded"))
+    clock.value += settings.SSO_BREAKER_COOLDOWN_RATE_LIMIT + 1
+    asyncio.run(manager.get_next_sso(exclude={"key-b"}))
+    assert state(manager, "key-a") == BreakerState.HALF_OPEN
+
+    asyncio.run(manager.mark_failed("key-a", "limited", "rate_limit_exceeded"))
+
+    key_id = manager._ids["key-a"]
+    assert state(manager, "key-a") == BreakerState.OPEN
+    assert manager._store.open_until[key_id] - clock.value == settings.SSO_BREAKER_COOLDOWN_RATE_LIMIT * 2
+
+
+def test_early_probe_when_every_key_is_open(manager):
+    asyncio.run(manager.mark_failed("key-a", "expired", "unauthorized"))
+    asyncio.run(manager.mark_failed("key-b", "limited", "rate_limit_exceeded"))
+
+    # 全部熔断时提前试探冷却最先结束的 key
+    assert asyncio.run(manager.get_next_sso()) == "key-b"
+    assert state(manager, "key-b") == BreakerState.HALF_OPEN
@@ -0,0 +1,145 @@
+"""Redis 降级保护测试（熔断、本地记账与恢复后对账）"""
+
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.sso_failover import FailoverSSOManager, RedisCircuit
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_circuit_opens_at_threshold_and_probes_once_per_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.sso_failover.time.time", lambda: now[0])
+    circuit = RedisCircuit(failure_threshold=2, retry_interval=10)
+
+    circuit.record_failure(TimeoutError())
+    assert not circuit.is_open
+    circuit.record_failure(TimeoutError())
+    assert circuit.is_open
+    assert not circuit.allow()
+
+    now[0] += 10
+    assert circuit.allow()
+    assert not circuit.allow()
+    assert circuit.record_success()
+    assert circuit.allow()
+    assert circuit.get_stats()["recoveries"] == 1
+
+
+def test_failures_outside_the_window_do_not_trip(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.sso_failover.time.time", lambda: now[0])
+    circuit = RedisCircuit(failure_threshold=2, retry_interval=10)
+
+    circuit.record_failure(TimeoutError())
+    now[0] += 11
+    circuit.record_failure(TimeoutError())
+
+    assert not circuit.is_open
+
+
+@pytest.fixture
+def failover(redis_manager, monkeypatch):
+    """返回 (降级管理器, 切换 Redis 可用状态的函数)"""
+    monkeypatch.setattr(settings, "REDIS_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(settings, "REDIS_RETRY_INTERVAL", 0)
+    primary = redis_manager(["a", "b"], strategy="least_used", daily_limit=4)
+    server = primary._redis.connection_pool.connection_kwargs["server"]
+
+    def set_redis(available):
+        # fakeredis 服务端断开时每次调用抛出 ConnectionError
+        server.connected = available
+
+    return FailoverSSOManager(primary, fallback_ratio=0.5), set_redis
+
+
+def test_outage_falls_back_to_local_accounting(failover):
+    manager, set_redis = failover
+
+    async def scenario():
+        await manager.primary.initialize()
+        set_redis(False)
+        picked = []
+        for _ in range(5):
+            sso = await manager.acquire(wait=0)
+            if sso:
+                await manager.record_usage(sso)
+                manager.release(sso)
+            picked.append(sso)
+        return picked, await manager.get_status()
+
+    picked, status = run(scenario())
+    # 本地配额按比例缩小为 2
+    assert sorted(picked[:4]) == ["a", "a", "b", "b"]
+    assert picked[4] is None
+    assert status["redis"]["state"] == "open"
+    assert status["redis"]["pending_uses"] == 4
+    assert status["redis"]["fallback_daily_limit"] == 2
+
+
+def test_recovery_reconciles_uses_into_redis(failover):
+    manager, set_redis = failover
+
+    async def scenario():
+        await manager.primary.initialize()
+        set_redis(False)
+        await manager.record_usage("a")
+        await manager.record_usage("a")
+        await manager.record_usage("b")
+
+        set_redis(True)
+        await manager.get_next_sso()
+        await manager._reconcile_task
+        status = await manager.get_status()
+        await manager.close()
+        return status
+
+    status = run(scenario())
+    used = {key["key_prefix"][:1]: key["used_today"] for key in status["keys"]}
+    assert used == {"a": 2, "b": 1}
+    assert status["redis"]["state"] == "closed"
+    assert status["redis"]["pending_uses"] == 0
+    assert status["redis"]["reconciled_uses"] == 3
+
+
+def test_leases_are_released_to_the_issuing_manager(failover):
+    manager, set_redis = failover
+
+    async def scenario():
+        await manager.primary.initialize()
+        set_redis(False)
+        local = await manager.acquire(wait=0)
+        set_redis(True)
+        remote = await manager.acquire(exclude={local}, wait=0)
+        assert manager.fallback._index.inflight_total == 1
+        assert sum(manager.primary._inflight.values()) == 1
+
+        manager.release(local)
+        manager.release(remote)
+        await asyncio.gather(*manager.primary._release_tasks)
+        return manager.fallback._index.inflight_total, manager.primary._inflight
+
+    fallback_inflight, primary_inflight = run(scenario())
+    assert fallback_inflight == 0
+    assert primary_inflight == {}
+
+
+def test_failed_reconciliation_keeps_pending_uses(failover):
+    manager, set_redis = failover
+
+    async def scenario():
+        await manager.primary.initialize()
+        set_redis(False)
+        await manager.record_usage("a")
+        manager._circuit.record_success()
+        await manager._reconcile()
+        return len(manager._pending_uses), manager._circuit.is_open
+
+    pending, is_open = run(scenario())
+    assert pending == 1
+    assert is_open
@@ -0,0 +1,79 @@
+"""SSO 文件监视与增量重新加载测试"""
+
+import asyncio
+
+from app.services.sso_file_watcher import SSOFileWatcher
+from app.services.sso_manager import SSOManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_watcher_calls_back_on_change(tmp_path):
+    path = tmp_path / "key.txt"
+    path.write_text("a\n", encoding="utf-8")
+    changes = []
+
+    async def on_change():
+        changes.append(path.read_text(encoding="utf-8"))
+
+    async def scenario():
+        watcher = SSOFileWatcher(path, 0.01, on_change)
+        await watcher.start()
+        await asyncio.sleep(0.05)
+        assert changes == []
+        path.write_text("a\nb\n", encoding="utf-8")
+        await asyncio.sleep(0.05)
+        path.unlink()
+        await asyncio.sleep(0.05)
+        stats = watcher.get_stats()
+        await watcher.close()
+        return stats
+
+    stats = run(scenario())
+    assert changes == ["a\nb\n"]
+    assert stats["enabled"] is True
+    assert stats["reloads"] == 1
+    # 文件被删除也视为变化，回调失败只计数，监视继续
+    assert stats["errors"] == 1
+
+
+def test_watcher_disabled_with_zero_interval(tmp_path):
+    async def on_change():
+        pass
+
+    async def scenario():
+        watcher = SSOFileWatcher(tmp_path / "key.txt", 0, on_change)
+        await watcher.start()
+        return watcher.get_stats()
+
+    assert run(scenario())["enabled"] is False
+
+
+def test_reload_keeps_state_of_existing_keys(sso_file):
+    write = sso_file
+    write(["key-a", "key-b", "key-c"])
+    manager = SSOManager(strategy="least_used", daily_limit=5)
+    manager.load_sso_list()
+
+    async def scenario():
+        await manager.record_usage("key-b")
+        await manager.mark_failed("key-c", "expired", "unauthorized")
+        leased = await manager.acquire(exclude={"key-a", "key-c"})
+        assert leased == "key-b"
+
+        write(["key-b", "key-c", "key-d"])
+        assert await manager.reload() == 3
+
+    run(scenario())
+    ids = manager._ids
+    assert list(ids) == ["key-b", "key-c", "key-d"]
+    assert manager._store.count[ids["key-b"]] == 1
+    assert manager._store.trips[ids["key-c"]] == 1
+    assert manager._index.inflight(ids["key-b"]) == 1
+    assert manager._store.count[ids["key-d"]] == 0
+    # 删除的 key 不再被选中，新增的 key 立即可用
+    assert run(manager.get_next_sso()) == "key-d"
+    manager.release("key-b")
+    assert manager._index.inflight_total == 0
@@ -0,0 +1,114 @@
+"""SSO 选择索引测试（树状数组与惰性删除堆）"""
+
+import random
+
+from app.services.sso_breaker import BreakerState
+from app.services.sso_index import FenwickTree, SSOIndex
+from app.services.sso_usage_store import UsageStore
+
+
+def make_index(counts, daily_limit=5, max_inflight=0):
+    store = UsageStore(len(counts), slots=daily_limit)
+    for key_id, count in enumerate(counts):
+        store.count[key_id] = count
+    index = SSOIndex(daily_limit, max_inflight)
+    index.rebuild(store)
+    return index, store
+
+
+def test_fenwick_matches_prefix_sums():
+    rng = random.Random(7)
+    values = [rng.randrange(5) for _ in range(37)]
+    tree = FenwickTree.from_values(values)
+    for _ in range(50):
+        i = rng.randrange(len(values))
+        delta = rng.randrange(-values[i], 4)
+        values[i] += delta
+        tree.add(i, delta)
+
+    for i in range(len(values) + 1):
+        assert tree.prefix(i) == sum(values[:i])
+    for target in range(tree.total):
+        pos = tree.find(target)
+        assert sum(values[:pos]) <= target < sum(values[:pos + 1])
+
+
+def test_exhausted_and_open_keys_are_unavailable():
+    index, store = make_index([5, 0, 2])
+    store.breaker[1] = BreakerState.OPEN
+    index.update(1)
+
+    assert index.available_count == 1
+    assert index.remaining(0) == 0
+    assert index.remaining(2) == 3
+    assert index.pick_least_used() == 2
+    assert index.pick_weighted() == 2
+
+
+def test_round_robin_wraps_and_skips_unavailable():
+    index, _ = make_index([0, 5, 0, 5])
+
+    assert index.pick_round_robin(1) == 2
+    assert index.pick_round_robin(3) == 0
+    assert index.pick_round_robin(0, exclude={0}) == 2
+
+
+def test_least_used_follows_updates():
+    index, store = make_index([3, 1, 2])
+    assert index.pick_least_used() == 1
+
+    store.count[1] = 4
+    index.update(1)
+
+    assert index.pick_least_used() == 2
+    assert index.pick_least_used(exclude={2}) == 0
+
+
+def test_least_recent_and_hybrid():
+    index, store = make_index([0, 0, 0])
+    store.last_used[0] = 300.0
+    store.last_used[1] = 100.0
+    store.last_used[2] = 200.0
+    for key_id in range(3):
+        index.update(key_id)
+
+    assert index.pick_least_recent() == 1
+    assert index.pick_least_recent(exclude={1}) == 2
+
+    store.count[1] = 4
+    index.update(1)
+    assert index.pick_hybrid(now=400.0) == 2
+
+
+def test_leases_count_towards_usage_and_concurrency():
+    index, _ = make_index([0, 1], max_inflight=1)
+    assert index.pick_least_used() == 0
+
+    index.lease(0, now=10.0)
+    assert index.inflight_total == 1
+    assert not index.is_available(0)
+    assert index.pick_least_used() == 1
+
+    index.unlease(0)
+    assert index.is_available(0)
+    assert index.remaining(0) == 5
+
+
+def test_half_open_allows_one_probe():
+    index, store = make_index([0])
+    store.breaker[0] = BreakerState.HALF_OPEN
+    index.update(0)
+    assert index.is_available(0)
+
+    index.lease(0, now=1.0)
+    assert not index.is_available(0)
+
+
+def test_sample_weighted_returns_distinct_available_keys():
+    index, _ = make_index([0, 5, 3, 0])
+
+    sample = index.sample_weighted(20)
+
+    assert len(sample) == len(set(sample))
+    assert set(sample) <= {0, 2, 3}
+    assert index.sample_weighted(5, exclude={0, 2, 3}) == []
@@ -0,0 +1,123 @@
+"""SSO 状态日志测试（追加写、重放、压缩）"""
+
+import asyncio
+
+from app.services.sso_journal import SSOJournal
+from app.services.sso_manager import SSOManager
+
+
+def make_journal(tmp_path, **kwargs):
+    return SSOJournal(tmp_path / "sso_state.bin", **kwargs)
+
+
+def test_append_and_replay(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.append("use", k="a", t=1.0)
+    journal.append("fail", k="b", r="auth", n=1, u=0)
+
+    snapshot, records = make_journal(tmp_path).load()
+
+    assert snapshot is None
+    assert [(r["op"], r["s"]) for r in records] == [("use", 1), ("fail", 2)]
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.append("use", k="a", t=1.0)
+    with open(journal.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"op": "use", "s": 2, "k"')
+
+    reloaded = make_journal(tmp_path)
+    _, records = reloaded.load()
+
+    assert [r["s"] for r in records] == [1]
+    assert reloaded.seq == 1
+
+
+def test_compaction_writes_snapshot_and_clears_journal(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.bind(lambda: b"state")
+    journal.append("use", k="a", t=1.0)
+    journal.append("use", k="a", t=2.0)
+
+    journal.compact_sync()
+
+    assert journal.journal_file.read_text(encoding="utf-8") == ""
+    reloaded = make_journal(tmp_path)
+    snapshot, records = reloaded.load()
+    assert snapshot == b"state"
+    assert records == []
+    assert reloaded.seq == 2
+    assert journal.get_stats()["compactions"] == 1
+
+
+def test_records_covered_by_snapshot_are_skipped(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.bind(lambda: b"state")
+    journal.append("use", k="a", t=1.0)
+    journal.compact_sync()
+    journal.append("use", k="a", t=2.0)
+    # 模拟快照替换后、清空日志前崩溃：日志中残留快照已包含的记录
+    lines = journal.journal_file.read_text(encoding="utf-8")
+    journal.journal_file.write_text('{"op": "use", "s": 1, "k": "a", "t": 1.0}\n' + lines, encoding="utf-8")
+
+    _, records = make_journal(tmp_path).load()
+
+    assert [r["s"] for r in records] == [2]
+
+
+def test_background_flush_and_close_compacts(tmp_path):
+    journal = make_journal(tmp_path, flush_interval=0.01)
+    journal.bind(lambda: b"state")
+
+    async def scenario():
+        await journal.start()
+        journal.append("use", k="a", t=1.0)
+        assert journal.get_stats()["buffered"] == 1
+        await asyncio.sleep(0.05)
+        assert journal.get_stats()["buffered"] == 0
+        assert journal.journal_file.read_text(encoding="utf-8").count("\n") == 1
+        await journal.close()
+
+    asyncio.run(scenario())
+    snapshot, records = make_journal(tmp_path).load()
+    assert snapshot == b"state"
+    assert records == []
+
+
+def test_disabled_journal_touches_no_files(tmp_path):
+    journal = make_journal(tmp_path, enabled=False)
+    journal.bind(lambda: b"state")
+    journal.append("use", k="a", t=1.0)
+    journal.compact_sync()
+
+    assert list(tmp_path.iterdir()) == []
+    assert journal.seq == 1
+
+
+def test_manager_state_survives_replay_and_snapshot(sso_file):
+    sso_file(["key-a", "key-b"])
+    manager = SSOManager(strategy="least_used", daily_limit=5)
+    manager.load_sso_list()
+
+    async def record():
+        await manager.record_usage("key-a")
+        await manager.record_usage("key-a")
+        await manager.record_usage("dedicated")
+        await manager.mark_failed("key-b", "expired", "unauthorized")
+
+    asyncio.run(record())
+
+    replayed = SSOManager(strategy="least_used", daily_limit=5)
+    replayed.load_sso_list()
+    assert replayed._store.count[replayed._ids["key-a"]] == 2
+    assert replayed._store.trips[replayed._ids["key-b"]] == 1
+    assert replayed.get_summary()["dedicated_keys"] == 1
+
+    replayed._journal.compact_sync()
+    restored = SSOManager(strategy="least_used", daily_limit=5)
+    restored.load_sso_list()
+    assert restored._store.count[restored._ids["key-a"]] == 2
+    assert restored._store.trips[restored._ids["key-b"]] == 1
+    assert asyncio.run(restored.filter_available(["dedicated"])) == ["dedicated"]
+    assert restored.get_summary()["dedicated_keys"] == 1
@@ -0,0 +1,69 @@
+"""锁等待统计与 Redis 分片选择测试"""
+
+import asyncio
+
+from app.core.config import settings
+from app.services.sso_lock import TimedLock, lock_stats
+
+
+def test_timed_lock_records_contention():
+    lock = TimedLock()
+
+    async def hold():
+        async with lock:
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        await asyncio.gather(hold(), hold())
+
+    asyncio.run(scenario())
+    stats = lock_stats([lock, TimedLock()])
+    assert stats["locks"] == 2
+    assert stats["acquisitions"] == 2
+    assert stats["contended"] == 1
+    assert stats["wait_max_ms"] >= 10
+    assert not lock.locked()
+
+
+def test_lock_stats_without_contention():
+    assert lock_stats([TimedLock()])["wait_avg_ms"] == 0
+
+
+def test_latency_strategy_walks_shards(redis_manager, monkeypatch):
+    monkeypatch.setattr(settings, "SSO_LOCK_SHARDS", 2)
+    manager = redis_manager(["a", "b", "c", "d"], strategy="latency", daily_limit=1)
+
+    async def scenario():
+        await manager.initialize()
+        assert manager._shards == [["a", "c"], ["b", "d"]]
+        picked = []
+        for _ in range(4):
+            sso = await manager.acquire(wait=0)
+            await manager.record_usage(sso)
+            picked.append(sso)
+        # 轮到的分片用完时依次尝试下一个分片
+        assert await manager.acquire(wait=0) is None
+        status = await manager.get_status()
+        return picked, status
+
+    picked, status = asyncio.run(scenario())
+    assert sorted(picked) == ["a", "b", "c", "d"]
+    assert {picked[0], picked[1]} not in ({"a", "c"}, {"b", "d"})
+    assert status["lock"]["shards"] == 2
+
+
+def test_concurrent_acquires_respect_inflight_cap(redis_manager):
+    first = redis_manager(["a", "b", "c"], strategy="least_used", max_inflight=1)
+    second = redis_manager(strategy="least_used", max_inflight=1)
+
+    async def scenario():
+        # 两个实例共享同一个 Redis，选择与占用在脚本内原子完成
+        picked = await asyncio.gather(
+            first.acquire(wait=0), second.acquire(wait=0), first.acquire(wait=0)
+        )
+        extra = await second.acquire(wait=0)
+        return picked, extra
+
+    picked, extra = asyncio.run(scenario())
+    assert sorted(picked) == ["a", "b", "c"]
+    assert extra is None
@@ -0,0 +1,68 @@
+"""SSO 遥测测试（EWMA 与延迟感知策略）"""
+
+import asyncio
+
+import pytest
+
+from app.services.sso_manager import SSOManager
+from app.services.sso_telemetry import (
+    KeyTelemetry, OUTCOME_BLOCKED, OUTCOME_ERROR, OUTCOME_OK
+)
+
+
+def test_ewma_starts_from_first_sample():
+    telemetry = KeyTelemetry(alpha=0.5, size=1)
+    telemetry.record(0, OUTCOME_OK, first_preview=2.0, final=10.0)
+    telemetry.record(0, OUTCOME_OK, first_preview=4.0, final=20.0)
+
+    assert telemetry.first_preview[0] == 3.0
+    assert telemetry.final[0] == 15.0
+    assert telemetry.pool_final == 15.0
+    assert telemetry.get_key_stats(0)["samples"] == 2
+
+
+def test_outcomes_feed_health():
+    telemetry = KeyTelemetry(alpha=0.5, size=2)
+    telemetry.record(0, OUTCOME_ERROR, final=5.0)
+    telemetry.record(1, OUTCOME_BLOCKED, final=5.0)
+
+    assert telemetry.error_rate[0] == 0.5
+    assert telemetry.blocked_rate[1] == 0.5
+    assert telemetry.health(0) == telemetry.health(1) == 0.5
+
+
+def test_keys_without_samples_are_explored():
+    telemetry = KeyTelemetry(alpha=0.5, size=2)
+    assert telemetry.expected_latency(1) == 1.0
+    assert telemetry.get_key_stats(1) is None
+
+    telemetry.record(0, OUTCOME_OK, final=10.0)
+
+    # 没有样本的 key 按池平均耗时打折估计，得分高于已知的同速 key
+    assert telemetry.expected_latency(1) == pytest.approx(10.0 * KeyTelemetry.EXPLORE_FACTOR)
+    assert telemetry.score(1) > telemetry.score(0)
+
+
+def test_copy_rows_keeps_metrics_of_remaining_keys():
+    old = KeyTelemetry(size=2)
+    old.record(1, OUTCOME_OK, final=3.0)
+
+    new = KeyTelemetry(size=1)
+    new.copy_rows(old, {1: 0})
+
+    assert new.final[0] == 3.0
+    assert new.pool_final == 3.0
+
+
+def test_latency_strategy_prefers_faster_key(sso_file):
+    sso_file(["slow", "fast"])
+    manager = SSOManager(strategy="latency", daily_limit=10)
+    manager.load_sso_list()
+    for _ in range(3):
+        manager.record_telemetry("slow", OUTCOME_OK, final=30.0)
+        manager.record_telemetry("fast", OUTCOME_OK, final=3.0)
+
+    picks = [asyncio.run(manager.get_next_sso()) for _ in range(20)]
+
+    assert picks.count("fast") > picks.count("slow")
+    assert manager.get_status()["keys"][0]["telemetry"]["final_ewma"] > 0
@@ -0,0 +1,127 @@
+"""SSO 列式使用统计存储测试"""
+
+from app.services.sso_breaker import BreakerState
+from app.services.sso_usage_store import (
+    UsageStore, key_hash, list_fingerprint, pack_hashes, snapshot_hashes
+)
+
+
+def make_store(keys, slots=3):
+    store = UsageStore(len(keys), now=1.0, slots=slots)
+    hashes = [key_hash(k) for k in keys]
+    return store, hashes
+
+
+def test_sliding_window_counts_only_recent_uses():
+    store = UsageStore(1, slots=3)
+    for t in (10.0, 20.0, 30.0, 40.0):
+        store.add_use(0, t)
+
+    # 只保留最近 slots 次使用
+    assert store.refresh_count(0, 0.0) == 3
+    assert store.refresh_count(0, 25.0) == 2
+    assert store.last_used[0] == 40.0
+    assert store.next_slot_at(0, 2, 25.0, 100.0) == 130.0
+    assert store.next_slot_at(0, 3, 25.0, 100.0) == 0.0
+
+
+def test_snapshot_round_trip_with_same_list():
+    keys = ["a", "b"]
+    store, hashes = make_store(keys)
+    store.add_use(1, 5.0)
+    store.refresh_count(1, 0.0)
+    store.breaker[0] = BreakerState.OPEN
+    store.trips[0] = 2
+    store.open_until[0] = 99.0
+    data = store.to_bytes(pack_hashes(hashes), list_fingerprint(keys), 7.0, 1)
+
+    restored, _ = make_store(keys)
+    header = restored.load_bytes(data, list_fingerprint(keys), lambda: {})
+
+    assert header == {"last_reset": 7.0, "current_index": 1}
+    assert list(restored.rows()) == list(store.rows())
+    assert snapshot_hashes(data) == hashes
+
+
+def test_snapshot_maps_rows_by_hash_when_list_changes():
+    store, hashes = make_store(["a", "b"])
+    store.add_use(1, 5.0)
+    store.refresh_count(1, 0.0)
+    store.trips[0] = 1
+    data = store.to_bytes(pack_hashes(hashes), list_fingerprint(["a", "b"]), 0.0, 0)
+
+    new_keys = ["c", "b"]
+    restored, new_hashes = make_store(new_keys)
+    restored.load_bytes(
+        data, list_fingerprint(new_keys), lambda: {h: i for i, h in enumerate(new_hashes)}
+    )
+
+    assert list(restored.count) == [0, 1]
+    assert list(restored.trips) == [0, 0]
+    assert restored.refresh_count(1, 0.0) == 1
+
+
+def test_snapshot_with_different_slots_keeps_latest_uses():
+    keys = ["a"]
+    store, hashes = make_store(keys, slots=3)
+    for t in (1.0, 2.0, 3.0):
+        store.add_use(0, t)
+    data = store.to_bytes(pack_hashes(hashes), list_fingerprint(keys), 0.0, 0)
+
+    restored = UsageStore(1, slots=2)
+    restored.load_bytes(data, list_fingerprint(keys), lambda: {})
+
+    assert restored.refresh_count(0, 0.0) == 2
+    assert restored.oldest_use(0, 0.0) == 2.0
+
+
+def test_append_adds_row_for_dedicated_keys():
+    store = UsageStore(slots=2)
+    row = store.append(now=3.0)
+    store.add_use(row, 4.0)
+
+    assert row == 0
+    assert len(store) == 1
+    assert len(store.uses) == 2
+    assert store.first_used[row] == 3.0
+    assert store.refresh_count(row, 0.0) == 1
+
+
+def test_copy_rows_and_summary():
+    old = UsageStore(3, slots=2)
+    old.count[0] = 2
+    old.count[2] = 1
+    old.breaker[1] = BreakerState.OPEN
+
+    new = UsageStore(2, slots=2)
+    new.copy_rows(old, {1: 0, 2: 1})
+
+    assert list(new.count) == [0, 1]
+    assert list(new.breaker) == [BreakerState.OPEN, 0]
+    assert new.remaining(2) == [0, 1]
+    assert old.summary(2) == {
+        "failed": 1, "open": 1, "half_open": 0, "exhausted": 1, "available": 1, "used_today": 3
+    }
+
+
+def test_manager_tracks_dedicated_keys_outside_the_pool(sso_file):
+    import asyncio
+    from app.services.sso_manager import SSOManager
+
+    sso_file(["pool-key"])
+    manager = SSOManager(daily_limit=2)
+    manager.load_sso_list()
+
+    async def scenario():
+        await manager.record_usage("dedicated")
+        assert await manager.filter_available(["dedicated"]) == ["dedicated"]
+        await manager.record_usage("dedicated")
+        assert await manager.filter_available(["dedicated", "unknown"]) == ["unknown"]
+        await manager.mark_failed("unknown", "expired", "unauthorized")
+        assert await manager.filter_available(["unknown"]) == []
+        await manager.mark_success("unknown")
+        assert await manager.filter_available(["unknown"]) == ["unknown"]
+
+    asyncio.run(scenario())
+    assert manager.get_summary()["total_keys"] == 1
+    assert manager.get_summary()["dedicated_keys"] == 2
@@ -0,0 +1,66 @@
+"""多余图片池测试"""
+
+import time
+
+from app.services.surplus_pool import SurplusPool, SurplusImage
+
+
+def images(*names, created_at=None):
+    now = time.time() if created_at is None else created_at
+    return [SurplusImage(filename=name, url=f"/images/{name}", created_at=now) for name in names]
+
+
+def test_take_returns_n_images_in_order():
+    pool = SurplusPool()
+    key = pool.make_key(" cat ", "1:1", False)
+    pool.put(key, images("a", "b", "c"))
+
+    taken = pool.take(pool.make_key("cat", "1:1", False), 2)
+
+    assert [img.filename for img in taken] == ["a", "b"]
+    assert pool.get_stats()["images"] == 1
+
+
+def test_take_does_not_remove_when_short():
+    pool = SurplusPool()
+    key = pool.make_key("cat", "1:1", False)
+    pool.put(key, images("a"))
+
+    assert pool.take(key, 2) == []
+    assert pool.get_stats()["images"] == 1
+    assert pool.get_stats()["misses"] == 1
+
+
+def test_expired_images_are_purged():
+    pool = SurplusPool(ttl=10)
+    key = pool.make_key("cat", "1:1", False)
+    pool.put(key, images("old", created_at=time.time() - 60))
+
+    assert pool.take(key, 1) == []
+    assert pool.get_stats()["expired"] == 1
+
+
+def test_oldest_group_is_evicted_over_capacity():
+    pool = SurplusPool(max_images=2)
+    first = pool.make_key("first", "1:1", False)
+    second = pool.make_key("second", "1:1", False)
+    pool.put(first, images("a", "b"))
+    pool.put(second, images("c"))
+
+    assert pool.take(first, 1) == []
+    assert [img.filename for img in pool.take(second, 1)] == ["c"]
+
+
+def test_give_back_restores_images_and_stats():
+    pool = SurplusPool()
+    key = pool.make_key("cat", "1:1", False)
+    pool.put(key, images("a", "b", "c"))
+    taken = pool.take(key, 2)
+
+    pool.give_back(key, taken[1:], lost=1)
+
+    assert [img.filename for img in pool.take(key, 2)] == ["b", "c"]
+    stats = pool.get_stats()
+    assert stats["served"] == 2
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
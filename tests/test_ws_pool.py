@@ -0,0 +1,198 @@
+"""WebSocket 连接池测试"""
+
+import asyncio
+import json
+
+import aiohttp
+
+from app.services.ws_pool import ImagineWSPool
+
+
+class FakeMessage:
+    def __init__(self, type_, data=None):
+        self.type = type_
+        self.data = data
+
+
+class FakeWS:
+    """按测试投递的帧返回的 WebSocket"""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+        self._frames: asyncio.Queue = asyncio.Queue()
+
+    def push(self, frame):
+        self._frames.put_nowait(FakeMessage(aiohttp.WSMsgType.TEXT, json.dumps(frame)))
+
+    def drop(self):
+        self._frames.put_nowait(FakeMessage(aiohttp.WSMsgType.CLOSED))
+
+    async def receive(self):
+        return await self._frames.get()
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    sockets = []
+
+    async def connect(sso):
+        ws = FakeWS()
+        sockets.append(ws)
+        return ws
+
+    return ImagineWSPool(connect, **kwargs), sockets
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_released_connection_is_reused():
+    async def scenario():
+        pool, sockets = make_pool()
+        stream = await pool.open_stream("sso-a", "r1")
+        await pool.release(stream)
+        again = await pool.open_stream("sso-a", "r2")
+        assert again.conn is stream.conn
+        assert len(sockets) == 1
+        assert pool.get_stats()["reused"] == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_connections_are_kept_per_sso():
+    async def scenario():
+        pool, sockets = make_pool()
+        a = await pool.open_stream("sso-a", "r1")
+        b = await pool.open_stream("sso-b", "r2")
+        assert a.conn is not b.conn
+        assert pool.get_stats()["sso_count"] == 2
+        await pool.close()
+
+    run(scenario())
+
+
+def test_unreusable_release_closes_connection():
+    async def scenario():
+        pool, sockets = make_pool()
+        stream = await pool.open_stream("sso-a", "r1")
+        await pool.release(stream, reusable=False)
+        assert sockets[0].closed
+        assert pool.get_stats()["connections"] == 0
+        await pool.close()
+
+    run(scenario())
+
+
+def test_idle_limit_per_sso():
+    async def scenario():
+        pool, sockets = make_pool(max_idle_per_sso=1)
+        first = await pool.open_stream("sso-a", "r1")
+        second = await pool.open_stream("sso-a", "r2")
+        await pool.release(first)
+        await pool.release(second)
+        assert sum(ws.closed for ws in sockets) == 1
+        assert pool.get_stats()["idle"] == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_reap_evicts_idle_connections():
+    async def scenario():
+        pool, sockets = make_pool(idle_timeout=0)
+        stream = await pool.open_stream("sso-a", "r1")
+        await pool.release(stream)
+        await pool._reap()
+        assert sockets[0].closed
+        assert pool.get_stats()["evicted_idle"] == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_disconnect_ends_stream():
+    async def scenario():
+        pool, sockets = make_pool()
+        stream = await pool.open_stream("sso-a", "r1")
+        sockets[0].drop()
+        assert await asyncio.wait_for(stream.queue.get(), 1) is None
+        assert not stream.conn.is_healthy(pool.max_age)
+        await pool.close()
+
+    run(scenario())
+
+
+def test_single_stream_until_frames_are_tagged():
+    async def scenario():
+        pool, sockets = make_pool(max_streams_per_conn=4)
+        a = await pool.open_stream("sso-a", "A")
+        b = await pool.open_stream("sso-a", "B")
+        assert a.conn is not b.conn
+        await pool.close()
+
+    run(scenario())
+
+
+def test_tagged_frames_enable_multiplexing_and_route_by_request_id():
+    async def scenario():
+        pool, sockets = make_pool(max_streams_per_conn=4)
+        a = await pool.open_stream("sso-a", "A")
+        sockets[0].push({"type": "image", "requestId": "A", "url": "/images/aa.png"})
+        assert (await asyncio.wait_for(a.queue.get(), 1))["requestId"] == "A"
+
+        b = await pool.open_stream("sso-a", "B")
+        assert b.conn is a.conn
+        sockets[0].push({"type": "image", "requestId": "B", "url": "/images/bb.png"})
+        sockets[0].push({"type": "error", "requestId": "A", "err_code": "x"})
+        assert (await asyncio.wait_for(b.queue.get(), 1))["url"] == "/images/bb.png"
+        assert (await asyncio.wait_for(a.queue.get(), 1))["type"] == "error"
+        assert b.queue.empty()
+        await pool.close()
+
+    run(scenario())
+
+
+def test_untagged_frame_with_several_streams_ends_them_all():
+    async def scenario():
+        pool, sockets = make_pool(max_streams_per_conn=4)
+        a = await pool.open_stream("sso-a", "A")
+        sockets[0].push({"type": "image", "requestId": "A", "url": "/images/aa.png"})
+        await asyncio.wait_for(a.queue.get(), 1)
+        b = await pool.open_stream("sso-a", "B")
+
+        sockets[0].push({"type": "image", "url": "/images/cc.png"})
+        assert await asyncio.wait_for(a.queue.get(), 1) is None
+        assert await asyncio.wait_for(b.queue.get(), 1) is None
+        assert a.conn.draining
+        assert a.conn.capacity == 1
+        await pool.close()
+
+    run(scenario())
+
+
+def test_untagged_frames_go_to_the_only_stream():
+    async def scenario():
+        pool, sockets = make_pool(max_streams_per_conn=4)
+        first = await pool.open_stream("sso-a", "A")
+        sockets[0].push({"type": "image", "url": "/images/aa.png"})
+        assert (await asyncio.wait_for(first.queue.get(), 1))["url"] == "/images/aa.png"
+        await pool.release(first)
+
+        # 上一个请求的迟到帧被丢弃，不会交给下一个请求
+        second = await pool.open_stream("sso-a", "B")
+        assert second.conn is first.conn
+        sockets[0].push({"type": "image", "url": "/images/aa.png"})
+        sockets[0].push({"type": "error", "err_code": "x"})
+        assert (await asyncio.wait_for(second.queue.get(), 1))["type"] == "error"
+        assert pool.get_stats()["multiplexing_connections"] == 0
+        await pool.close()
+
+    run(scenario())